@@ -16,10 +16,17 @@ class Settings(BaseSettings):
     ENVIRONMENT: str = Field(default="development", env="ENVIRONMENT")
     DEBUG: bool = Field(default=True, env="DEBUG")
     LOG_LEVEL: str = Field(default="INFO", env="LOG_LEVEL")
+    LOG_FORMAT: str = Field(default="text", env="LOG_FORMAT")  # text, json
+    LOG_DIR: str = Field(default="logs", env="LOG_DIR")
+    LOG_TO_FILE: bool = Field(default=True, env="LOG_TO_FILE")
+    LOG_BACKUP_DAYS: int = Field(default=7, env="LOG_BACKUP_DAYS")
+    LOG_SAMPLE_RATE: float = Field(default=1.0, env="LOG_SAMPLE_RATE")  # fraction of per-image INFO lines kept
+    LOG_QUEUE_SIZE: int = Field(default=10000, env="LOG_QUEUE_SIZE")
     
     # API Keys
     OPENAI_API_KEY: Optional[str] = Field(default=None, env="OPENAI_API_KEY")
     STABILITY_API_KEY: Optional[str] = Field(default=None, env="STABILITY_API_KEY")
+    OPENAI_BASE_URL: Optional[str] = Field(default=None, env="OPENAI_BASE_URL")  # e.g. a proxy or local stub
     
     # File Settings
     MAX_FILE_SIZE: int = Field(default=10 * 1024 * 1024, env="MAX_FILE_SIZE")  # 10MB
@@ -28,17 +35,75 @@ class Settings(BaseSettings):
     PROCESSED_DIR: str = Field(default="processed", env="PROCESSED_DIR")
     TEMP_DIR: str = Field(default="temp", env="TEMP_DIR")
     OUTPUT_DIR: str = Field(default="output", env="OUTPUT_DIR")
+    DOWNLOAD_CACHE_CONTROL: str = Field(default="private, max-age=86400, immutable", env="DOWNLOAD_CACHE_CONTROL")
+    
+    # File Retention
+    FILE_TTL_HOURS: float = Field(default=24, env="FILE_TTL_HOURS")
+    TEMP_FILE_TTL_HOURS: float = Field(default=1, env="TEMP_FILE_TTL_HOURS")
+    UPLOAD_DIR_QUOTA_MB: int = Field(default=1024, env="UPLOAD_DIR_QUOTA_MB")
+    PROCESSED_DIR_QUOTA_MB: int = Field(default=2048, env="PROCESSED_DIR_QUOTA_MB")
+    TEMP_DIR_QUOTA_MB: int = Field(default=512, env="TEMP_DIR_QUOTA_MB")
+    REAPER_INTERVAL_SECONDS: float = Field(default=60, env="REAPER_INTERVAL_SECONDS")
+    REAPER_BATCH_SIZE: int = Field(default=200, env="REAPER_BATCH_SIZE")
+    REAPER_LOCK_FILE: str = Field(default="cache/reaper.lock", env="REAPER_LOCK_FILE")  # one reaper per host holds it, empty = every process reaps
+    REAPER_RESCAN_SECONDS: float = Field(default=300, env="REAPER_RESCAN_SECONDS")  # how often the reaper indexes files other workers wrote
+    REAPER_MIN_AGE_SECONDS: float = Field(default=600, env="REAPER_MIN_AGE_SECONDS")  # younger files are never evicted for quota
     
     # AI Settings
-    AI_PROVIDER: str = Field(default="openai", env="AI_PROVIDER")  # openai, stability, local
+    AI_PROVIDER: str = Field(default="openai", env="AI_PROVIDER")  # openai, fallback (stability, local: not implemented yet)
+    AI_PROVIDERS: list = Field(default=[], env="AI_PROVIDERS")  # candidates for routing, defaults to [AI_PROVIDER]
     IMAGE_SIZE: str = Field(default="1024x1024", env="IMAGE_SIZE")
     QUALITY: str = Field(default="standard", env="QUALITY")  # standard, hd
     STYLE: str = Field(default="natural", env="STYLE")  # natural, vivid
     
+    # Provider Limits
+    PROVIDER_MAX_CONCURRENCY: int = Field(default=4, env="PROVIDER_MAX_CONCURRENCY")
+    PROVIDER_MAX_RETRIES: int = Field(default=2, env="PROVIDER_MAX_RETRIES")
+    PROVIDER_BACKOFF_INITIAL_SECONDS: float = Field(default=1.0, env="PROVIDER_BACKOFF_INITIAL_SECONDS")
+    PROVIDER_BACKOFF_MAX_SECONDS: float = Field(default=60.0, env="PROVIDER_BACKOFF_MAX_SECONDS")
+    PROVIDER_TIMEOUT_SECONDS: float = Field(default=60.0, env="PROVIDER_TIMEOUT_SECONDS")
+    
+    # Provider Routing
+    ROUTER_WINDOW: int = Field(default=50, env="ROUTER_WINDOW")  # calls kept per provider
+    ROUTER_HEDGE_MIN_SECONDS: float = Field(default=2.0, env="ROUTER_HEDGE_MIN_SECONDS")
+    ROUTER_HEDGE_DEFAULT_SECONDS: float = Field(default=20.0, env="ROUTER_HEDGE_DEFAULT_SECONDS")
+    ROUTER_MAX_ERROR_RATE: float = Field(default=0.5, env="ROUTER_MAX_ERROR_RATE")
+    ROUTER_FAILURE_THRESHOLD: int = Field(default=3, env="ROUTER_FAILURE_THRESHOLD")
+    ROUTER_CIRCUIT_COOLDOWN_SECONDS: float = Field(default=30.0, env="ROUTER_CIRCUIT_COOLDOWN_SECONDS")
+    
     # Processing Settings
-    DETECTION_CONFIDENCE: float = Field(default=0.7, env="DETECTION_CONFIDENCE")
+    DETECTION_CONFIDENCE: float = Field(default=0.7, env="DETECTION_CONFIDENCE")  # candidates scoring lower are dropped before generation
+    NO_WINDOWS_ACTION: str = Field(default="strip", env="NO_WINDOWS_ACTION")  # strip, ask, full
     BLEND_MODE: str = Field(default="seamless", env="BLEND_MODE")  # seamless, overlay
     PRESERVE_ASPECT_RATIO: bool = Field(default=True, env="PRESERVE_ASPECT_RATIO")
+    HARMONIZE_STRENGTH: float = Field(default=0.7, env="HARMONIZE_STRENGTH")  # 0 pastes decoys as is, 1 fully matches the window's lighting
+    HARMONIZE_SAMPLE_EDGE: int = Field(default=64, env="HARMONIZE_SAMPLE_EDGE")  # long edge of the samples lighting is measured on
+    DECODER_BACKENDS: list = Field(default=["turbojpeg", "opencv", "pillow"], env="DECODER_BACKENDS")  # tried in order per format; missing ones are skipped
+    
+    # Animations and Short Videos
+    VIDEO_EXTENSIONS: list = Field(default=[".mp4", ".mov", ".webm"], env="VIDEO_EXTENSIONS")
+    MAX_CLIP_FRAMES: int = Field(default=300, env="MAX_CLIP_FRAMES")  # longer clips are truncated
+    CLIP_KEYFRAME_INTERVAL: int = Field(default=30, env="CLIP_KEYFRAME_INTERVAL")  # frames between forced re-detections
+    CLIP_QUEUE_FRAMES: int = Field(default=8, env="CLIP_QUEUE_FRAMES")  # frames buffered between pipeline stages
+    
+    # Preview Mode
+    PREVIEW_MAX_EDGE: int = Field(default=640, env="PREVIEW_MAX_EDGE")  # long edge of previews in pixels
+    PREVIEW_WEBP_QUALITY: int = Field(default=75, env="PREVIEW_WEBP_QUALITY")
+    PREVIEW_TTL_SECONDS: float = Field(default=1800, env="PREVIEW_TTL_SECONDS")  # how long a preview can be rendered
+    
+    # Decoy Library (local backgrounds instead of generating one per request)
+    DECOY_LIBRARY_DIR: Optional[str] = Field(default=None, env="DECOY_LIBRARY_DIR")  # images in scene subdirectories; unset disables
+    DECOY_INDEX_DIR: str = Field(default="cache/decoys", env="DECOY_INDEX_DIR")  # persisted descriptors and thumbnails
+    DECOY_RESCAN_SECONDS: float = Field(default=300, env="DECOY_RESCAN_SECONDS")  # how often new library files are picked up
+    
+    # Editing Sessions
+    SESSION_MAX_MB: int = Field(default=512, env="SESSION_MAX_MB")  # decoded sessions kept in memory per worker
+    SESSION_TTL_SECONDS: float = Field(default=900, env="SESSION_TTL_SECONDS")  # idle time before a session expires
+    SESSION_MAX_BACKGROUNDS: int = Field(default=4, env="SESSION_MAX_BACKGROUNDS")  # candidate backgrounds per session
+    
+    # Output Variants
+    VARIANT_SIZES: list = Field(default=[2048, 1080, 640], env="VARIANT_SIZES")  # long edge in pixels
+    VARIANT_JPEG_QUALITY: int = Field(default=85, env="VARIANT_JPEG_QUALITY")
     
     # Security
     SECRET_KEY: str = Field(default="your-secret-key-change-in-production", env="SECRET_KEY")
@@ -46,6 +111,50 @@ class Settings(BaseSettings):
     
     # Rate Limiting
     RATE_LIMIT_PER_MINUTE: int = Field(default=10, env="RATE_LIMIT_PER_MINUTE")
+    RATE_LIMIT_BURST: int = Field(default=5, env="RATE_LIMIT_BURST")
+    TRUST_PROXY_HEADERS: bool = Field(default=False, env="TRUST_PROXY_HEADERS")
+    
+    # Admission Control
+    MAX_CONCURRENT_JOBS: int = Field(default=4, env="MAX_CONCURRENT_JOBS")
+    MAX_QUEUED_JOBS: int = Field(default=16, env="MAX_QUEUED_JOBS")
+    QUEUE_TIMEOUT_SECONDS: float = Field(default=30, env="QUEUE_TIMEOUT_SECONDS")
+    ADMISSION_PATHS: list = Field(default=["/api/process", "/api/render", "/api/sessions"], env="ADMISSION_PATHS")  # prefixes, sub-routes included
+    WORKER_THREADS: int = Field(default=0, env="WORKER_THREADS")  # thread pool for blocking work, 0 = native threads + 4
+    
+    # Thread Budget (cores divided among WEB_CONCURRENCY workers)
+    CPU_LIMIT: float = Field(default=0, env="CPU_LIMIT")  # cores the deployment may use, 0 = cgroup quota or CPU affinity
+    NATIVE_THREADS: int = Field(default=0, env="NATIVE_THREADS")  # OpenCV/BLAS threads per worker, 0 = cores / workers
+    
+    # Request Deadlines
+    REQUEST_TIMEOUT_SECONDS: float = Field(default=120, env="REQUEST_TIMEOUT_SECONDS")  # from arrival; clients may ask for less, 0 = none
+    DEADLINE_RESERVE_SECONDS: float = Field(default=2.0, env="DEADLINE_RESERVE_SECONDS")  # kept back from the provider call for blending and saving
+    DEADLINE_MIN_PROVIDER_SECONDS: float = Field(default=3.0, env="DEADLINE_MIN_PROVIDER_SECONDS")  # with less left, use a cached or fallback background
+    
+    # Quality Tiers (cheaper results under load)
+    QUALITY_TIER: str = Field(default="auto", env="QUALITY_TIER")  # auto, or always full, reduced or minimal
+    QUALITY_REDUCED_LOAD: float = Field(default=1.5, env="QUALITY_REDUCED_LOAD")  # (in flight + waiting) / MAX_CONCURRENT_JOBS, 0 = ignore
+    QUALITY_MINIMAL_LOAD: float = Field(default=3.0, env="QUALITY_MINIMAL_LOAD")
+    QUALITY_REDUCED_LATENCY_SECONDS: float = Field(default=30, env="QUALITY_REDUCED_LATENCY_SECONDS")  # mean over the last minute, 0 = ignore
+    QUALITY_MINIMAL_LATENCY_SECONDS: float = Field(default=60, env="QUALITY_MINIMAL_LATENCY_SECONDS")
+    QUALITY_RECOVERY: float = Field(default=0.8, env="QUALITY_RECOVERY")  # climb back once signals are below this fraction of the thresholds
+    QUALITY_MINIMAL_MAX_EDGE: int = Field(default=1600, env="QUALITY_MINIMAL_MAX_EDGE")  # long-edge cap of the minimal tier
+    
+    # Shared Cache (visible to every worker)
+    SHARED_CACHE_BACKEND: str = Field(default="auto", env="SHARED_CACHE_BACKEND")  # auto (redis if REDIS_URL, else sqlite), sqlite, redis, memory
+    SHARED_CACHE_PATH: str = Field(default="cache/geomask.sqlite3", env="SHARED_CACHE_PATH")
+    SHARED_CACHE_MAX_MB: int = Field(default=256, env="SHARED_CACHE_MAX_MB")
+    BACKGROUND_CACHE_TTL_SECONDS: float = Field(default=3600, env="BACKGROUND_CACHE_TTL_SECONDS")  # 0 disables reuse
+    DETECTION_CACHE_TTL_SECONDS: float = Field(default=86400, env="DETECTION_CACHE_TTL_SECONDS")
+    
+    # Profiling
+    PROFILING_ENABLED: bool = Field(default=False, env="PROFILING_ENABLED")
+    PROFILE_SAMPLE_RATE: float = Field(default=0.01, env="PROFILE_SAMPLE_RATE")  # fraction profiled from the start
+    PROFILE_SLOW_SECONDS: float = Field(default=10.0, env="PROFILE_SLOW_SECONDS")  # start profiling once exceeded
+    PROFILE_INTERVAL_MS: float = Field(default=10.0, env="PROFILE_INTERVAL_MS")
+    PROFILE_DIR: str = Field(default="profiles", env="PROFILE_DIR")
+    PROFILE_MAX_FILES: int = Field(default=50, env="PROFILE_MAX_FILES")
+    PROFILE_PATHS: list = Field(default=["/api/process", "/api/render"], env="PROFILE_PATHS")
+    ADMIN_TOKEN: Optional[str] = Field(default=None, env="ADMIN_TOKEN")  # admin endpoints are disabled without it
     
     # CORS
     ALLOWED_ORIGINS: list = Field(
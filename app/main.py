@@ -3,34 +3,86 @@ Main FastAPI application for GeoMask
 """
 
 import os
-import logging
+import secrets
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 from pathlib import Path
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from typing import TYPE_CHECKING, Literal, Optional
+from fastapi import Depends, FastAPI, HTTPException, Request, UploadFile, File, Form, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+import anyio
 import uvicorn
 
 from app.config import settings
-from app.services.image_processor import ImageProcessor
-from app.services.ai_generator import AIGenerator
-from app.models.schemas import ProcessRequest, ProcessResponse
-from app.utils.file_utils import save_upload_file, cleanup_temp_files
-from app.utils.logger import setup_logger
+from app.utils.threads import thread_budget
+
+# BLAS and OpenMP read their thread counts when they load, which the imports below do
+thread_budget.apply_env()
+
+from app.services.admission import AdmissionMiddleware  # noqa: E402
+from app.services.container import ServiceContainer  # noqa: E402
+from app.services.jobs import is_valid_job_id  # noqa: E402
+from app.services.previews import PreviewExpired  # noqa: E402
+from app.services.sessions import EditSession, SessionExpired  # noqa: E402
+from app.models.schemas import (  # noqa: E402
+    ProcessResponse, ProcessingStatus, RecompositeRequest, SessionResponse
+)
+from app.utils.deadlines import (  # noqa: E402
+    ClientDisconnected, Deadline, DeadlineExceeded, deadline_scope, run_until_disconnected
+)
+from app.utils.file_utils import UploadRejected, UploadGuardMiddleware, save_upload_file  # noqa: E402
+from app.utils.http_utils import IndexedFileResponse  # noqa: E402
+from app.utils.logger import SAMPLED, setup_logger  # noqa: E402
+from app.utils.profiling import ProfilingMiddleware, profile_store  # noqa: E402
+from app.utils.metrics import (  # noqa: E402
+    PROCESS_SECONDS, StageTimings, collect_timings, register_service_stats, render_metrics, stage_timer
+)
+
+if TYPE_CHECKING:
+    from app.services.image_processor import ProcessResult
 
 # Setup logging
 logger = setup_logger(__name__)
 
+# App-scoped services, started and stopped by the lifespan below
+services = ServiceContainer()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start services on startup and shut them down deterministically"""
+    logger.info("Starting GeoMask application...")
+    await app.state.services.start()
+    try:
+        yield
+    finally:
+        logger.info("Shutting down GeoMask application...")
+        await app.state.services.aclose()
+
 # Create FastAPI app
 app = FastAPI(
+    lifespan=lifespan,
     title="GeoMask",
     description="Protect your privacy from AI-powered GeoGuessr tools",
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc"
 )
+app.state.services = services
+
+# Profiles sampled and slow requests (innermost, so it times admitted work only)
+app.add_middleware(ProfilingMiddleware)
+
+# Rate limiting and queueing, checked before the upload body is read
+app.add_middleware(AdmissionMiddleware)
+
+# Oversized upload bodies get 413, and non-image files 400, before multipart parsing finishes
+app.add_middleware(UploadGuardMiddleware)
 
-# Add CORS middleware
+# Add CORS middleware (outermost, so rejections still carry CORS headers)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Configure appropriately for production
@@ -46,25 +98,19 @@ for directory in ["uploads", "processed", "output", "temp", "logs"]:
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Initialize services
-image_processor = ImageProcessor()
-ai_generator = AIGenerator()
-
-@app.on_event("startup")
-async def startup_event():
-    """Initialize services on startup"""
-    logger.info("Starting GeoMask application...")
-    try:
-        await ai_generator.initialize()
-        logger.info("AI Generator initialized successfully")
-    except Exception as e:
-        logger.error(f"Failed to initialize AI Generator: {e}")
+# Export queue depths, reaper backlog and provider health on /metrics
+register_service_stats(
+    admission=services.admission,
+    reaper=services.reaper,
+    gateway=services.gateway,
+    router=services.router,
+    sessions=services.sessions,
+    quality=services.quality
+)
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Cleanup on shutdown"""
-    logger.info("Shutting down GeoMask application...")
-    cleanup_temp_files()
+def get_services(request: Request) -> ServiceContainer:
+    """Dependency returning the app's service container"""
+    return request.app.state.services
 
 @app.get("/")
 async def root():
@@ -80,62 +126,376 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "service": "geomask"}
 
+@app.get("/ready")
+async def readiness_check(services: ServiceContainer = Depends(get_services)):
+    """Readiness endpoint: 503 until services have finished warming up"""
+    if not services.ready:
+        return JSONResponse({"status": "starting", "service": "geomask"}, status_code=503)
+    return {"status": "ready", "service": "geomask", "providers": services.ai_generator.providers or ["fallback"]}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics endpoint"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+def request_deadline(request: Request, timeout: Optional[float]) -> Optional[Deadline]:
+    """
+    Deadline for a request, counted from its arrival at admission control
+    
+    Args:
+        request: Incoming request
+        timeout: Client-supplied limit in seconds, capped at REQUEST_TIMEOUT_SECONDS
+    
+    Returns:
+        The deadline, or None when neither the client nor the server sets one
+    """
+    limits = [limit for limit in (timeout, settings.REQUEST_TIMEOUT_SECONDS) if limit]
+    if not limits:
+        return None
+    return Deadline.after(min(limits), start=getattr(request.state, "arrived", None))
+
 @app.post("/api/process", response_model=ProcessResponse)
 async def process_image(
+    request: Request,
     file: UploadFile = File(...),
     scene_type: str = Form("random"),
-    custom_prompt: str = Form("")
+    custom_prompt: str = Form(""),
+    variants: bool = Form(False),
+    include_timings: bool = Form(False),
+    preview: bool = Form(False),
+    no_windows: Optional[Literal["strip", "ask", "full"]] = Form(None),
+    timeout: Optional[float] = Form(None, gt=0),
+    services: ServiceContainer = Depends(get_services)
 ):
     """
     Process an uploaded image to replace background with decoy scene
+    
+    The job_id is generated here, so one client can't read or overwrite
+    another's job; error responses carry it in X-Job-ID for polling
+    /api/jobs/{job_id} (from any worker). With preview=true a small WebP is returned instead; POST its job_id to
+    /api/render for the full-resolution result. no_windows overrides
+    NO_WINDOWS_ACTION for images without confident window regions.
+    timeout (seconds, capped at REQUEST_TIMEOUT_SECONDS) bounds the whole
+    request; processing stops when it passes or the client disconnects.
+    Under load the result is produced at a cheaper quality tier, reported
+    as quality_tier.
     """
+    start_time = time.perf_counter()
+    arrived = getattr(request.state, "arrived", time.monotonic())
+    job_id = uuid.uuid4().hex
+    created_at = datetime.now(timezone.utc)
+    
     try:
-        # Validate file
-        if not file.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="File must be an image")
-        
-        if file.size > settings.MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"File size must be less than {settings.MAX_FILE_SIZE} bytes"
-            )
+        await services.jobs.update(job_id, "processing", created_at)
         
-        # Save uploaded file
-        file_path = await save_upload_file(file)
-        logger.info(f"File uploaded: {file_path}")
+        with collect_timings() as timings:
+            # Validate and save the upload in one pass
+            with stage_timer("upload"):
+                upload = await save_upload_file(file)
+            logger.info(f"File uploaded: {upload.path}", extra=SAMPLED)
+            
+            # Process image, at a quality tier suiting the current load
+            tier = services.quality.choose()
+            if preview:
+                work = services.image_processor.preview_image(
+                    upload.path, 
+                    job_id, 
+                    scene_type, 
+                    custom_prompt, 
+                    original_file=file.filename, 
+                    no_windows=no_windows, 
+                    tier=tier
+                )
+            else:
+                work = services.image_processor.process_image(
+                    upload.path, 
+                    scene_type, 
+                    custom_prompt,
+                    variant_sizes=settings.VARIANT_SIZES if variants else None,
+                    digest=upload.sha256,
+                    no_windows=no_windows, 
+                    tier=tier
+                )
+            with deadline_scope(request_deadline(request, timeout)):
+                result = await run_until_disconnected(request, work)
         
-        # Process image
-        processed_path = await image_processor.process_image(
-            file_path, 
-            scene_type, 
-            custom_prompt
+        response = build_process_response(
+            result, file.filename, start_time, timings if include_timings else None, job_id, preview
         )
-        
-        # Generate response
-        return ProcessResponse(
-            success=True,
-            original_file=file.filename,
-            processed_file=os.path.basename(processed_path),
-            download_url=f"/api/download/{os.path.basename(processed_path)}"
+        services.quality.observe(time.monotonic() - arrived)
+        await services.jobs.update(
+            job_id, "completed", created_at, progress=100.0, result=response.model_dump()
         )
-        
+        return response
+    
+    except UploadRejected as e:
+        await services.jobs.update(job_id, "failed", created_at, error=str(e))
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"X-Job-ID": job_id})
+    
+    except (DeadlineExceeded, ClientDisconnected) as e:
+        raise await abandon_job(services, job_id, created_at, e)
+    
     except Exception as e:
         logger.error(f"Error processing image: {e}")
+        await services.jobs.update(job_id, "failed", created_at, error=str(e))
+        raise HTTPException(status_code=500, detail=str(e), headers={"X-Job-ID": job_id})
+
+@app.post("/api/render", response_model=ProcessResponse)
+async def render_preview(
+    request: Request,
+    job_id: str = Form(...),
+    variants: bool = Form(False),
+    include_timings: bool = Form(False),
+    timeout: Optional[float] = Form(None, gt=0),
+    services: ServiceContainer = Depends(get_services)
+):
+    """Render a preview at full resolution, reusing its background and regions"""
+    start_time = time.perf_counter()
+    arrived = getattr(request.state, "arrived", time.monotonic())
+    if not is_valid_job_id(job_id):
+        raise HTTPException(status_code=400, detail="job_id must be 8-64 letters, digits, '-' or '_'")
+    created_at = datetime.now(timezone.utc)
+    
+    try:
+        await services.jobs.update(job_id, "processing", created_at)
+        
+        with collect_timings() as timings, deadline_scope(request_deadline(request, timeout)):
+            result = await run_until_disconnected(request, services.image_processor.render_preview(
+                job_id, 
+                variant_sizes=settings.VARIANT_SIZES if variants else None, 
+                tier=services.quality.choose()
+            ))
+        
+        response = build_process_response(
+            result, result.original_file, start_time, timings if include_timings else None, job_id
+        )
+        services.quality.observe(time.monotonic() - arrived)
+        await services.jobs.update(
+            job_id, "completed", created_at, progress=100.0, result=response.model_dump()
+        )
+        return response
+    
+    except PreviewExpired:
+        await services.jobs.update(job_id, "failed", created_at, error="Preview not found or expired")
+        raise HTTPException(status_code=404, detail="Preview not found or expired")
+    
+    except (DeadlineExceeded, ClientDisconnected) as e:
+        raise await abandon_job(services, job_id, created_at, e)
+    
+    except Exception as e:
+        logger.error(f"Error rendering preview: {e}")
+        await services.jobs.update(job_id, "failed", created_at, error=str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
+async def abandon_job(
+    services: ServiceContainer, job_id: str, created_at: datetime, reason: Exception
+) -> HTTPException:
+    """
+    Mark a job whose processing was abandoned as failed
+    
+    Returns:
+        504 for a passed deadline, or 499 (client closed request) for a
+        disconnect, which nobody will read but which access logs record
+    """
+    if isinstance(reason, ClientDisconnected):
+        await services.jobs.update(job_id, "failed", created_at, error="Client disconnected")
+        return HTTPException(status_code=499, detail="Client disconnected", headers={"X-Job-ID": job_id})
+    
+    await services.jobs.update(job_id, "failed", created_at, error="Request deadline exceeded")
+    return HTTPException(status_code=504, detail="Request deadline exceeded", headers={"X-Job-ID": job_id})
+
+def build_process_response(
+    result: "ProcessResult",
+    original_file: Optional[str],
+    start_time: float,
+    timings: Optional[StageTimings],
+    job_id: str,
+    preview: bool = False
+) -> ProcessResponse:
+    """Build the response for a processed, previewed or rendered image"""
+    processed_path = result.output_path
+    
+    processing_time = time.perf_counter() - start_time
+    PROCESS_SECONDS.observe(processing_time)
+    
+    return ProcessResponse(
+        success=True,
+        original_file=original_file or os.path.basename(processed_path),
+        processed_file=os.path.basename(processed_path),
+        download_url=f"/api/download/{os.path.basename(processed_path)}",
+        variants={
+            str(size): f"/api/download/{os.path.basename(path)}"
+            for size, path in result.variants.items()
+        } or None,
+        processing_time=round(processing_time, 4),
+        timings=timings.as_dict() if timings is not None else None,
+        job_id=job_id,
+        preview=preview,
+        windows=result.windows,
+        confirmation_required=result.confirmation_required,
+        quality_tier=result.tier,
+        message=(
+            "No windows detected; the image was returned unchanged. "
+            "Resubmit with no_windows=full to blend the whole frame."
+        ) if result.confirmation_required else None
+    )
+
+@app.post("/api/sessions", response_model=SessionResponse)
+async def create_session(
+    file: UploadFile = File(...),
+    scene_type: str = Form("random"),
+    custom_prompt: str = Form(""),
+    include_timings: bool = Form(False),
+    services: ServiceContainer = Depends(get_services)
+):
+    """
+    Start an editing session: the upload is decoded, detected and composited once
+    
+    Later edits (/api/sessions/{session_id}/recomposite) only re-blend the
+    affected regions of the kept original.
+    """
+    start_time = time.perf_counter()
+    
+    try:
+        with collect_timings() as timings:
+            with stage_timer("upload"):
+                upload = await save_upload_file(file)
+            session = await services.image_processor.open_session(
+                upload.path, 
+                uuid.uuid4().hex, 
+                scene_type, 
+                custom_prompt, 
+                original_file=file.filename, 
+                digest=upload.sha256
+            )
+        return build_session_response(session, start_time, timings if include_timings else None)
+    
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    
+    except Exception as e:
+        logger.error(f"Error creating session: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def load_session(session_id: str, services: ServiceContainer) -> EditSession:
+    """Fetch a session for an endpoint, 404 if it is unknown or expired"""
+    try:
+        if not is_valid_job_id(session_id):
+            raise SessionExpired(session_id)
+        return await services.image_processor.get_session(session_id)
+    except SessionExpired:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+
+@app.get("/api/sessions/{session_id}", response_model=SessionResponse)
+async def get_session(session_id: str, services: ServiceContainer = Depends(get_services)):
+    """Current state of an editing session"""
+    return build_session_response(await load_session(session_id, services))
+
+@app.post("/api/sessions/{session_id}/backgrounds", response_model=SessionResponse)
+async def add_session_background(
+    session_id: str,
+    scene_type: str = Form("random"),
+    custom_prompt: str = Form(""),
+    services: ServiceContainer = Depends(get_services)
+):
+    """Generate another candidate background; assign it with a recomposite"""
+    start_time = time.perf_counter()
+    session = await load_session(session_id, services)
+    if len(session.backgrounds) >= settings.SESSION_MAX_BACKGROUNDS:
+        raise HTTPException(status_code=409, detail=f"Sessions are limited to {settings.SESSION_MAX_BACKGROUNDS} backgrounds")
+    
+    try:
+        await services.image_processor.add_session_background(session, scene_type, custom_prompt)
+    except Exception as e:
+        logger.error(f"Error adding session background: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return build_session_response(session, start_time)
+
+@app.post("/api/sessions/{session_id}/recomposite", response_model=SessionResponse)
+async def recomposite_session(
+    session_id: str,
+    edit: RecompositeRequest,
+    include_timings: bool = False,
+    services: ServiceContainer = Depends(get_services)
+):
+    """Change the blend or background of a session, re-blending only the affected regions"""
+    start_time = time.perf_counter()
+    session = await load_session(session_id, services)
+    
+    try:
+        with collect_timings() as timings:
+            updated = await services.image_processor.recomposite(
+                session, 
+                feather=edit.feather, 
+                blend_mode=edit.blend_mode, 
+                background=edit.background, 
+                regions=edit.regions, 
+                preview=edit.preview
+            )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error recompositing session: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return build_session_response(session, start_time, timings if include_timings else None, updated)
+
+@app.delete("/api/sessions/{session_id}")
+async def delete_session(session_id: str, services: ServiceContainer = Depends(get_services)):
+    """End an editing session and free its memory"""
+    try:
+        if not is_valid_job_id(session_id):
+            raise SessionExpired(session_id)
+        record = await services.sessions.load(session_id)
+    except SessionExpired:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    await services.sessions.delete(session_id, len(record["scenes"]))
+    return {"message": "Session deleted"}
+
+def build_session_response(
+    session: EditSession,
+    start_time: Optional[float] = None,
+    timings: Optional[StageTimings] = None,
+    updated_regions: Optional[list] = None
+) -> SessionResponse:
+    """Build the response describing an editing session"""
+    return SessionResponse(
+        session_id=session.session_id,
+        original_file=session.original_file,
+        download_url=f"/api/download/{os.path.basename(session.output_path)}" if session.output_path else None,
+        regions=[list(region) for region in session.regions],
+        backgrounds=session.scenes,
+        assignments=session.assignments,
+        feather=session.feather,
+        blend_mode=session.blend_mode,
+        revision=session.revision,
+        updated_regions=updated_regions,
+        processing_time=round(time.perf_counter() - start_time, 4) if start_time is not None else None,
+        timings=timings.as_dict() if timings is not None else None
+    )
+
+@app.get("/api/jobs/{job_id}", response_model=ProcessingStatus)
+async def get_job(job_id: str, services: ServiceContainer = Depends(get_services)):
+    """Status and result of a processing job, from whichever worker ran it"""
+    record = await services.jobs.get(job_id) if is_valid_job_id(job_id) else None
+    if record is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return record
+
 @app.get("/api/download/{filename}")
-async def download_processed_image(filename: str):
+async def download_processed_image(
+    filename: str,
+    request: Request,
+    services: ServiceContainer = Depends(get_services)
+):
     """Download processed image"""
-    file_path = Path("processed") / filename
+    metadata = await services.index.aget(filename)
     
-    if not file_path.exists():
+    if metadata is None:
         raise HTTPException(status_code=404, detail="File not found")
     
-    return FileResponse(
-        path=file_path,
-        filename=filename,
-        media_type="image/jpeg"
-    )
+    services.reaper.touch(metadata.path)
+    return IndexedFileResponse(request, metadata, services.index, filename)
 
 @app.get("/api/scenes")
 async def get_available_scenes():
@@ -152,16 +512,43 @@ async def get_available_scenes():
         ]
     }
 
+@app.get("/api/cleanup/stats")
+async def cleanup_stats(services: ServiceContainer = Depends(get_services)):
+    """Get file reaper statistics"""
+    return services.reaper.stats()
+
 @app.delete("/api/cleanup")
-async def cleanup_files():
+async def cleanup_files(services: ServiceContainer = Depends(get_services)):
     """Clean up temporary files"""
     try:
-        cleanup_temp_files()
-        return {"message": "Cleanup completed successfully"}
+        deleted = await services.reaper.run_once()
+        return {"message": "Cleanup completed successfully", "deleted": deleted}
     except Exception as e:
         logger.error(f"Error during cleanup: {e}")
         raise HTTPException(status_code=500, detail="Cleanup failed")
 
+def require_admin(token: Optional[str]):
+    """Reject admin requests without the configured ADMIN_TOKEN"""
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    if token is None or not secrets.compare_digest(token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/api/admin/profiles")
+async def list_profiles(x_admin_token: Optional[str] = Header(None)):
+    """List recently saved request profiles"""
+    require_admin(x_admin_token)
+    return {"profiles": await anyio.to_thread.run_sync(profile_store.list)}
+
+@app.get("/api/admin/profiles/{name}")
+async def get_profile(name: str, x_admin_token: Optional[str] = Header(None)):
+    """Download a profile as collapsed stacks (flamegraph.pl / speedscope input)"""
+    require_admin(x_admin_token)
+    path = profile_store.path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(await anyio.to_thread.run_sync(path.read_text))
+
 if __name__ == "__main__":
     uvicorn.run(
         "app.main:app",
@@ -2,7 +2,7 @@
 Pydantic schemas for GeoMask API
 """
 
-from typing import Optional, List
+from typing import Optional, List, Dict, Literal
 from pydantic import BaseModel, Field
 from datetime import datetime
 
@@ -21,10 +21,42 @@ class ProcessResponse(BaseModel):
     original_file: str = Field(description="Original filename")
     processed_file: str = Field(description="Processed filename")
     download_url: str = Field(description="URL to download processed image")
+    variants: Optional[Dict[str, str]] = Field(default=None, description="Download URLs of resized variants keyed by long-edge size")
     processing_time: Optional[float] = Field(default=None, description="Processing time in seconds")
+    timings: Optional[Dict[str, float]] = Field(default=None, description="Seconds spent per processing stage")
+    job_id: Optional[str] = Field(default=None, description="Job ID, pollable at /api/jobs/{job_id} from any worker")
+    preview: bool = Field(default=False, description="Reduced-size preview; POST the job_id to /api/render for full resolution")
+    windows: Optional[int] = Field(default=None, description="Window regions replaced; 0 means the image was returned unchanged with its metadata stripped")
+    confirmation_required: bool = Field(default=False, description="No windows were found and no_windows=ask; resubmit with no_windows=full to blend the whole frame")
+    quality_tier: str = Field(default="full", description="Quality tier the result was produced at under the load at the time: full, reduced or minimal")
     message: Optional[str] = Field(default=None, description="Additional message")
 
 
+class RecompositeRequest(BaseModel):
+    """Request model for editing a session's composite"""
+    feather: Optional[int] = Field(default=None, ge=0, le=255, description="Blend mask blur in pixels")
+    blend_mode: Optional[Literal["radial", "replace"]] = Field(default=None, description="Fade towards the corners, or replace all but a feathered border")
+    background: Optional[int] = Field(default=None, ge=0, description="Index of the background to show")
+    regions: Optional[List[int]] = Field(default=None, description="Indices of the regions to show it in (default: all)")
+    preview: bool = Field(default=False, description="Return a reduced-size WebP instead of a full-size JPEG")
+
+
+class SessionResponse(BaseModel):
+    """Response model for an editing session"""
+    session_id: str = Field(description="Session ID")
+    original_file: Optional[str] = Field(default=None, description="Original filename")
+    download_url: Optional[str] = Field(default=None, description="URL to download the latest composite")
+    regions: List[List[int]] = Field(description="Window regions as [x, y, width, height]")
+    backgrounds: List[Dict[str, str]] = Field(description="Candidate backgrounds, by index")
+    assignments: List[int] = Field(description="Background index shown in each region")
+    feather: int = Field(description="Blend mask blur in pixels")
+    blend_mode: str = Field(description="Blend mode")
+    revision: int = Field(description="Incremented by every edit")
+    updated_regions: Optional[List[int]] = Field(default=None, description="Regions re-blended by this edit")
+    processing_time: Optional[float] = Field(default=None, description="Processing time in seconds")
+    timings: Optional[Dict[str, float]] = Field(default=None, description="Seconds spent per processing stage")
+
+
 class SceneInfo(BaseModel):
     """Scene information model"""
     id: str = Field(description="Scene identifier")
@@ -67,4 +99,6 @@ class ProcessingStatus(BaseModel):
     status: str = Field(description="Processing status")
     progress: float = Field(default=0.0, description="Processing progress (0-100)")
     estimated_time: Optional[float] = Field(default=None, description="Estimated completion time")
-    created_at: datetime = Field(default_factory=datetime.utcnow, description="Job creation time") 
\ No newline at end of file
+    created_at: datetime = Field(default_factory=datetime.utcnow, description="Job creation time")
+    result: Optional[ProcessResponse] = Field(default=None, description="Processing result once completed")
+    error: Optional[str] = Field(default=None, description="Error message if the job failed") 
\ No newline at end of file
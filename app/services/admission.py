@@ -0,0 +1,289 @@
+"""
+Rate limiting and admission control for GeoMask
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import settings
+from app.utils.file_utils import path_matches
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+MAX_TRACKED_CLIENTS = 10000
+REDIS_RETRY_SECONDS = 30
+
+# Token bucket in Redis: KEYS[1] = bucket, ARGV = capacity, rate/s, now, ttl(ms)
+REDIS_TOKEN_BUCKET = """
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], ARGV[4])
+return {allowed, tostring(tokens)}
+"""
+
+
+@dataclass
+class RateLimitResult:
+    """Outcome of a rate limit check"""
+    allowed: bool
+    remaining: int
+    retry_after: float
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously"""
+    
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    
+    def take(self, now: Optional[float] = None) -> RateLimitResult:
+        """Try to take a single token"""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return RateLimitResult(True, int(self.tokens), 0.0)
+        
+        return RateLimitResult(False, 0, (1 - self.tokens) / self.rate)
+
+
+class MemoryRateLimiter:
+    """Per-client token buckets kept in process memory"""
+    
+    def __init__(self, per_minute: int, burst: int):
+        self.capacity = max(1, burst)
+        self.rate = per_minute / 60.0
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+    
+    async def hit(self, key: str) -> RateLimitResult:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.capacity, self.rate)
+            self._buckets[key] = bucket
+            if len(self._buckets) > MAX_TRACKED_CLIENTS:
+                # Oldest clients have long since refilled
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        
+        return bucket.take()
+
+
+class RedisRateLimiter:
+    """Per-client token buckets shared across workers through Redis"""
+    
+    def __init__(self, redis_url: str, per_minute: int, burst: int):
+        import redis.asyncio as redis
+        
+        self.client = redis.from_url(redis_url)
+        self.script = self.client.register_script(REDIS_TOKEN_BUCKET)
+        self.capacity = max(1, burst)
+        self.rate = per_minute / 60.0
+        self.ttl_ms = int(math.ceil(self.capacity / self.rate * 1000)) if self.rate else 60000
+        
+        # While Redis is down each worker enforces its share of the limit
+        workers = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+        self.fallback = MemoryRateLimiter(max(1, per_minute // workers), burst)
+        self.down_until = 0.0
+    
+    async def hit(self, key: str) -> RateLimitResult:
+        if time.monotonic() < self.down_until:
+            return await self.fallback.hit(key)
+        
+        try:
+            allowed, tokens = await self.script(
+                keys=[f"geomask:ratelimit:{key}"],
+                args=[self.capacity, self.rate, time.time(), self.ttl_ms]
+            )
+        except Exception as e:
+            # Skip Redis for a while instead of failing (and logging) per request
+            self.down_until = time.monotonic() + REDIS_RETRY_SECONDS
+            logger.warning(
+                f"Redis rate limiter unavailable, using per-worker limits for {REDIS_RETRY_SECONDS}s: {e}"
+            )
+            return await self.fallback.hit(key)
+        
+        tokens = float(tokens)
+        if int(allowed):
+            return RateLimitResult(True, int(tokens), 0.0)
+        return RateLimitResult(False, 0, (1 - tokens) / self.rate)
+
+
+class Overloaded(Exception):
+    """Raised when the processing queue is full or the wait timed out"""
+    
+    def __init__(self, retry_after: float):
+        super().__init__("Server is busy")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Caps in-flight processing and bounds the queue in front of it
+    
+    Requests beyond max_concurrent wait in a queue of at most max_queue
+    entries. Anything beyond that is rejected immediately so that admitted
+    requests keep a bounded latency.
+    """
+    
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected_total = 0
+        self.avg_service_time = 5.0
+    
+    def retry_after(self) -> float:
+        """Estimate when a slot is likely to free up"""
+        return self.avg_service_time * (self.waiting + 1) / self.max_concurrent
+    
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one processing slot for the duration of the block"""
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            self.rejected_total += 1
+            raise Overloaded(self.retry_after())
+        
+        self.waiting += 1
+        try:
+            # asyncio.timeout cancels the acquire itself, so a cancelled or
+            # timed-out waiter can never end up holding a slot
+            async with asyncio.timeout(self.queue_timeout):
+                await self._semaphore.acquire()
+        except TimeoutError:
+            self.rejected_total += 1
+            raise Overloaded(self.retry_after())
+        finally:
+            self.waiting -= 1
+        
+        self.in_flight += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            # Exponentially weighted average of slot hold time
+            self.avg_service_time += 0.2 * (time.monotonic() - start - self.avg_service_time)
+    
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "rejected_total": self.rejected_total
+        }
+
+
+def create_rate_limiter():
+    """Create the configured rate limiter backend"""
+    if settings.REDIS_URL:
+        try:
+            limiter = RedisRateLimiter(
+                settings.REDIS_URL, settings.RATE_LIMIT_PER_MINUTE, settings.RATE_LIMIT_BURST
+            )
+            logger.info("Using Redis rate limiter")
+            return limiter
+        except ImportError:
+            logger.warning("redis package not installed, using in-memory rate limiter")
+    
+    return MemoryRateLimiter(settings.RATE_LIMIT_PER_MINUTE, settings.RATE_LIMIT_BURST)
+
+
+def get_client_key(scope: Scope) -> str:
+    """Identify the client a request is counted against"""
+    if settings.TRUST_PROXY_HEADERS:
+        forwarded = Headers(scope=scope).get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+rate_limiter = create_rate_limiter()
+admission_controller = AdmissionController(
+    settings.MAX_CONCURRENT_JOBS, settings.MAX_QUEUED_JOBS, settings.QUEUE_TIMEOUT_SECONDS
+)
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware enforcing rate limits and the processing queue
+    
+    Runs before the request body is read, so rejected uploads cost neither
+    bandwidth nor multipart parsing. Over-limit clients get 429 and a full
+    queue gets 503, both with Retry-After.
+    """
+    
+    def __init__(self, app: ASGIApp, paths: Optional[list] = None):
+        self.app = app
+        self.paths = list(paths if paths is not None else settings.ADMISSION_PATHS)
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or not path_matches(scope["path"], self.paths):
+            await self.app(scope, receive, send)
+            return
+        
+        # Request deadlines count from here, so time spent queued is included
+        scope.setdefault("state", {})["arrived"] = time.monotonic()
+        
+        limit_headers = {}
+        if settings.RATE_LIMIT_PER_MINUTE > 0:
+            result = await rate_limiter.hit(get_client_key(scope))
+            limit_headers = {
+                "X-RateLimit-Limit": str(settings.RATE_LIMIT_PER_MINUTE),
+                "X-RateLimit-Remaining": str(result.remaining)
+            }
+            if not result.allowed:
+                limit_headers["Retry-After"] = str(max(1, math.ceil(result.retry_after)))
+                response = JSONResponse({"detail": "Rate limit exceeded"}, status_code=429, headers=limit_headers)
+                await response(scope, receive, send)
+                return
+        
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).update(limit_headers)
+            await send(message)
+        
+        try:
+            async with admission_controller.slot():
+                await self.app(scope, receive, send_with_headers)
+        except Overloaded as e:
+            logger.warning(f"Rejecting request, processing queue full ({admission_controller.stats()})")
+            response = JSONResponse(
+                {"detail": "Server is busy, please retry later"},
+                status_code=503,
+                headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+            )
+            await response(scope, receive, send)
@@ -2,31 +2,58 @@
 AI image generation service for GeoMask
 """
 
+import hashlib
+import math
 import os
 import time
+import uuid
 import asyncio
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import TYPE_CHECKING, List, Optional, Tuple
 import logging
 import random
 
-import openai
 from PIL import Image
 import numpy as np
 
 from app.config import settings
-from app.utils.logger import setup_logger
+from app.services.provider_gateway import ProviderGateway, provider_gateway
+from app.services.provider_router import ProviderRouter, provider_router
+from app.services.shared_cache import shared_cache
+from app.utils.deadlines import remaining_budget
+from app.utils.file_reaper import file_reaper
+from app.utils.logger import SAMPLED, setup_logger
+from app.utils.metrics import record_cache, record_degradation
+
+if TYPE_CHECKING:
+    import httpx
 
 logger = setup_logger(__name__)
 
+# Provider names reserved in AI_PROVIDER without a client yet; configuring
+# one logs a warning and routes to the other providers instead
+UNIMPLEMENTED_PROVIDERS = ("stability", "local")
+
 
 class AIGenerator:
     """Handles AI image generation for background replacement"""
     
-    def __init__(self):
+    def __init__(
+        self,
+        gateway: Optional[ProviderGateway] = None,
+        router: Optional[ProviderRouter] = None,
+        http_client: Optional["httpx.AsyncClient"] = None,
+        cache=None
+    ):
         self.client = None
         self.initialized = False
         self.provider = settings.AI_PROVIDER.lower()
+        self.providers: List[str] = []
+        self.gateway = gateway or provider_gateway
+        self.router = router or provider_router
+        # Shared pool for downloading generated images; owned by the caller
+        self.http_client = http_client
+        self.cache = cache or shared_cache
         
         # Scene templates for different types
         self.scene_templates = {
@@ -65,45 +92,60 @@ class AIGenerator:
         }
     
     async def initialize(self):
-        """Initialize the AI generator"""
-        try:
-            if self.provider == "openai":
-                await self._initialize_openai()
-            elif self.provider == "stability":
-                await self._initialize_stability()
-            elif self.provider == "local":
-                await self._initialize_local()
-            else:
-                logger.warning(f"Unknown AI provider: {self.provider}, using fallback")
-                await self._initialize_fallback()
-            
-            self.initialized = True
-            logger.info(f"AI Generator initialized with provider: {self.provider}")
-            
-        except Exception as e:
-            logger.error(f"Failed to initialize AI Generator: {e}")
+        """Initialize the AI generator and every configured provider"""
+        candidates = [p.lower() for p in settings.AI_PROVIDERS] or [self.provider]
+        initializers = {
+            "openai": self._initialize_openai
+        }
+        
+        self.providers = []
+        for provider in candidates:
+            if provider in UNIMPLEMENTED_PROVIDERS:
+                logger.warning(f"AI provider {provider} is not implemented yet, skipping")
+                continue
+            if provider not in initializers:
+                if provider != "fallback":
+                    logger.warning(f"Unknown AI provider: {provider}, skipping")
+                continue
+            try:
+                await initializers[provider]()
+                self.providers.append(provider)
+            except Exception as e:
+                logger.error(f"Failed to initialize AI provider {provider}: {e}")
+        
+        if self.providers:
+            self.provider = self.providers[0]
+        else:
             await self._initialize_fallback()
+        
+        self.initialized = True
+        logger.info(f"AI Generator initialized with providers: {self.providers or ['fallback']}")
     
     async def _initialize_openai(self):
         """Initialize OpenAI client"""
         if not settings.OPENAI_API_KEY:
             raise ValueError("OpenAI API key not configured")
         
-        self.client = openai.AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
-        logger.info("OpenAI client initialized")
-    
-    async def _initialize_stability(self):
-        """Initialize Stability AI client"""
-        if not settings.STABILITY_API_KEY:
-            raise ValueError("Stability API key not configured")
+        # Imported here so the SDK is only loaded when this provider is selected
+        from openai import AsyncOpenAI
         
-        # Placeholder for Stability AI integration
-        logger.info("Stability AI client initialized")
+        # Retries and 429 backoff are handled by the provider gateway
+        self.client = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            base_url=settings.OPENAI_BASE_URL or None,
+            max_retries=0
+        )
+        logger.info("OpenAI client initialized")
     
-    async def _initialize_local(self):
-        """Initialize local AI model"""
-        # Placeholder for local model integration (e.g., Stable Diffusion)
-        logger.info("Local AI model initialized")
+    async def aclose(self):
+        """Close provider clients; the next request initializes again"""
+        client, self.client = self.client, None
+        self.initialized = False
+        if client is not None and hasattr(client, "close"):
+            try:
+                await client.close()
+            except Exception as e:
+                logger.error(f"Error closing AI provider client: {e}")
     
     async def _initialize_fallback(self):
         """Initialize fallback generator"""
@@ -116,18 +158,30 @@ class AIGenerator:
         custom_prompt: str = "",
         width: int = 1024,
         height: int = 1024,
-        quality: str = "standard"
+        quality: str = "standard",
+        cached_only: bool = False
     ) -> str:
         """
         Generate an image using AI
         
+        Every call without cached_only generates a fresh image; the
+        latest one per request is kept for cached_only callers. The
+        provider call is bounded by the current request's deadline,
+        less DEADLINE_RESERVE_SECONDS for the stages after it. With less
+        than DEADLINE_MIN_PROVIDER_SECONDS to spend, or if the call
+        overruns, a cached image for the same request or the fallback is
+        returned instead; an overrunning call is cancelled unless another
+        request is still waiting for it.
+        
         Args:
             scene_type: Type of scene to generate
             custom_prompt: Custom scene description
             width: Image width
             height: Image height
             quality: Image quality (standard, hd)
-            
+            cached_only: Return a cached image for the request, or the
+                fallback, without calling a provider
+        
         Returns:
             Path to generated image
         """
@@ -135,27 +189,133 @@ class AIGenerator:
             if not self.initialized:
                 await self.initialize()
             
-            # Generate prompt
-            prompt = self._generate_prompt(scene_type, custom_prompt)
+            # Identical concurrent requests share one generation
+            key = (tuple(self.providers), scene_type, custom_prompt, width, height, quality)
+            if cached_only:
+                return await self._cached_or_fallback(key, width, height, quality)
             
-            # Generate image based on provider
-            if self.provider == "openai":
-                image_path = await self._generate_openai_image(prompt, width, height, quality)
-            elif self.provider == "stability":
-                image_path = await self._generate_stability_image(prompt, width, height, quality)
-            elif self.provider == "local":
-                image_path = await self._generate_local_image(prompt, width, height, quality)
-            else:
-                image_path = await self._generate_fallback_image(prompt, width, height, quality)
+            budget = remaining_budget() - settings.DEADLINE_RESERVE_SECONDS
+            if budget < settings.DEADLINE_MIN_PROVIDER_SECONDS:
+                logger.warning(f"{budget:.1f}s left before the deadline, not calling a provider")
+                return await self._degraded_image(key, width, height, quality)
             
-            logger.info(f"Generated image: {image_path}")
-            return image_path
+            try:
+                async with asyncio.timeout(None if math.isinf(budget) else budget):
+                    image_path = await self.gateway.coalesce(
+                        key,
+                        lambda: self._generate_and_store(key, scene_type, custom_prompt, width, height, quality)
+                    )
+            except TimeoutError:
+                logger.warning(f"Provider call overran the request deadline after {budget:.1f}s")
+                return await self._degraded_image(key, width, height, quality)
             
+            logger.info(f"Generated image: {image_path}", extra=SAMPLED)
+            return image_path
+        
         except Exception as e:
             logger.error(f"Error generating image: {e}")
             # Return fallback image
             return await self._generate_fallback_image("", width, height, quality)
     
+    async def _generate_and_store(
+        self,
+        key: tuple,
+        scene_type: str,
+        custom_prompt: str,
+        width: int,
+        height: int,
+        quality: str
+    ) -> str:
+        """
+        Generate a fresh provider image and keep it for cached requests
+        
+        The cache is never read here: a full-quality request gets a new
+        prompt and a new image. The stored copy serves the reduced tier
+        and requests the deadline leaves no time to generate for. Only
+        provider results are stored; the fallback gradient is cheap and
+        would otherwise mask a provider that has recovered.
+        """
+        image_path = await self._generate_with_provider(scene_type, custom_prompt, width, height, quality)
+        
+        ttl = settings.BACKGROUND_CACHE_TTL_SECONDS
+        if self.providers and ttl > 0:
+            try:
+                await self.cache.set(self._cache_key(key), await asyncio.to_thread(Path(image_path).read_bytes), ttl)
+            except Exception as e:
+                logger.error(f"Background cache store failed: {e}")
+        return image_path
+    
+    def _cache_key(self, key: tuple) -> str:
+        return "background:" + hashlib.sha256(repr(key).encode()).hexdigest()
+    
+    async def _lookup_cached(self, key: tuple) -> Optional[str]:
+        """Path of a cached provider image for the request, None if there is none"""
+        try:
+            data = await self.cache.get(self._cache_key(key))
+        except Exception as e:
+            logger.error(f"Background cache lookup failed: {e}")
+            data = None
+        record_cache("background", data is not None)
+        if data is None:
+            return None
+        return await asyncio.to_thread(self._save_temp_image, data, "cached")
+    
+    async def _degraded_image(self, key: tuple, width: int, height: int, quality: str) -> str:
+        """Stand-in for a provider call the deadline leaves no time for"""
+        record_degradation("generate")
+        return await self._cached_or_fallback(key, width, height, quality)
+    
+    async def _cached_or_fallback(self, key: tuple, width: int, height: int, quality: str) -> str:
+        """A cached provider image for the request if there is one, else the fallback"""
+        if self.providers and settings.BACKGROUND_CACHE_TTL_SECONDS > 0:
+            image_path = await self._lookup_cached(key)
+            if image_path is not None:
+                return image_path
+        return await self._generate_fallback_image("", width, height, quality)
+    
+    async def _generate_with_provider(
+        self,
+        scene_type: str,
+        custom_prompt: str,
+        width: int,
+        height: int,
+        quality: str
+    ) -> str:
+        """
+        Generate an image with the best available provider
+        
+        The router picks the fastest healthy provider and hedges slow calls;
+        each individual call still goes through the gateway's limits. If
+        every provider fails or has its circuit open, ProviderUnavailable
+        propagates and generate_image falls back immediately.
+        """
+        # Generate prompt
+        prompt = self._generate_prompt(scene_type, custom_prompt)
+        
+        if not self.providers:
+            return await self._generate_fallback_image(prompt, width, height, quality)
+        
+        return await self.router.generate(
+            self.providers,
+            lambda provider: self.gateway.limited(
+                provider,
+                lambda: self._call_provider(provider, prompt, width, height, quality)
+            )
+        )
+    
+    async def _call_provider(
+        self,
+        provider: str,
+        prompt: str,
+        width: int,
+        height: int,
+        quality: str
+    ) -> str:
+        """Make a single generation call to a provider"""
+        if provider == "openai":
+            return await self._generate_openai_image(prompt, width, height, quality)
+        return await self._generate_fallback_image(prompt, width, height, quality)
+    
     def _generate_prompt(self, scene_type: str, custom_prompt: str) -> str:
         """Generate AI prompt based on scene type and custom prompt"""
         if custom_prompt:
@@ -206,35 +366,11 @@ class AIGenerator:
             image_path = await self._download_and_save_image(image_url, "openai")
             
             return image_path
-            
+        
         except Exception as e:
             logger.error(f"OpenAI generation failed: {e}")
             raise
     
-    async def _generate_stability_image(
-        self, 
-        prompt: str, 
-        width: int, 
-        height: int, 
-        quality: str
-    ) -> str:
-        """Generate image using Stability AI"""
-        # Placeholder for Stability AI integration
-        logger.info("Stability AI generation not implemented yet")
-        return await self._generate_fallback_image(prompt, width, height, quality)
-    
-    async def _generate_local_image(
-        self, 
-        prompt: str, 
-        width: int, 
-        height: int, 
-        quality: str
-    ) -> str:
-        """Generate image using local model"""
-        # Placeholder for local model integration
-        logger.info("Local model generation not implemented yet")
-        return await self._generate_fallback_image(prompt, width, height, quality)
-    
     async def _generate_fallback_image(
         self, 
         prompt: str, 
@@ -249,14 +385,15 @@ class AIGenerator:
             
             # Save image
             timestamp = int(time.time())
-            filename = f"fallback_{timestamp}.jpg"
+            filename = f"fallback_{timestamp}_{uuid.uuid4().hex[:8]}.jpg"
             image_path = Path(settings.TEMP_DIR) / filename
             
             image.save(image_path, "JPEG", quality=95)
+            file_reaper.track(str(image_path))
             
-            logger.info(f"Generated fallback image: {image_path}")
+            logger.info(f"Generated fallback image: {image_path}", extra=SAMPLED)
             return str(image_path)
-            
+        
         except Exception as e:
             logger.error(f"Error generating fallback image: {e}")
             raise
@@ -282,26 +419,33 @@ class AIGenerator:
     async def _download_and_save_image(self, image_url: str, provider: str) -> str:
         """Download and save image from URL"""
         try:
-            import httpx
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.get(image_url)
-                response.raise_for_status()
-                
-                # Save image
-                timestamp = int(time.time())
-                filename = f"{provider}_{timestamp}.jpg"
-                image_path = Path(settings.TEMP_DIR) / filename
-                
-                with open(image_path, "wb") as f:
-                    f.write(response.content)
-                
-                return str(image_path)
+            if self.http_client is not None:
+                response = await self.http_client.get(image_url)
+            else:
+                import httpx
                 
+                async with httpx.AsyncClient() as client:
+                    response = await client.get(image_url)
+            response.raise_for_status()
+            
+            return self._save_temp_image(response.content, provider)
+        
         except Exception as e:
             logger.error(f"Error downloading image: {e}")
             raise
     
+    def _save_temp_image(self, data: bytes, prefix: str) -> str:
+        """Write image bytes to a reaper-tracked temp file"""
+        timestamp = int(time.time())
+        filename = f"{prefix}_{timestamp}_{uuid.uuid4().hex[:8]}.jpg"
+        image_path = Path(settings.TEMP_DIR) / filename
+        
+        with open(image_path, "wb") as f:
+            f.write(data)
+        file_reaper.track(str(image_path), size=len(data))
+        
+        return str(image_path)
+    
     def get_available_scenes(self) -> dict:
         """Get available scene types"""
         return {
@@ -318,7 +462,7 @@ class AIGenerator:
         try:
             temp_dir = Path(settings.TEMP_DIR)
             for file in temp_dir.glob("*.jpg"):
-                if file.name.startswith(("openai_", "stability_", "local_", "fallback_")):
+                if file.name.startswith(("openai_", "stability_", "local_", "fallback_", "cached_")):
                     file.unlink()
                     logger.debug(f"Cleaned up temp file: {file}")
         except Exception as e:
@@ -0,0 +1,385 @@
+"""
+Animated image and short video processing for GeoMask
+
+Multi-frame uploads (animated GIF/WebP, short videos) are masked frame by
+frame in a streaming pipeline: a decoder thread, the caller's thread
+(tracking and blending) and an encoder thread, connected by bounded
+queues, so only a few frames are in flight at once. Windows are detected
+on keyframes and tracked in between.
+"""
+
+import contextvars
+import queue
+import threading
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from app.config import settings
+from app.utils.deadlines import check_deadline
+from app.utils.logger import setup_logger
+from app.utils.metrics import stage_timer
+
+logger = setup_logger(__name__)
+
+Region = Tuple[int, int, int, int]
+
+ANIMATED_EXTENSIONS = (".gif", ".webp")
+
+# Pillow reports no duration for some frames; browsers treat those as 100ms
+DEFAULT_FRAME_MS = 100
+
+_DONE = object()
+
+
+class PillowClip:
+    """
+    An animated GIF or WebP, decoded one frame at a time
+    
+    Pillow's GIF and WebP writers take all frames in one call, so the
+    writer keeps the encoded-ready frames (palette images for GIF) until
+    close(); MAX_CLIP_FRAMES bounds how many that can be.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.image = Image.open(path)
+        self.format = self.image.format
+        self.suffix = Path(path).suffix.lower()
+        self.size = self.image.size
+        self.loop = self.image.info.get("loop", 0)
+        self.durations: List[int] = []
+    
+    def frames(self, limit: int) -> Iterator[np.ndarray]:
+        """Yield BGR frames, at most limit of them"""
+        for index in range(limit):
+            try:
+                self.image.seek(index)
+            except EOFError:
+                return
+            self.durations.append(self.image.info.get("duration") or DEFAULT_FRAME_MS)
+            with stage_timer("decode"):
+                rgb = np.asarray(self.image.convert("RGB"))
+                frame = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+            yield frame
+    
+    def open_writer(self, path: str) -> "PillowClipWriter":
+        return PillowClipWriter(path, self.format, self.durations, self.loop)
+    
+    def close(self):
+        self.image.close()
+
+
+class PillowClipWriter:
+    """Collects processed frames and writes the animation on close()"""
+    
+    def __init__(self, path: str, image_format: str, durations: List[int], loop: int):
+        self.path = path
+        self.format = image_format
+        self.durations = durations
+        self.loop = loop
+        self.frames: List[Image.Image] = []
+    
+    def write(self, frame: np.ndarray):
+        with stage_timer("encode"):
+            image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            if self.format == "GIF":
+                # Quantize here, in the encoder thread, rather than all at once in save()
+                image = image.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+            self.frames.append(image)
+    
+    def close(self):
+        if not self.frames:
+            raise ValueError(f"No frames to write: {self.path}")
+        
+        options = {"quality": 85, "method": 2} if self.format == "WEBP" else {"optimize": False}
+        with stage_timer("encode"):
+            self.frames[0].save(
+                self.path,
+                format=self.format,
+                save_all=True,
+                append_images=self.frames[1:],
+                duration=self.durations[:len(self.frames)],
+                loop=self.loop,
+                **options
+            )
+        self.frames = []
+
+
+class VideoClip:
+    """A short video, decoded with OpenCV (FFmpeg) one frame at a time"""
+    
+    suffix = ".mp4"
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise ValueError(f"Could not open video: {path}")
+        self.size = (
+            int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        )
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 25.0
+    
+    def frames(self, limit: int) -> Iterator[np.ndarray]:
+        """Yield BGR frames, at most limit of them"""
+        for _ in range(limit):
+            with stage_timer("decode"):
+                success, frame = self.capture.read()
+            if not success:
+                return
+            yield frame
+    
+    def open_writer(self, path: str) -> "VideoClipWriter":
+        return VideoClipWriter(path, self.fps, self.size)
+    
+    def close(self):
+        self.capture.release()
+
+
+class VideoClipWriter:
+    """Encodes frames to MP4 as they arrive"""
+    
+    def __init__(self, path: str, fps: float, size: Tuple[int, int]):
+        self.path = path
+        self.writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+        if not self.writer.isOpened():
+            raise ValueError(f"Could not open video writer: {path}")
+    
+    def write(self, frame: np.ndarray):
+        with stage_timer("encode"):
+            self.writer.write(frame)
+    
+    def close(self):
+        self.writer.release()
+
+
+def is_clip(path: str) -> bool:
+    """
+    Check whether a file has more than one frame
+    
+    Args:
+        path: Path to an uploaded file
+    
+    Returns:
+        True for videos and animated GIF/WebP, False for still images
+    """
+    extension = Path(path).suffix.lower()
+    if extension in settings.VIDEO_EXTENSIONS:
+        return True
+    if extension not in ANIMATED_EXTENSIONS:
+        return False
+    
+    try:
+        with Image.open(path) as image:
+            return bool(getattr(image, "is_animated", False))
+    except Exception as e:
+        logger.error(f"Error reading {path}: {e}")
+        return False
+
+
+def open_clip(path: str):
+    """Open a multi-frame file for decoding"""
+    if Path(path).suffix.lower() in settings.VIDEO_EXTENSIONS:
+        return VideoClip(path)
+    return PillowClip(path)
+
+
+class RegionTracker:
+    """
+    Follows window regions across frames without re-detecting on each one
+    
+    Regions are detected on keyframes: the first frame, every
+    keyframe_interval frames, and whenever phase correlation against the
+    keyframe loses confidence (a cut, or the camera has moved too far). In
+    between, they are shifted by the global translation measured on
+    downscaled grayscale frames, which costs about a millisecond per frame.
+    """
+    
+    TRACK_WIDTH = 320
+    MIN_RESPONSE = 0.1
+    # Mean absolute difference (0-255) below which a frame counts as unchanged
+    STILL_THRESHOLD = 1.0
+    
+    def __init__(self, detect: Callable[[np.ndarray], List[Region]], keyframe_interval: int):
+        self.detect = detect
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.keyframes = 0
+        self._regions: List[Region] = []
+        self._reference: Optional[np.ndarray] = None
+        self._previous: Optional[np.ndarray] = None
+        self._window: Optional[np.ndarray] = None
+        self._scale = 1.0
+        self._offset = (0.0, 0.0)
+        self._since_keyframe = 0
+    
+    def update(self, frame: np.ndarray) -> List[Region]:
+        """
+        Regions for the next frame
+        
+        Args:
+            frame: BGR frame
+        
+        Returns:
+            Window regions (x, y, width, height); shifted regions may extend past the frame
+        """
+        small = self._downscale(frame)
+        keyframe = self._reference is None or self._since_keyframe >= self.keyframe_interval
+        
+        if not keyframe and not self._unchanged(small):
+            # Measured against the keyframe, so sub-pixel errors don't accumulate
+            offset = self._measure_shift(self._reference, small)
+            if offset is None:
+                keyframe = True
+            else:
+                self._offset = offset
+        self._previous = small
+        
+        if keyframe:
+            height, width = frame.shape[:2]
+            self._regions = self.detect(frame) or [(0, 0, width, height)]
+            self._reference = small
+            self._offset = (0.0, 0.0)
+            self._since_keyframe = 0
+            self.keyframes += 1
+        self._since_keyframe += 1
+        
+        dx, dy = round(self._offset[0]), round(self._offset[1])
+        return [(x + dx, y + dy, w, h) for x, y, w, h in self._regions]
+    
+    def _downscale(self, frame: np.ndarray) -> np.ndarray:
+        height, width = frame.shape[:2]
+        self._scale = width / min(width, self.TRACK_WIDTH)
+        size = (max(1, round(width / self._scale)), max(1, round(height / self._scale)))
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, size, interpolation=cv2.INTER_AREA).astype(np.float32)
+    
+    def _unchanged(self, current: np.ndarray) -> bool:
+        """Whether a frame is (nearly) identical to the previous one, e.g. a paused animation"""
+        previous = self._previous
+        if previous is None or previous.shape != current.shape:
+            return False
+        return cv2.norm(previous, current, cv2.NORM_L1) / previous.size < self.STILL_THRESHOLD
+    
+    def _measure_shift(self, reference: np.ndarray, current: np.ndarray) -> Optional[Tuple[float, float]]:
+        """Translation from reference to current in full-frame pixels, None if unreliable"""
+        if reference.shape != current.shape:
+            return None
+        
+        if self._window is None or self._window.shape != current.shape:
+            self._window = cv2.createHanningWindow(current.shape[::-1], cv2.CV_32F)
+        (dx, dy), response = cv2.phaseCorrelate(reference, current, self._window)
+        if not response >= self.MIN_RESPONSE:
+            return None
+        return dx * self._scale, dy * self._scale
+
+
+def run_frame_pipeline(
+    frames: Iterable[np.ndarray],
+    process: Callable[[np.ndarray], np.ndarray],
+    write: Callable[[np.ndarray], None],
+    queue_size: int,
+    cancel: Optional[threading.Event] = None
+) -> int:
+    """
+    Decode, process and encode frames concurrently with bounded buffering
+    
+    frames is consumed on a decoder thread and write() is called on an
+    encoder thread, while process() runs on the calling thread. Each queue
+    holds at most queue_size frames, so a slow stage holds back the others
+    instead of frames piling up in memory. OpenCV releases the GIL, so the
+    stages overlap. The first error in any stage stops all three and is
+    re-raised. Each frame checks the request deadline (the calling thread
+    must carry the request's context, as asyncio.to_thread does) and the
+    cancel event.
+    
+    Args:
+        frames: Decoded frames, in order
+        process: Frame transformation
+        write: Sink for processed frames, in order
+        queue_size: Frames buffered between stages
+        cancel: Set from another thread to stop after the current frame
+    
+    Returns:
+        Number of frames processed
+    
+    Raises:
+        DeadlineExceeded: If the request's deadline passes between frames
+    """
+    decoded: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+    processed: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    
+    def fail(error: BaseException):
+        errors.append(error)
+        stop.set()
+    
+    def put(target: queue.Queue, item) -> bool:
+        # Give up once another stage has failed, rather than block forever
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def get(source: queue.Queue):
+        while True:
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                if stop.is_set():
+                    return _DONE
+    
+    def decode():
+        try:
+            for frame in frames:
+                if not put(decoded, frame):
+                    return
+        except BaseException as e:
+            fail(e)
+        finally:
+            put(decoded, _DONE)
+    
+    def encode():
+        try:
+            while (frame := get(processed)) is not _DONE:
+                write(frame)
+        except BaseException as e:
+            fail(e)
+    
+    # Copy the context so stage timings from these threads reach the request
+    threads = [
+        threading.Thread(target=contextvars.copy_context().run, args=(decode,), name="geomask-decode", daemon=True),
+        threading.Thread(target=contextvars.copy_context().run, args=(encode,), name="geomask-encode", daemon=True)
+    ]
+    for thread in threads:
+        thread.start()
+    
+    count = 0
+    try:
+        while (frame := get(decoded)) is not _DONE:
+            if cancel is not None and cancel.is_set():
+                # Unblocks the decoder; frames already processed are still written
+                stop.set()
+                break
+            check_deadline("frame")
+            if not put(processed, process(frame)):
+                break
+            count += 1
+    except BaseException as e:
+        fail(e)
+    finally:
+        put(processed, _DONE)
+        for thread in threads:
+            thread.join()
+    
+    if errors:
+        raise errors[0]
+    return count
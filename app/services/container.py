@@ -0,0 +1,170 @@
+"""
+Service container for GeoMask
+
+Owns the app-scoped services so each process builds, warms up and shuts
+down exactly one of each. The AI generator is shared by the endpoints and
+the image processor, downloads reuse one HTTP connection pool, blocking
+work runs on one thread pool, and caches and job records go through the
+shared cache so every worker sees them. Editing sessions are held per
+worker, in memory, by one session store.
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Optional
+
+from app.config import settings
+from app.services.admission import AdmissionController, admission_controller
+from app.services.ai_generator import AIGenerator
+from app.services.jobs import JobStore
+from app.services.provider_gateway import ProviderGateway, provider_gateway
+from app.services.provider_router import ProviderRouter, provider_router
+from app.services.quality import QualityController
+from app.services.sessions import SessionStore
+from app.services.shared_cache import shared_cache
+from app.utils.file_index import FileIndex, processed_index
+from app.utils.file_reaper import FileReaper, file_reaper
+from app.utils.logger import setup_logger
+from app.utils.threads import thread_budget
+
+if TYPE_CHECKING:
+    import httpx
+    from app.services.image_processor import ImageProcessor
+
+logger = setup_logger(__name__)
+
+
+class ServiceContainer:
+    """
+    App-scoped services with an explicit start/stop lifecycle
+    
+    Construction is cheap; the image processor (and OpenCV) is built on
+    first use or during warm-up. start() and aclose() are called from the
+    FastAPI lifespan. Without them (e.g. a TestClient used outside a
+    `with` block) services are still built lazily on first use.
+    """
+    
+    def __init__(
+        self,
+        gateway: Optional[ProviderGateway] = None,
+        router: Optional[ProviderRouter] = None,
+        admission: Optional[AdmissionController] = None,
+        reaper: Optional[FileReaper] = None,
+        index: Optional[FileIndex] = None,
+        cache=None
+    ):
+        self.gateway = gateway or provider_gateway
+        self.router = router or provider_router
+        self.admission = admission or admission_controller
+        self.quality = QualityController(self.admission)
+        self.reaper = reaper or file_reaper
+        self.index = index or processed_index
+        self.cache = cache or shared_cache
+        self.jobs = JobStore(self.cache)
+        self.sessions = SessionStore(self.cache)
+        self.ai_generator = AIGenerator(gateway=self.gateway, router=self.router, cache=self.cache)
+        self.http_client: Optional["httpx.AsyncClient"] = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.ready = False
+        self._image_processor: Optional["ImageProcessor"] = None
+        self._image_processor_lock = threading.Lock()
+        self._warm_up_task: Optional[asyncio.Task] = None
+    
+    @property
+    def image_processor(self) -> "ImageProcessor":
+        """The shared ImageProcessor, importing and constructing it on first use"""
+        if self._image_processor is None:
+            with self._image_processor_lock:
+                if self._image_processor is None:
+                    from app.services.decoy_library import DecoyLibrary
+                    from app.services.image_processor import ImageProcessor
+                    decoys = DecoyLibrary(settings.DECOY_LIBRARY_DIR) if settings.DECOY_LIBRARY_DIR else None
+                    self._image_processor = ImageProcessor(
+                        ai_generator=self.ai_generator, cache=self.cache, sessions=self.sessions, decoys=decoys
+                    )
+                    # OpenCV is loaded by now; keep it to this worker's share of the cores
+                    thread_budget.apply_opencv()
+        return self._image_processor
+    
+    async def start(self):
+        """Create the executor, start background services and begin warm-up"""
+        # asyncio.to_thread uses the loop's default executor
+        self.executor = ThreadPoolExecutor(
+            max_workers=thread_budget.executor_threads,
+            thread_name_prefix="geomask-worker"
+        )
+        logger.info(
+            f"Thread budget: {thread_budget.cpus} cores for {thread_budget.workers} workers, "
+            f"{thread_budget.native_threads} native and {thread_budget.executor_threads} executor threads per worker"
+        )
+        asyncio.get_running_loop().set_default_executor(self.executor)
+        
+        self.reaper.start()
+        
+        # /health answers immediately, /ready once warm-up has finished
+        self._warm_up_task = asyncio.create_task(self.warm_up())
+    
+    async def warm_up(self):
+        """Create the HTTP pool, initialize providers, build the image processor and index decoys, then mark ready"""
+        start = time.perf_counter()
+        
+        # Importing httpx takes ~150ms, so it happens here rather than before /health answers
+        self.http_client = await asyncio.to_thread(self._create_http_client)
+        self.ai_generator.http_client = self.http_client
+        
+        try:
+            await self.ai_generator.initialize()
+            logger.info("AI Generator initialized successfully")
+        except Exception as e:
+            logger.error(f"Failed to initialize AI Generator: {e}")
+        
+        try:
+            image_processor = await asyncio.to_thread(lambda: self.image_processor)
+        except Exception as e:
+            logger.error(f"Failed to initialize image processor: {e}")
+            return
+        
+        # Index new library images now rather than on the first request
+        if image_processor.decoys is not None:
+            try:
+                await image_processor.decoys.refresh()
+            except Exception as e:
+                logger.error(f"Failed to index decoy library: {e}")
+        
+        self.ready = True
+        logger.info(f"GeoMask ready in {time.perf_counter() - start:.2f}s")
+    
+    def _create_http_client(self) -> "httpx.AsyncClient":
+        import httpx
+        
+        return httpx.AsyncClient(timeout=settings.PROVIDER_TIMEOUT_SECONDS)
+    
+    async def aclose(self):
+        """Stop background work and release pools, in reverse order of start()"""
+        self.ready = False
+        
+        if self._warm_up_task is not None and not self._warm_up_task.done():
+            self._warm_up_task.cancel()
+            try:
+                await self._warm_up_task
+            except asyncio.CancelledError:
+                pass
+        self._warm_up_task = None
+        
+        await self.reaper.stop()
+        await self.ai_generator.aclose()
+        
+        await self.cache.aclose()
+        
+        client, self.http_client = self.http_client, None
+        self.ai_generator.http_client = None
+        if client is not None:
+            await client.aclose()
+        
+        # Blocking is fine here (no requests are running), and to_thread
+        # would submit the shutdown to this same executor
+        executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
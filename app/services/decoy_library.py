@@ -0,0 +1,344 @@
+"""
+Decoy image library for GeoMask
+
+An optional local alternative to generating a background per request. A
+directory of licensed or previously generated images is indexed once, by
+scene tag, aspect ratio and a compact lighting descriptor, and each request
+picks the image whose lighting best matches the original windows with a
+vectorised nearest-neighbour lookup. Matches are served with no provider
+latency.
+
+Images are tagged by their first subdirectory (city/, beach/, ...); images
+at the top level only match "random". The index (descriptors plus a small
+thumbnail per image) is persisted, and rescans only describe files that
+were added or changed.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from app.config import settings
+from app.services.image_decoder import decode_image
+from app.utils.logger import SAMPLED, setup_logger
+from app.utils.metrics import record_cache
+
+logger = setup_logger(__name__)
+
+# Bump when describe() changes so persisted descriptors are recomputed (from the thumbnails)
+DESCRIPTOR_VERSION = 1
+
+THUMBNAIL_EDGE = 256
+
+# Descriptor: mean L, a, b; L spread; L of the top and bottom halves; log aspect ratio.
+# Lighting dominates; the aspect ratio only breaks ties between similar images.
+FEATURE_WEIGHTS = np.array([1.0, 0.5, 0.5, 0.5, 0.5, 0.5, 0.1], dtype=np.float32)
+
+
+# Search group key for "random", which matches every image
+ALL_SCENES = "*"
+
+
+class SearchGroup:
+    """
+    Images of one scene, laid out for nearest-neighbour lookups
+    
+    Features are scaled by the square root of their weights and stored
+    contiguously with their squared norms, so a lookup is one matrix-vector
+    product: |f - q|^2 = |f|^2 - 2 f.q + |q|^2, and |q|^2 doesn't change
+    the ranking.
+    """
+    
+    def __init__(self, rows: np.ndarray, features: np.ndarray):
+        self.rows = rows
+        self.matrix = np.ascontiguousarray(features[rows] * np.sqrt(FEATURE_WEIGHTS))
+        self.norms = np.einsum("ij,ij->i", self.matrix, self.matrix)
+    
+    def nearest(self, descriptor: np.ndarray) -> int:
+        """Row of the image closest to a descriptor"""
+        query = descriptor * np.sqrt(FEATURE_WEIGHTS)
+        return int(self.rows[np.argmin(self.norms - 2 * (self.matrix @ query))])
+
+
+@dataclass
+class DecoyEntry:
+    """One indexed library image"""
+    path: str
+    scene: str
+    size: int
+    mtime_ns: int
+    width: int
+    height: int
+    thumbnail: str
+
+
+def describe(image: np.ndarray, aspect: float) -> np.ndarray:
+    """
+    Compact lighting descriptor of a BGR image
+    
+    Args:
+        image: BGR pixels (any size; large images are subsampled)
+        aspect: Width / height the descriptor should match on
+    
+    Returns:
+        float32 feature vector, comparable with FEATURE_WEIGHTS
+    """
+    step = max(1, max(image.shape[:2]) // 128)
+    small = np.ascontiguousarray(image[::step, ::step])
+    lab = cv2.cvtColor(small, cv2.COLOR_BGR2LAB).astype(np.float32) / 255.0
+    lightness = lab[:, :, 0]
+    half = max(1, lightness.shape[0] // 2)
+    
+    return np.array([
+        lightness.mean(),
+        lab[:, :, 1].mean(),
+        lab[:, :, 2].mean(),
+        lightness.std(),
+        lightness[:half].mean(),
+        lightness[half:].mean() if lightness.shape[0] > 1 else lightness.mean(),
+        np.log(max(aspect, 1e-3))
+    ], dtype=np.float32)
+
+
+def describe_windows(image: np.ndarray, regions: Optional[List[Tuple[int, int, int, int]]] = None) -> np.ndarray:
+    """
+    Descriptor of what an image shows through its windows
+    
+    Args:
+        image: BGR image
+        regions: Window regions (x, y, width, height); the whole image if empty
+    
+    Returns:
+        Descriptor matched against the library, with the aspect ratio of the image
+    """
+    height, width = image.shape[:2]
+    if regions:
+        x0 = max(0, min(x for x, _, _, _ in regions))
+        y0 = max(0, min(y for _, y, _, _ in regions))
+        x1 = min(width, max(x + w for x, _, w, _ in regions))
+        y1 = min(height, max(y + h for _, y, _, h in regions))
+        if x1 > x0 and y1 > y0:
+            image = image[y0:y1, x0:x1]
+    return describe(image, width / height)
+
+
+class DecoyLibrary:
+    """
+    Nearest-neighbour index over a directory of decoy images
+    
+    The feature matrix lives in memory (a few bytes per image), so a lookup
+    over tens of thousands of images is one vectorised distance computation.
+    """
+    
+    def __init__(
+        self,
+        directory: str,
+        index_dir: Optional[str] = None,
+        rescan_seconds: Optional[float] = None
+    ):
+        self.directory = Path(directory)
+        self.index_dir = Path(index_dir or settings.DECOY_INDEX_DIR)
+        self.rescan_seconds = rescan_seconds if rescan_seconds is not None else settings.DECOY_RESCAN_SECONDS
+        # (entries, feature matrix, search groups by scene), replaced as one so lookups never see a partial update
+        self._index: Tuple[List[DecoyEntry], np.ndarray, Dict[str, SearchGroup]] = (
+            [], np.zeros((0, len(FEATURE_WEIGHTS)), dtype=np.float32), {}
+        )
+        self.described_total = 0
+        self._scanned_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+    
+    @property
+    def entries(self) -> List[DecoyEntry]:
+        return self._index[0]
+    
+    @property
+    def features(self) -> np.ndarray:
+        return self._index[1]
+    
+    async def refresh(self) -> int:
+        """
+        Bring the index up to date with the directory
+        
+        Loads the persisted index on first use, then describes only files
+        that are new or changed since, and drops files that are gone.
+        
+        Returns:
+            Number of images described in this refresh
+        """
+        async with self._lock:
+            described = await asyncio.to_thread(self._refresh)
+            self._scanned_at = time.monotonic()
+            return described
+    
+    async def select(self, scene_type: str, descriptor: np.ndarray) -> Optional[str]:
+        """
+        Pick the library image whose lighting best matches a descriptor
+        
+        Args:
+            scene_type: Scene tag; "random" matches the whole library
+            descriptor: Output of describe_windows() for the original image
+        
+        Returns:
+            Path to the closest image, or None if the library has none for the scene
+        """
+        if self._scanned_at is None:
+            await self.refresh()
+        elif time.monotonic() - self._scanned_at > self.rescan_seconds and (
+            self._refresh_task is None or self._refresh_task.done()
+        ):
+            # New files are picked up in the background, without delaying this request
+            self._refresh_task = asyncio.create_task(self.refresh())
+        
+        entries, _, groups = self._index
+        group = groups.get(ALL_SCENES if scene_type == "random" else scene_type)
+        record_cache("decoy", group is not None)
+        if group is None:
+            return None
+        
+        entry = entries[group.nearest(descriptor)]
+        logger.info(f"Selected decoy {entry.path} for scene {scene_type}", extra=SAMPLED)
+        return str(self.directory / entry.path)
+    
+    def stats(self) -> dict:
+        return {
+            "images": len(self.entries),
+            "scenes": sorted(scene for scene in self._index[2] if scene != ALL_SCENES),
+            "described_total": self.described_total
+        }
+    
+    def _refresh(self) -> int:
+        if self._scanned_at is None and not self.entries:
+            self._load()
+        
+        known: Dict[str, Tuple[DecoyEntry, np.ndarray]] = {
+            entry.path: (entry, feature) for entry, feature in zip(self.entries, self.features)
+        }
+        entries, features = [], []
+        described = 0
+        
+        for path, stat in self._scan():
+            relative = path.relative_to(self.directory).as_posix()
+            previous = known.get(relative)
+            if previous is not None and (previous[0].size, previous[0].mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                entries.append(previous[0])
+                features.append(previous[1])
+                continue
+            
+            try:
+                entry, feature = self._describe_file(path, relative, stat)
+            except Exception as e:
+                logger.error(f"Skipping decoy {path}: {e}")
+                continue
+            entries.append(entry)
+            features.append(feature)
+            described += 1
+        
+        removed = known.keys() - {entry.path for entry in entries}
+        for path in removed:
+            (self.index_dir / "thumbnails" / known[path][0].thumbnail).unlink(missing_ok=True)
+        self._set(entries, features)
+        if described or removed:
+            self.described_total += described
+            self._save()
+            logger.info(f"Decoy library: {len(entries)} images ({described} described, {len(removed)} removed)")
+        return described
+    
+    def _scan(self):
+        """Image files in the library, with their stat results"""
+        extensions = {extension.lower() for extension in settings.ALLOWED_EXTENSIONS}
+        for root, _, files in os.walk(self.directory):
+            for name in sorted(files):
+                path = Path(root) / name
+                if path.suffix.lower() in extensions:
+                    yield path, path.stat()
+    
+    def _describe_file(self, path: Path, relative: str, stat: os.stat_result) -> Tuple[DecoyEntry, np.ndarray]:
+        """Make a thumbnail of a library image and describe it"""
+        # JPEGs decode straight at reduced scale
+        decoded = decode_image(path.read_bytes(), min_edge=THUMBNAIL_EDGE)
+        width, height = decoded.full_size
+        pixels = decoded.image
+        ratio = THUMBNAIL_EDGE / max(pixels.shape[:2])
+        if ratio < 1:
+            size = (max(1, round(pixels.shape[1] * ratio)), max(1, round(pixels.shape[0] * ratio)))
+            pixels = cv2.resize(pixels, size, interpolation=cv2.INTER_AREA)
+        
+        thumbnail_name = hashlib.sha1(relative.encode()).hexdigest() + ".jpg"
+        thumbnails = self.index_dir / "thumbnails"
+        thumbnails.mkdir(parents=True, exist_ok=True)
+        cv2.imwrite(str(thumbnails / thumbnail_name), pixels, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        
+        parts = Path(relative).parts
+        entry = DecoyEntry(
+            path=relative,
+            scene=parts[0].lower() if len(parts) > 1 else "random",
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            width=width,
+            height=height,
+            thumbnail=thumbnail_name
+        )
+        return entry, describe(pixels, width / height)
+    
+    def _set(self, entries: List[DecoyEntry], features: List[np.ndarray]):
+        matrix = np.array(features, dtype=np.float32).reshape(len(entries), len(FEATURE_WEIGHTS))
+        tags = np.array([entry.scene for entry in entries])
+        groups = {scene: SearchGroup(np.flatnonzero(tags == scene), matrix) for scene in set(tags.tolist())}
+        if entries:
+            groups[ALL_SCENES] = SearchGroup(np.arange(len(entries)), matrix)
+        self._index = (entries, matrix, groups)
+    
+    def _load(self):
+        """Read the persisted index, recomputing descriptors from thumbnails if their version changed"""
+        path = self.index_dir / "index.json"
+        if not path.exists():
+            return
+        
+        try:
+            data = json.loads(path.read_text())
+            entries = [DecoyEntry(**entry) for entry in data["entries"]]
+            features = None
+            if data.get("version") == DESCRIPTOR_VERSION:
+                features = list(np.load(self.index_dir / "features.npy"))
+            # Another worker may have replaced one file but not yet the other
+            if features is None or len(features) != len(entries):
+                features = [self._describe_thumbnail(entry) for entry in entries]
+        except Exception as e:
+            logger.error(f"Rebuilding decoy index, could not load {path}: {e}")
+            return
+        self._set(entries, features)
+    
+    def _describe_thumbnail(self, entry: DecoyEntry) -> np.ndarray:
+        try:
+            pixels = decode_image((self.index_dir / "thumbnails" / entry.thumbnail).read_bytes()).image
+        except OSError:
+            raise ValueError(f"Missing thumbnail for {entry.path}")
+        return describe(pixels, entry.width / entry.height)
+    
+    def _save(self):
+        """Persist the index; written to temporary files and renamed, since workers share it"""
+        try:
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            suffix = f".{os.getpid()}.tmp"
+            
+            features_tmp = self.index_dir / f"features{suffix}.npy"
+            np.save(features_tmp, self.features)
+            index_tmp = self.index_dir / f"index.json{suffix}"
+            index_tmp.write_text(json.dumps({
+                "version": DESCRIPTOR_VERSION,
+                "entries": [asdict(entry) for entry in self.entries]
+            }))
+            
+            os.replace(features_tmp, self.index_dir / "features.npy")
+            os.replace(index_tmp, self.index_dir / "index.json")
+        except Exception as e:
+            logger.error(f"Failed to persist decoy index: {e}")
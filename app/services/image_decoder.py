@@ -0,0 +1,227 @@
+"""
+Image decoding for GeoMask
+
+Every still image is decoded through decode_image(), which picks the first
+available backend for the format from DECODER_BACKENDS: libjpeg-turbo
+(PyTurboJPEG, JPEG only), then OpenCV, then Pillow. A backend that can't
+be loaded is skipped, and one that fails on a file falls through to the
+next, so a missing native library only costs speed.
+
+Decoding works on in-memory buffers, can reduce by 2, 4 or 8 while
+decoding (JPEG scales in the DCT, so a reduced decode is several times
+faster than a full one), and applies the EXIF orientation in the same
+call, so every backend returns the same upright BGR pixels.
+"""
+
+import io
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from app.config import settings
+from app.utils.file_utils import detect_image_type
+from app.utils.logger import setup_logger
+from app.utils.metrics import record_decode
+
+logger = setup_logger(__name__)
+
+REDUCTIONS = (8, 4, 2)
+
+OPENCV_REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+
+@dataclass
+class DecodedImage:
+    """An upright BGR image and what it was decoded from"""
+    image: np.ndarray
+    # Upright size of the full-resolution image, (width, height)
+    full_size: Tuple[int, int]
+    format: str
+    backend: str
+    
+    @property
+    def scale(self) -> float:
+        """Full-resolution long edge / decoded long edge"""
+        return max(self.full_size) / max(self.image.shape[:2])
+
+
+class TurboJPEGBackend:
+    """libjpeg-turbo through PyTurboJPEG; decodes straight to BGR with DCT scaling"""
+    
+    name = "turbojpeg"
+    formats = {"jpeg"}
+    
+    def __init__(self):
+        from turbojpeg import TJPF_BGR, TurboJPEG
+        
+        self._jpeg = TurboJPEG()
+        self._pixel_format = TJPF_BGR
+    
+    def decode(self, data: bytes, factor: int) -> Optional[np.ndarray]:
+        return self._jpeg.decode(
+            data,
+            pixel_format=self._pixel_format,
+            scaling_factor=(1, factor) if factor > 1 else None
+        )
+
+
+class OpenCVBackend:
+    """cv2.imdecode; JPEG scales while decoding, other formats are resized after"""
+    
+    name = "opencv"
+    formats = {"jpeg", "png", "webp", "bmp", "tiff"}
+    
+    def decode(self, data: bytes, factor: int) -> Optional[np.ndarray]:
+        # Orientation is applied by decode_image, the same way for every backend
+        flags = OPENCV_REDUCED_FLAGS[factor] | cv2.IMREAD_IGNORE_ORIENTATION
+        return cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+
+
+class PillowBackend:
+    """Pillow; slowest, but reads every accepted format (GIFs decode their first frame)"""
+    
+    name = "pillow"
+    formats = {"jpeg", "png", "webp", "bmp", "tiff", "gif"}
+    
+    def decode(self, data: bytes, factor: int) -> Optional[np.ndarray]:
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+            if factor > 1:
+                # JPEGs decode at reduced scale; a no-op for other formats
+                image.draft("RGB", (width // factor, height // factor))
+                if image.size == (width, height):
+                    image = image.reduce(factor)
+            return cv2.cvtColor(np.asarray(image.convert("RGB")), cv2.COLOR_RGB2BGR)
+
+
+BACKENDS = {backend.name: backend for backend in (TurboJPEGBackend, OpenCVBackend, PillowBackend)}
+
+
+@lru_cache(maxsize=None)
+def available_backends() -> tuple:
+    """Load the backends in DECODER_BACKENDS order, skipping those whose library is missing"""
+    backends = []
+    for name in settings.DECODER_BACKENDS:
+        if name not in BACKENDS:
+            logger.warning(f"Unknown decoder backend {name!r} in DECODER_BACKENDS")
+            continue
+        try:
+            backends.append(BACKENDS[name]())
+        except Exception as e:
+            logger.info(f"Decoder backend {name} unavailable: {e}")
+    logger.info(f"Image decoders: {', '.join(backend.name for backend in backends) or 'none'}")
+    return tuple(backends)
+
+
+def backends_for(image_format: str) -> List[str]:
+    """Names of the loaded backends that decode a format, in the order they are tried"""
+    return [backend.name for backend in available_backends() if image_format in backend.formats]
+
+
+def decode_image(data: bytes, min_edge: Optional[int] = None, min_size: Optional[Tuple[int, int]] = None) -> DecodedImage:
+    """
+    Decode an encoded image to upright BGR pixels
+    
+    With min_edge or min_size, the image is reduced by the largest of 8, 4
+    or 2 that keeps it at least that large; callers resize the rest of the
+    way.
+    
+    Args:
+        data: Encoded image
+        min_edge: Smallest acceptable long edge of the result
+        min_size: Smallest acceptable (width, height) of the result
+    
+    Returns:
+        The decoded image
+    
+    Raises:
+        ValueError: If the format is not supported or no backend can decode it
+    """
+    mime_type = detect_image_type(data[:16])
+    if mime_type is None:
+        raise ValueError("Unsupported image format")
+    image_format = mime_type.split("/")[1]
+    
+    width, height, orientation = probe_image(data)
+    if orientation in (5, 6, 7, 8):
+        width, height = height, width
+    factor = _reduction(width, height, min_edge, min_size)
+    
+    for backend in available_backends():
+        if image_format not in backend.formats:
+            continue
+        try:
+            image = backend.decode(data, factor)
+        except Exception as e:
+            logger.warning(f"{backend.name} failed to decode {image_format}: {e}")
+            continue
+        if image is None:
+            continue
+        
+        record_decode(backend.name, image_format)
+        return DecodedImage(_orient(image, orientation), (width, height), image_format, backend.name)
+    
+    raise ValueError(f"Could not decode {image_format} image")
+
+
+def probe_image(data: bytes) -> Tuple[int, int, int]:
+    """
+    Read an image's stored size and EXIF orientation from its header alone
+    
+    Returns:
+        (width, height, orientation), with orientation 1 (upright) if unknown
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if image.format == "PNG":
+                # getexif() would decode the whole PNG looking for an eXIf chunk after the pixels
+                exif = Image.Exif()
+                if "exif" in image.info:
+                    exif.load(image.info["exif"])
+            else:
+                exif = image.getexif()
+            return image.size[0], image.size[1], int(exif.get(0x0112, 1))
+    except Exception as e:
+        logger.warning(f"Could not read image header: {e}")
+        return 0, 0, 1
+
+
+def _reduction(width: int, height: int, min_edge: Optional[int], min_size: Optional[Tuple[int, int]]) -> int:
+    """Largest reduction factor that keeps the image at least min_edge / min_size"""
+    if not (min_edge or min_size) or not width:
+        return 1
+    for factor in REDUCTIONS:
+        if min_edge and max(width, height) / factor < min_edge:
+            continue
+        if min_size and (width / factor < min_size[0] or height / factor < min_size[1]):
+            continue
+        return factor
+    return 1
+
+
+def _orient(image: np.ndarray, orientation: int) -> np.ndarray:
+    """Apply an EXIF orientation (1-8) to decoded pixels"""
+    if orientation == 2:
+        return cv2.flip(image, 1)
+    if orientation == 3:
+        return cv2.rotate(image, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(image, 0)
+    if orientation == 5:
+        return cv2.transpose(image)
+    if orientation == 6:
+        return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.flip(cv2.transpose(image), -1)
+    if orientation == 8:
+        return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return image
@@ -2,30 +2,80 @@
 Image processing service for GeoMask
 """
 
+import asyncio
+import hashlib
+import itertools
+import json
 import cv2
 import numpy as np
 from PIL import Image, ImageFilter, ImageEnhance
 import os
+import threading
 import time
+from dataclasses import dataclass, field
+from functools import cached_property
 from pathlib import Path
-from typing import Tuple, Optional, List
+from typing import Dict, Tuple, Optional, List
 import logging
 
 from app.config import settings
 from app.services.ai_generator import AIGenerator
-from app.utils.logger import setup_logger
+from app.services.animation import RegionTracker, is_clip, open_clip, run_frame_pipeline
+from app.services.decoy_library import DecoyLibrary, describe_windows
+from app.services.image_decoder import decode_image, probe_image
+from app.services.previews import PreviewExpired, PreviewStore
+from app.services.quality import FULL, QualityTier
+from app.services.sessions import BLEND_MODES, EditSession, SessionExpired, SessionStore
+from app.services.shared_cache import shared_cache
+from app.utils.file_index import processed_index
+from app.utils.file_reaper import file_reaper
+from app.utils.deadlines import check_deadline, remaining_budget
+from app.utils.file_utils import strip_metadata
+from app.utils.logger import SAMPLED, setup_logger
+from app.utils.metrics import record_cache, record_degradation, stage_timer
 
 logger = setup_logger(__name__)
 
+# Bump when detection changes so cached regions from older code are ignored
+DETECTION_CACHE_VERSION = 2
+
+
+@dataclass
+class ProcessResult:
+    """Outcome of a processing run"""
+    output_path: str
+    variants: Dict[int, str] = field(default_factory=dict)
+    original_file: Optional[str] = None
+    # Confident window regions found; 0 means the original was returned as is
+    windows: Optional[int] = None
+    confirmation_required: bool = False
+    # Quality tier the result was produced at
+    tier: str = "full"
+
 
 class ImageProcessor:
     """Handles image processing and background replacement"""
     
-    def __init__(self):
-        self.ai_generator = AIGenerator()
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    def __init__(
+        self, 
+        ai_generator: Optional[AIGenerator] = None, 
+        cache=None, 
+        sessions: Optional[SessionStore] = None, 
+        decoys: Optional[DecoyLibrary] = None
+    ):
+        self.ai_generator = ai_generator or AIGenerator()
+        self.cache = cache or shared_cache
+        self.previews = PreviewStore(self.cache)
+        self.sessions = sessions or SessionStore(self.cache)
+        # Optional local library tried before generating a background
+        self.decoys = decoys
         self.window_detector = self._load_window_detector()
     
+    @cached_property
+    def face_cascade(self) -> cv2.CascadeClassifier:
+        """Haar face cascade, parsed on first use rather than at construction"""
+        return cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    
     def _load_window_detector(self):
         """Load window detection model (placeholder for now)"""
         # In a real implementation, you'd load a trained model
@@ -36,8 +86,12 @@ class ImageProcessor:
         self, 
         image_path: str, 
         scene_type: str = "random", 
-        custom_prompt: str = ""
-    ) -> str:
+        custom_prompt: str = "",
+        variant_sizes: Optional[List[int]] = None,
+        digest: Optional[str] = None,
+        no_windows: Optional[str] = None,
+        tier: QualityTier = FULL
+    ) -> ProcessResult:
         """
         Process image to replace background with AI-generated scene
         
@@ -45,62 +99,820 @@ class ImageProcessor:
             image_path: Path to input image
             scene_type: Type of scene to generate
             custom_prompt: Custom scene description
-            
+            variant_sizes: Long-edge sizes of downscaled variants to produce
+            digest: SHA-256 of the file if already known (computed during upload)
+            no_windows: What to do without confident windows: strip, ask or full
+                (default NO_WINDOWS_ACTION)
+            tier: Quality tier, deciding the background source, the blend and
+                any resolution cap
+        
         Returns:
-            Path to processed image
+            Processing result with the output path and any variant paths
         """
         start_time = time.time()
         
         try:
-            logger.info(f"Processing image: {image_path}")
+            logger.info(f"Processing image: {image_path}", extra=SAMPLED)
+            
+            # Animations and videos go through the frame pipeline
+            if is_clip(image_path):
+                return await self._process_clip(image_path, scene_type, custom_prompt)
             
-            # Load image
-            original_image = cv2.imread(image_path)
-            if original_image is None:
-                raise ValueError(f"Could not load image: {image_path}")
+            # Load image; the digest keys cached detection results. CPU stages
+            # run in the executor so the event loop keeps serving other requests
+            with stage_timer("decode"):
+                data, original_image, scale = await asyncio.to_thread(self._load_image, image_path, tier.max_edge)
+            digest = digest or hashlib.sha256(data).hexdigest()
             
-            # Detect windows/backgrounds
-            window_regions = self._detect_windows(original_image)
+            # Detect windows/backgrounds; cached regions are in full-size pixels
+            check_deadline("detect")
+            with stage_timer("detect"):
+                if scale > 1:
+                    window_regions = await asyncio.to_thread(
+                        self._detect_windows, original_image, min_area=1000 / scale ** 2
+                    )
+                else:
+                    window_regions = await self._detect_windows_cached(original_image, digest)
             
             if not window_regions:
+                action = no_windows or settings.NO_WINDOWS_ACTION
+                if action != "full":
+                    result = await self._keep_original(image_path, data, original_image, action, variant_sizes)
+                    result.tier = tier.name
+                    return result
                 logger.warning("No windows detected, processing entire image")
                 window_regions = [(0, 0, original_image.shape[1], original_image.shape[0])]
             
-            # Generate replacement background
+            # Generate replacement background; short of time this falls back
+            # to a cached or procedural background instead of failing
+            check_deadline("generate")
             background_image = await self._generate_background(
-                original_image, scene_type, custom_prompt
+                original_image, scene_type, custom_prompt, window_regions, tier.background
             )
             
             # Replace backgrounds
-            processed_image = self._replace_backgrounds(
-                original_image, background_image, window_regions
-            )
+            check_deadline("blend")
+            with stage_timer("blend"):
+                processed_image = await asyncio.to_thread(
+                    self._replace_backgrounds, 
+                    original_image, 
+                    background_image, 
+                    window_regions, 
+                    blend=self._blend_within_deadline(tier.blend)
+                )
             
             # Save processed image
-            output_path = self._save_processed_image(processed_image, image_path)
+            check_deadline("save")
+            output_path = await asyncio.to_thread(self._save_processed_image, processed_image, image_path)
             
-            processing_time = time.time() - start_time
-            logger.info(f"Image processing completed in {processing_time:.2f}s")
+            # Derive resized variants from the in-memory composite
+            variants = {}
+            if variant_sizes:
+                variants = await self._save_variants(processed_image, output_path, variant_sizes)
             
-            return output_path
+            processing_time = time.time() - start_time
+            logger.info(f"Image processing completed in {processing_time:.2f}s", extra=SAMPLED)
             
+            return ProcessResult(
+                output_path=output_path, variants=variants, windows=len(window_regions), tier=tier.name
+            )
+        
         except Exception as e:
             logger.error(f"Error processing image: {e}")
             raise
     
-    def _detect_windows(self, image: np.ndarray) -> List[Tuple[int, int, int, int]]:
+    async def preview_image(
+        self, 
+        image_path: str, 
+        preview_id: str, 
+        scene_type: str = "random", 
+        custom_prompt: str = "", 
+        original_file: Optional[str] = None,
+        no_windows: Optional[str] = None,
+        tier: QualityTier = FULL
+    ) -> ProcessResult:
         """
-        Detect windows in the image
+        Produce a small WebP preview and keep what the full render needs
+        
+        The image is decoded at reduced scale (JPEG decodes natively at 1/2,
+        1/4 or 1/8) and detection and blending run at preview size. The
+        background is requested at full size and kept, with the regions, in
+        the preview store for PREVIEW_TTL_SECONDS. That lets render_preview()
+        produce exactly the chosen result without calling the provider again.
         
         Args:
-            image: Input image as numpy array
+            image_path: Path to input image (or clip; its first frame is previewed)
+            preview_id: Key to render the preview by later (the job ID)
+            scene_type: Type of scene to generate
+            custom_prompt: Custom scene description
+            original_file: Uploaded filename, reported by the render
+            no_windows: What to do without confident windows: strip, ask or full
+                (default NO_WINDOWS_ACTION)
+            tier: Quality tier; only its background source applies, since
+                previews are already small
+        
+        Returns:
+            Processing result with the preview path
+        """
+        try:
+            logger.info(f"Previewing image: {image_path}", extra=SAMPLED)
+            
+            with stage_timer("decode"):
+                image, scale = await asyncio.to_thread(self._decode_preview, image_path)
+            height, width = image.shape[:2]
+            
+            # Scale the area threshold so detection matches full resolution
+            check_deadline("detect")
+            with stage_timer("detect"):
+                regions = await asyncio.to_thread(self._detect_windows, image, min_area=1000 / scale ** 2)
+            action = no_windows or settings.NO_WINDOWS_ACTION
+            if not regions and action == "full":
+                regions = [(0, 0, width, height)]
+            
+            if regions:
+                check_deadline("generate")
+                background_data = await self._generate_background_data(
+                    round(width * scale), round(height * scale), scene_type, custom_prompt, image, regions, tier.background
+                )
+                check_deadline("blend")
+                with stage_timer("resize"):
+                    background = await asyncio.to_thread(self._decode_background, background_data, width, height)
+                
+                with stage_timer("blend"):
+                    preview = await asyncio.to_thread(self._replace_backgrounds, image, background, regions)
+            else:
+                # Nothing to replace: the render returns the original, so preview it as is
+                background_data = b""
+                preview = image
+            
+            check_deadline("save")
+            output_path = str(Path(settings.PROCESSED_DIR) / f"{Path(image_path).stem}_preview_{int(time.time())}.webp")
+            await asyncio.to_thread(
+                self._write_image, preview, output_path, [cv2.IMWRITE_WEBP_QUALITY, settings.PREVIEW_WEBP_QUALITY]
+            )
+            
+            # Regions as fractions, so the render can apply them at any resolution
+            record = {
+                "image_path": image_path,
+                "scene_type": scene_type,
+                "custom_prompt": custom_prompt,
+                "original_file": original_file,
+                "regions": [[x / width, y / height, w / width, h / height] for x, y, w, h in regions],
+                "no_windows": action
+            }
+            await self.previews.save(preview_id, record, background_data)
+            
+            return ProcessResult(
+                output_path=output_path, 
+                original_file=original_file, 
+                windows=len(regions), 
+                confirmation_required=not regions and action == "ask", 
+                tier=tier.name
+            )
+        
+        except Exception as e:
+            logger.error(f"Error previewing image: {e}")
+            raise
+    
+    async def render_preview(
+        self, 
+        preview_id: str, 
+        variant_sizes: Optional[List[int]] = None, 
+        tier: QualityTier = FULL
+    ) -> ProcessResult:
+        """
+        Render a preview at full resolution with its background and regions
+        
+        Args:
+            preview_id: ID the preview was stored under
+            variant_sizes: Long-edge sizes of downscaled variants to produce
+            tier: Quality tier; only its blend applies, as the background
+                and full resolution are what was previewed
+        
+        Returns:
+            Processing result with the output path and any variant paths
+        
+        Raises:
+            PreviewExpired: If the preview or its upload is gone
+        """
+        record, background_data = await self.previews.load(preview_id)
+        image_path = record["image_path"]
+        if not Path(image_path).exists():
+            raise PreviewExpired(preview_id)
+        
+        try:
+            logger.info(f"Rendering preview {preview_id}: {image_path}", extra=SAMPLED)
+            
+            if is_clip(image_path):
+                result = await self._process_clip(
+                    image_path, record["scene_type"], record["custom_prompt"], background_data=background_data
+                )
+                result.original_file = record["original_file"]
+                return result
+            
+            with stage_timer("decode"):
+                data, original_image, _ = await asyncio.to_thread(self._load_image, image_path)
+            height, width = original_image.shape[:2]
+            
+            if not record["regions"]:
+                result = await self._keep_original(
+                    image_path, data, original_image, record.get("no_windows", "strip"), variant_sizes
+                )
+                result.original_file = record["original_file"]
+                return result
+            
+            regions = []
+            for fx, fy, fw, fh in record["regions"]:
+                x, y = round(fx * width), round(fy * height)
+                regions.append((x, y, min(round(fw * width), width - x), min(round(fh * height), height - y)))
+            
+            with stage_timer("resize"):
+                background = await asyncio.to_thread(self._decode_background, background_data, width, height)
+            
+            check_deadline("blend")
+            with stage_timer("blend"):
+                processed_image = await asyncio.to_thread(
+                    self._replace_backgrounds, 
+                    original_image, 
+                    background, 
+                    regions, 
+                    blend=self._blend_within_deadline(tier.blend)
+                )
+            
+            check_deadline("save")
+            output_path = await asyncio.to_thread(self._save_processed_image, processed_image, image_path)
+            variants = {}
+            if variant_sizes:
+                variants = await self._save_variants(processed_image, output_path, variant_sizes)
+            
+            return ProcessResult(
+                output_path=output_path, 
+                variants=variants, 
+                original_file=record["original_file"], 
+                windows=len(regions), 
+                tier=tier.name
+            )
+        
+        except Exception as e:
+            logger.error(f"Error rendering preview {preview_id}: {e}")
+            raise
+    
+    async def open_session(
+        self, 
+        image_path: str, 
+        session_id: str, 
+        scene_type: str = "random", 
+        custom_prompt: str = "", 
+        original_file: Optional[str] = None, 
+        digest: Optional[str] = None
+    ) -> EditSession:
+        """
+        Decode an image once and keep it, its regions and a background in an editing session
+        
+        Args:
+            image_path: Path to input image
+            session_id: Key for later edits
+            scene_type: Type of scene for the first background
+            custom_prompt: Custom scene description
+            original_file: Uploaded filename
+            digest: SHA-256 of the file if already known (computed during upload)
+        
+        Returns:
+            The session, with its first composite in session.composite
+        """
+        if is_clip(image_path):
+            raise ValueError("Editing sessions support still images only")
+        
+        with stage_timer("decode"):
+            data = await asyncio.to_thread(Path(image_path).read_bytes)
+            image = decode_image(data).image
+        
+        with stage_timer("detect"):
+            regions = await self._detect_windows_cached(image, digest or hashlib.sha256(data).hexdigest())
+        if not regions:
+            regions = [(0, 0, image.shape[1], image.shape[0])]
+        
+        session = EditSession(session_id, image_path, original_file, image, [tuple(region) for region in regions])
+        await self.add_session_background(session, scene_type, custom_prompt)
+        return session
+    
+    async def get_session(self, session_id: str) -> EditSession:
+        """
+        Return a session, restoring it from the shared cache if this worker doesn't hold it
+        
+        A hot session is used unless another worker has since edited it.
+        Restoring re-decodes the original and the stored backgrounds, which
+        costs about as much as the original decode; edits after that are cheap.
+        
+        Raises:
+            SessionExpired: If the session or its upload is gone
+        """
+        record = await self.sessions.load(session_id)
+        session = self.sessions.get(session_id)
+        if session is not None and session.revision >= record["revision"]:
+            return session
+        
+        if not Path(record["image_path"]).exists():
+            raise SessionExpired(session_id)
+        backgrounds = await self.sessions.load_backgrounds(session_id, len(record["scenes"]))
+        session = await asyncio.to_thread(self._restore_session, session_id, record, backgrounds)
+        self.sessions.put(session)
+        return session
+    
+    def _restore_session(self, session_id: str, record: dict, backgrounds: List[bytes]) -> EditSession:
+        try:
+            with stage_timer("decode"):
+                image = decode_image(Path(record["image_path"]).read_bytes()).image
+        except (OSError, ValueError):
+            raise SessionExpired(session_id)
+        height, width = image.shape[:2]
+        
+        session = EditSession(
+            session_id, 
+            record["image_path"], 
+            record["original_file"], 
+            image, 
+            [tuple(region) for region in record["regions"]], 
+            feather=record["feather"], 
+            blend_mode=record["blend_mode"]
+        )
+        with stage_timer("resize"):
+            for data in backgrounds:
+                session.backgrounds.append(
+                    self._crop_regions(self._decode_background(data, width, height), session.regions, image)
+                )
+        session.scenes = record["scenes"]
+        session.assignments = record["assignments"]
+        session.output_path = record["output_path"]
+        session.revision = record["revision"]
+        
+        session.composite = image.copy()
+        with stage_timer("blend"):
+            for index in range(len(session.regions)):
+                self._blend_session_region(session, index)
+        return session
+    
+    async def add_session_background(self, session: EditSession, scene_type: str = "random", custom_prompt: str = "") -> int:
+        """
+        Generate another candidate background for a session
+        
+        The first background is shown in every region; later ones are only
+        kept until a recomposite assigns them.
+        
+        Returns:
+            Index of the new background
+        """
+        height, width = session.image.shape[:2]
+        data = await self._generate_background_data(
+            width, height, scene_type, custom_prompt, session.image, session.regions
+        )
+        
+        async with session.lock:
+            if len(session.backgrounds) >= settings.SESSION_MAX_BACKGROUNDS:
+                raise ValueError(f"Sessions are limited to {settings.SESSION_MAX_BACKGROUNDS} backgrounds")
+            
+            with stage_timer("resize"):
+                crops = await asyncio.to_thread(
+                    lambda: self._crop_regions(
+                        self._decode_background(data, width, height), session.regions, session.image
+                    )
+                )
+            session.backgrounds.append(crops)
+            session.scenes.append({"scene_type": scene_type, "custom_prompt": custom_prompt})
+            index = len(session.backgrounds) - 1
+            
+            if session.composite is None:
+                session.composite = session.image.copy()
+                with stage_timer("blend"):
+                    await asyncio.to_thread(
+                        lambda: [self._blend_session_region(session, i) for i in range(len(session.regions))]
+                    )
+                session.output_path = await asyncio.to_thread(self._save_session_output, session, False)
+            
+            session.revision += 1
+            self.sessions.put(session)
+            await self.sessions.save(session, background=(index, data))
+        return index
+    
+    async def recomposite(
+        self, 
+        session: EditSession, 
+        feather: Optional[int] = None, 
+        blend_mode: Optional[str] = None, 
+        background: Optional[int] = None, 
+        regions: Optional[List[int]] = None, 
+        preview: bool = False
+    ) -> List[int]:
+        """
+        Change a session's blend and re-blend only the affected regions
+        
+        A new feather or blend mode re-blends every region; a background
+        change re-blends only the regions it is assigned to (all by default).
+        Each region is blended from the kept original and background crops,
+        so nothing is decoded, detected or generated.
+        
+        Args:
+            session: Session to edit
+            feather: Blend mask blur in pixels
+            blend_mode: "radial" or "replace"
+            background: Index of the background to assign
+            regions: Indices of the regions to assign it to (default: all)
+            preview: Write a reduced-size WebP instead of a full-size JPEG
+        
+        Returns:
+            Indices of the regions that were re-blended
+        """
+        async with session.lock:
+            if blend_mode is not None and blend_mode not in BLEND_MODES:
+                raise ValueError(f"Unknown blend mode: {blend_mode}")
+            if background is not None and not 0 <= background < len(session.backgrounds):
+                raise ValueError(f"Unknown background: {background}")
+            targets = list(range(len(session.regions))) if regions is None else sorted(set(regions))
+            if any(not 0 <= index < len(session.regions) for index in targets):
+                raise ValueError(f"Unknown region in {regions}")
+            
+            affected = set()
+            if (feather is not None and feather != session.feather) or (blend_mode is not None and blend_mode != session.blend_mode):
+                session.feather = session.feather if feather is None else feather
+                session.blend_mode = blend_mode or session.blend_mode
+                session.masks.clear()
+                affected.update(range(len(session.regions)))
+            if background is not None:
+                for index in targets:
+                    if session.assignments[index] != background:
+                        session.assignments[index] = background
+                        affected.add(index)
+            
+            def render() -> str:
+                with stage_timer("blend"):
+                    for index in sorted(affected):
+                        self._blend_session_region(session, index)
+                return self._save_session_output(session, preview, sorted(affected))
+            
+            session.revision += 1
+            session.output_path = await asyncio.to_thread(render)
+            self.sessions.put(session)
+            await self.sessions.save(session)
+        return sorted(affected)
+    
+    def _crop_regions(
+        self, 
+        background: np.ndarray, 
+        regions: List[Tuple[int, int, int, int]], 
+        image: np.ndarray
+    ) -> List[np.ndarray]:
+        """
+        Copy out the parts of a background that regions show, so the full frame can be freed
+        
+        Crops are harmonized with their window once here, so edits never redo it.
+        """
+        return [self._harmonize(image[y:y+h, x:x+w], background[y:y+h, x:x+w]) for x, y, w, h in regions]
+    
+    def _blend_session_region(self, session: EditSession, index: int):
+        """Blend one region of a session's composite from its original and assigned background"""
+        x, y, w, h = session.regions[index]
+        crop = session.backgrounds[session.assignments[index]][index]
+        if index not in session.masks:
+            session.masks[index] = np.clip(self._create_blend_mask(crop, session.feather, session.blend_mode), 0, 1)
+        mask = session.masks[index]
+        session.composite[y:y+h, x:x+w] = cv2.blendLinear(session.image[y:y+h, x:x+w], crop, mask, 1 - mask)
+    
+    def _save_session_output(self, session: EditSession, preview: bool, updated: Optional[List[int]] = None) -> str:
+        """
+        Write a session's composite, as a full-size JPEG or a WebP of preview size
+        
+        The preview-size composite is kept in the session and only the
+        updated regions are resized into it, so previews of large photos
+        don't pay for downscaling the whole image on every edit.
+        """
+        # Kept current once it exists, so a later preview doesn't miss earlier edits
+        if preview or session.preview is not None:
+            with stage_timer("resize"):
+                self._update_session_preview(session, updated)
+        
+        name = f"{session.session_id}_r{session.revision}"
+        if not preview:
+            output_path = str(Path(settings.PROCESSED_DIR) / f"{name}.jpg")
+            self._write_jpeg(session.composite, output_path, 95)
+            return output_path
+        
+        output_path = str(Path(settings.PROCESSED_DIR) / f"{name}_preview.webp")
+        self._write_image(session.preview, output_path, [cv2.IMWRITE_WEBP_QUALITY, settings.PREVIEW_WEBP_QUALITY])
+        return output_path
+    
+    def _update_session_preview(self, session: EditSession, updated: Optional[List[int]]):
+        """Bring the preview-size composite up to date, resizing only the updated regions"""
+        height, width = session.composite.shape[:2]
+        ratio = min(1.0, settings.PREVIEW_MAX_EDGE / max(height, width))
+        size = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+        
+        if session.preview is None or session.preview.shape[1::-1] != size or updated is None:
+            session.preview = cv2.resize(session.composite, size, interpolation=cv2.INTER_AREA)
+            return
+        
+        scale_x, scale_y = width / size[0], height / size[1]
+        for index in updated:
+            x, y, w, h = session.regions[index]
+            # Whole preview pixels covering the region, and the full-size area they sample
+            px0, py0 = int(x / scale_x), int(y / scale_y)
+            px1, py1 = min(size[0], int(np.ceil((x + w) / scale_x))), min(size[1], int(np.ceil((y + h) / scale_y)))
+            fx0, fy0 = round(px0 * scale_x), round(py0 * scale_y)
+            fx1, fy1 = min(width, round(px1 * scale_x)), min(height, round(py1 * scale_y))
+            session.preview[py0:py1, px0:px1] = cv2.resize(
+                session.composite[fy0:fy1, fx0:fx1], (px1 - px0, py1 - py0), interpolation=cv2.INTER_AREA
+            )
+    
+    def _load_image(self, image_path: str, max_edge: int = 0) -> Tuple[bytes, np.ndarray, float]:
+        """
+        Read and decode an image, capping its long edge at max_edge if set
+        
+        Returns:
+            (encoded bytes, image, full-size long edge / decoded long edge)
+        """
+        data = Path(image_path).read_bytes()
+        if max_edge:
+            return (data, *self._decode_capped(data, max_edge))
+        return data, decode_image(data).image, 1.0
+    
+    def _decode_preview(self, image_path: str) -> Tuple[np.ndarray, float]:
+        """
+        Decode an image at preview size
+        
+        Returns:
+            (image with long edge at most PREVIEW_MAX_EDGE, full-size long edge / preview long edge)
+        """
+        if is_clip(image_path):
+            clip = open_clip(image_path)
+            try:
+                image = next(clip.frames(1), None)
+            finally:
+                clip.close()
+            full_edge = max(clip.size)
+        else:
+            return self._decode_capped(Path(image_path).read_bytes(), settings.PREVIEW_MAX_EDGE)
+        
+        if image is None:
+            raise ValueError(f"Could not load image: {image_path}")
+        
+        image = self._cap_size(image, settings.PREVIEW_MAX_EDGE)
+        return image, full_edge / max(image.shape[:2])
+    
+    def _decode_capped(self, data: bytes, max_edge: int) -> Tuple[np.ndarray, float]:
+        """
+        Decode an image with its long edge capped
+        
+        Returns:
+            (image with long edge at most max_edge, full-size long edge / decoded long edge)
+        """
+        # The largest reduction that stays above the cap
+        decoded = decode_image(data, min_edge=max_edge)
+        image = self._cap_size(decoded.image, max_edge)
+        return image, max(decoded.full_size) / max(image.shape[:2])
+    
+    def _cap_size(self, image: np.ndarray, max_edge: int) -> np.ndarray:
+        """Downscale an image whose long edge is over max_edge"""
+        height, width = image.shape[:2]
+        long_edge = max(height, width)
+        if long_edge <= max_edge:
+            return image
+        ratio = max_edge / long_edge
+        return cv2.resize(image, (max(1, round(width * ratio)), max(1, round(height * ratio))), interpolation=cv2.INTER_AREA)
+    
+    async def _generate_background_data(
+        self, 
+        width: int, 
+        height: int, 
+        scene_type: str, 
+        custom_prompt: str, 
+        image: Optional[np.ndarray] = None, 
+        regions: Optional[List[Tuple[int, int, int, int]]] = None, 
+        source: str = "fresh"
+    ) -> bytes:
+        """Pick or generate a background and return its encoded bytes, falling back to a gradient"""
+        try:
+            background_path = None
+            if image is not None:
+                background_path = await self._select_decoy(image, regions, scene_type, custom_prompt)
+            if background_path is None and source == "procedural":
+                return await asyncio.to_thread(self._encode_fallback_background, width, height)
+            if background_path is None:
+                with stage_timer("generate"):
+                    background_path = await self.ai_generator.generate_image(
+                        scene_type=scene_type,
+                        custom_prompt=custom_prompt,
+                        width=width,
+                        height=height,
+                        cached_only=source == "cached"
+                    )
+            return await asyncio.to_thread(Path(background_path).read_bytes)
+        except Exception as e:
+            logger.error(f"Error generating background: {e}")
+            return self._encode_fallback_background(width, height)
+    
+    def _encode_fallback_background(self, width: int, height: int) -> bytes:
+        """The gradient fallback background, JPEG-encoded"""
+        success, buffer = cv2.imencode(".jpg", self._create_fallback_background((height, width)))
+        return buffer.tobytes()
+    
+    def _decode_background(self, data: bytes, width: int, height: int) -> np.ndarray:
+        """Decode an encoded background and resize it to the target size"""
+        background = decode_image(data, min_size=(width, height)).image
+        return cv2.resize(background, (width, height), interpolation=cv2.INTER_AREA)
+    
+    async def _process_clip(
+        self, 
+        clip_path: str, 
+        scene_type: str, 
+        custom_prompt: str, 
+        background_data: Optional[bytes] = None
+    ) -> ProcessResult:
+        """
+        Mask every frame of an animation or short video
+        
+        One background is generated for the whole clip. Windows are detected
+        on keyframes and tracked in between (RegionTracker), and frames are
+        decoded, blended and encoded concurrently with bounded buffering.
+        Variants are not produced for clips.
+        
+        Args:
+            clip_path: Path to the animated image or video
+            scene_type: Type of scene to generate
+            custom_prompt: Custom scene description
+            background_data: Encoded background to use instead of generating one (from a preview)
+        
+        Returns:
+            Processing result with the output path
+        """
+        clip = await asyncio.to_thread(open_clip, clip_path)
+        output_path = str(
+            Path(settings.PROCESSED_DIR) / f"{Path(clip_path).stem}_geomasked_{int(time.time())}{clip.suffix}"
+        )
+        
+        try:
+            frames = clip.frames(settings.MAX_CLIP_FRAMES)
+            first = await asyncio.to_thread(next, frames, None)
+            if first is None:
+                raise ValueError(f"Could not load clip: {clip_path}")
+            
+            check_deadline("generate")
+            if background_data is not None:
+                background = await asyncio.to_thread(
+                    self._decode_background, background_data, first.shape[1], first.shape[0]
+                )
+            else:
+                background = await self._generate_background(first, scene_type, custom_prompt)
+            
+            check_deadline("blend")
+            start = time.perf_counter()
+            cancel = threading.Event()
+            render = asyncio.ensure_future(asyncio.to_thread(
+                self._render_clip, itertools.chain([first], frames), background, clip, output_path, cancel
+            ))
+            try:
+                count, keyframes = await asyncio.shield(render)
+            except asyncio.CancelledError:
+                # The render thread can't be cancelled: ask it to stop and wait
+                # (a frame at most) so the clip and output aren't freed under it
+                cancel.set()
+                await asyncio.wait([render])
+                raise
+            elapsed = time.perf_counter() - start
+        except BaseException:
+            self._discard_output(output_path)
+            raise
+        finally:
+            await asyncio.to_thread(clip.close)
+        
+        if count >= settings.MAX_CLIP_FRAMES:
+            logger.warning(f"Clip {clip_path} truncated to {settings.MAX_CLIP_FRAMES} frames")
+        
+        size = Path(output_path).stat().st_size
+        processed_index.register(output_path)
+        file_reaper.track(output_path, size=size)
+        
+        logger.info(
+            f"Masked {count} frames ({keyframes} keyframes) in {elapsed:.2f}s, {count / max(elapsed, 1e-6):.1f} fps",
+            extra=SAMPLED
+        )
+        return ProcessResult(output_path=output_path)
+    
+    def _render_clip(
+        self, 
+        frames, 
+        background: np.ndarray, 
+        clip, 
+        output_path: str, 
+        cancel: Optional[threading.Event] = None
+    ) -> Tuple[int, int]:
+        """Run the frame pipeline into output_path until done or cancelled, returning (frames, keyframes)"""
+        tracker = RegionTracker(self._detect_windows, settings.CLIP_KEYFRAME_INTERVAL)
+        masks: Dict[Tuple[int, int], Tuple[np.ndarray, np.ndarray]] = {}
+        luts: Dict[Tuple[int, int], np.ndarray] = {}
+        
+        def mask_frame(frame: np.ndarray) -> np.ndarray:
+            with stage_timer("detect"):
+                regions = tracker.update(frame)
+            with stage_timer("blend"):
+                return self._blend_frame(frame, background, regions, masks, luts)
+        
+        writer = clip.open_writer(output_path)
+        try:
+            count = run_frame_pipeline(frames, mask_frame, writer.write, settings.CLIP_QUEUE_FRAMES, cancel)
+        finally:
+            writer.close()
+        return count, tracker.keyframes
+    
+    def _blend_frame(
+        self, 
+        frame: np.ndarray, 
+        background: np.ndarray, 
+        regions: List[Tuple[int, int, int, int]], 
+        masks: Dict[Tuple[int, int], Tuple[np.ndarray, np.ndarray]], 
+        luts: Optional[Dict[Tuple[int, int], np.ndarray]] = None
+    ) -> np.ndarray:
+        """
+        Blend the background into tracked regions of one frame
+        
+        Same result as _replace_backgrounds, but blend masks and lighting
+        LUTs are built once per region size and reused for every frame of the
+        clip (a re-detected region gets new ones, so the lighting is matched
+        again without flickering in between), and regions tracked partly out
+        of the frame are clipped together with their mask.
+        
+        Args:
+            frame: BGR frame
+            background: Background the size of the frame
+            regions: Regions (x, y, width, height), possibly extending past the frame
+            masks: Per-clip cache of (original weight, background weight) by region size
+            luts: Per-clip cache of harmonization LUTs by region size
+        
+        Returns:
+            Blended frame
+        """
+        height, width = frame.shape[:2]
+        result = frame.copy()
+        
+        for x, y, w, h in regions:
+            x0, y0 = max(x, 0), max(y, 0)
+            x1, y1 = min(x + w, width), min(y + h, height)
+            if x1 <= x0 or y1 <= y0:
+                continue
+            
+            if (w, h) not in masks:
+                mask = np.clip(self._create_blend_mask(np.empty((h, w), np.uint8)), 0, 1)
+                masks[(w, h)] = (mask, 1 - mask)
+            keep, replace = (m[y0 - y:y1 - y, x0 - x:x1 - x] for m in masks[(w, h)])
             
+            window, decoy = frame[y0:y1, x0:x1], background[y0:y1, x0:x1]
+            lut = luts.get((w, h)) if luts is not None else None
+            if lut is None:
+                lut = self._harmonize_lut(window, decoy)
+                if luts is not None:
+                    luts[(w, h)] = lut
+            if lut is not None:
+                decoy = cv2.LUT(decoy, lut)
+            
+            result[y0:y1, x0:x1] = cv2.blendLinear(window, decoy, keep, replace)
+        
+        return result
+    
+    def _detect_windows(self, image: np.ndarray, min_area: float = 1000) -> List[Tuple[int, int, int, int]]:
+        """
+        Detect windows in the image, keeping only confident ones
+        
+        Args:
+            image: Input image as numpy array
+            min_area: Smallest contour area kept, in pixels
+        
         Returns:
             List of window regions (x, y, width, height)
         """
+        return self._confident_regions(self._detect_window_candidates(image, min_area))
+    
+    def _detect_window_candidates(
+        self, 
+        image: np.ndarray, 
+        min_area: float = 1000
+    ) -> List[Tuple[Tuple[int, int, int, int], float]]:
+        """
+        Find window-like regions and score how much each looks like a window
+        
+        The score combines how much of its bounding box the contour fills,
+        whether it simplifies to a quadrilateral, and how different the region
+        is in brightness from the rest of the image (windows are usually much
+        lighter or darker than the wall around them).
+        
+        Args:
+            image: Input image as numpy array
+            min_area: Smallest contour area kept, in pixels
+        
+        Returns:
+            List of (region, score) pairs, score between 0 and 1
+        """
         try:
             # Convert to grayscale
             gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            mean = cv2.mean(gray)[0]
             
             # Edge detection
             edges = cv2.Canny(gray, 50, 150)
@@ -108,12 +920,12 @@ class ImageProcessor:
             # Find contours
             contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
             
-            window_regions = []
+            candidates = []
             
             for contour in contours:
                 # Filter by area
                 area = cv2.contourArea(contour)
-                if area < 1000:  # Minimum area threshold
+                if area < min_area:  # Minimum area threshold
                     continue
                 
                 # Get bounding rectangle
@@ -121,19 +933,77 @@ class ImageProcessor:
                 
                 # Filter by aspect ratio (windows are usually rectangular)
                 aspect_ratio = w / h
-                if 0.5 < aspect_ratio < 3.0:
-                    window_regions.append((x, y, w, h))
-            
-            # Merge overlapping regions
-            window_regions = self._merge_overlapping_regions(window_regions)
-            
-            logger.info(f"Detected {len(window_regions)} window regions")
-            return window_regions
+                if not 0.5 < aspect_ratio < 3.0:
+                    continue
+                
+                fill = min(area / (w * h), 1.0)
+                corners = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+                # A fifth corner allows for one corner cut off by a frame or curtain
+                quad = 1.0 if len(corners) in (4, 5) else 0.0
+                contrast = min(abs(cv2.mean(gray[y:y + h, x:x + w])[0] - mean) / 64, 1.0)
+                score = 0.45 * fill + 0.35 * quad + 0.2 * contrast
+                candidates.append(((x, y, w, h), round(score, 3)))
             
+            return candidates
+        
         except Exception as e:
             logger.error(f"Error detecting windows: {e}")
             return []
     
+    def _confident_regions(
+        self, 
+        candidates: List[Tuple[Tuple[int, int, int, int], float]]
+    ) -> List[Tuple[int, int, int, int]]:
+        """Drop candidates scoring below DETECTION_CONFIDENCE and merge the rest"""
+        threshold = settings.DETECTION_CONFIDENCE
+        kept = [region for region, score in candidates if score >= threshold]
+        
+        # Merge overlapping regions
+        window_regions = self._merge_overlapping_regions(kept)
+        
+        logger.info(
+            f"Detected {len(window_regions)} window regions "
+            f"({len(candidates) - len(kept)} candidates below confidence {threshold})", 
+            extra=SAMPLED
+        )
+        return window_regions
+    
+    async def _detect_windows_cached(self, image: np.ndarray, digest: str) -> List[Tuple[int, int, int, int]]:
+        """
+        Detect windows, reusing results for identical uploads from any worker
+        
+        Scored candidates are cached rather than the final regions, so a
+        changed DETECTION_CONFIDENCE applies to cached uploads too.
+        
+        Args:
+            image: Decoded input image
+            digest: SHA-256 of the encoded upload
+        
+        Returns:
+            List of window regions (x, y, width, height)
+        """
+        ttl = settings.DETECTION_CACHE_TTL_SECONDS
+        if ttl <= 0:
+            return await asyncio.to_thread(self._detect_windows, image)
+        
+        key = f"detection:{DETECTION_CACHE_VERSION}:{digest}"
+        try:
+            cached = await self.cache.get(key)
+        except Exception as e:
+            logger.error(f"Detection cache lookup failed: {e}")
+            cached = None
+        record_cache("detection", cached is not None)
+        if cached is not None:
+            candidates = [(tuple(entry[:4]), entry[4]) for entry in json.loads(cached)]
+            return self._confident_regions(candidates)
+        
+        candidates = await asyncio.to_thread(self._detect_window_candidates, image)
+        try:
+            await self.cache.set(key, json.dumps([[*region, score] for region, score in candidates]).encode(), ttl)
+        except Exception as e:
+            logger.error(f"Detection cache store failed: {e}")
+        return self._confident_regions(candidates)
+    
     def _merge_overlapping_regions(self, regions: List[Tuple[int, int, int, int]]) -> List[Tuple[int, int, int, int]]:
         """Merge overlapping window regions"""
         if not regions:
@@ -170,16 +1040,24 @@ class ImageProcessor:
         self, 
         original_image: np.ndarray, 
         scene_type: str, 
-        custom_prompt: str
+        custom_prompt: str, 
+        window_regions: Optional[List[Tuple[int, int, int, int]]] = None, 
+        source: str = "fresh"
     ) -> np.ndarray:
         """
         Generate background image using AI
         
+        With a decoy library, the library image best matching the lighting
+        of the windows is used instead, if there is one for the scene.
+        
         Args:
             original_image: Original image for reference
             scene_type: Type of scene to generate
             custom_prompt: Custom scene description
-            
+            window_regions: Detected windows, whose lighting a library image should match
+            source: Without a library image: fresh (provider), cached (a
+                cached provider image or the fallback) or procedural
+        
         Returns:
             Generated background image
         """
@@ -187,29 +1065,52 @@ class ImageProcessor:
             # Get dimensions from original image
             height, width = original_image.shape[:2]
             
-            # Generate AI image
-            background_path = await self.ai_generator.generate_image(
-                scene_type=scene_type,
-                custom_prompt=custom_prompt,
-                width=width,
-                height=height
-            )
-            
-            # Load generated image
-            background_image = cv2.imread(background_path)
-            if background_image is None:
-                raise ValueError(f"Could not load generated background: {background_path}")
+            background_path = await self._select_decoy(original_image, window_regions, scene_type, custom_prompt)
+            if background_path is None and source == "procedural":
+                return await asyncio.to_thread(self._create_fallback_background, (height, width))
             
-            # Resize to match original dimensions
-            background_image = cv2.resize(background_image, (width, height))
+            # Generate AI image
+            if background_path is None:
+                with stage_timer("generate"):
+                    background_path = await self.ai_generator.generate_image(
+                        scene_type=scene_type,
+                        custom_prompt=custom_prompt,
+                        width=width,
+                        height=height,
+                        cached_only=source == "cached"
+                    )
             
-            return background_image
+            # Load generated image and resize it to match the original
+            def load() -> np.ndarray:
+                with stage_timer("decode"):
+                    background_image = decode_image(Path(background_path).read_bytes(), min_size=(width, height)).image
+                with stage_timer("resize"):
+                    return cv2.resize(background_image, (width, height))
             
+            return await asyncio.to_thread(load)
+        
         except Exception as e:
             logger.error(f"Error generating background: {e}")
             # Fallback to a simple gradient
             return self._create_fallback_background(original_image.shape[:2])
     
+    async def _select_decoy(
+        self, 
+        image: np.ndarray, 
+        regions: Optional[List[Tuple[int, int, int, int]]], 
+        scene_type: str, 
+        custom_prompt: str
+    ) -> Optional[str]:
+        """Library image closest to the windows' lighting; None without a library, a match, or for custom prompts"""
+        if self.decoys is None or custom_prompt:
+            return None
+        try:
+            with stage_timer("generate"):
+                return await self.decoys.select(scene_type, describe_windows(image, regions))
+        except Exception as e:
+            logger.error(f"Decoy selection failed: {e}")
+            return None
+    
     def _create_fallback_background(self, shape: Tuple[int, int]) -> np.ndarray:
         """Create a fallback background if AI generation fails"""
         height, width = shape
@@ -233,7 +1134,8 @@ class ImageProcessor:
         self, 
         original_image: np.ndarray, 
         background_image: np.ndarray, 
-        window_regions: List[Tuple[int, int, int, int]]
+        window_regions: List[Tuple[int, int, int, int]],
+        blend: str = "radial"
     ) -> np.ndarray:
         """
         Replace backgrounds in detected window regions
@@ -242,7 +1144,11 @@ class ImageProcessor:
             original_image: Original image
             background_image: Generated background image
             window_regions: List of window regions to replace
-            
+            blend: "radial" fades from the original at the centre to the
+                background at the corners; "edges" alpha-blends only a band
+                along each window's edges and "paste" none at all, both several
+                times cheaper
+        
         Returns:
             Processed image with replaced backgrounds
         """
@@ -254,8 +1160,14 @@ class ImageProcessor:
                 # Extract window region
                 window_region = original_image[y:y+h, x:x+w]
                 
-                # Extract corresponding background region
-                bg_region = background_image[y:y+h, x:x+w]
+                # Extract corresponding background region, matched to the window's lighting
+                bg_region = self._harmonize(window_region, background_image[y:y+h, x:x+w])
+                if blend == "paste":
+                    processed_image[y:y+h, x:x+w] = bg_region
+                    continue
+                if blend == "edges":
+                    processed_image[y:y+h, x:x+w] = self._blend_edges(window_region, bg_region)
+                    continue
                 
                 # Create mask for smooth blending
                 mask = self._create_blend_mask(window_region)
@@ -267,29 +1179,80 @@ class ImageProcessor:
                 processed_image[y:y+h, x:x+w] = blended_region
             
             return processed_image
-            
+        
         except Exception as e:
             logger.error(f"Error replacing backgrounds: {e}")
             return original_image
     
-    def _create_blend_mask(self, region: np.ndarray) -> np.ndarray:
-        """Create a mask for smooth blending"""
-        height, width = region.shape[:2]
+    def _blend_within_deadline(self, blend: str) -> str:
+        """The blend to use, or "paste" if the request has no time left for blending"""
+        if blend == "paste" or remaining_budget() > settings.DEADLINE_RESERVE_SECONDS:
+            return blend
+        record_degradation("blend")
+        logger.warning("Deadline close, pasting backgrounds without blending")
+        return "paste"
+    
+    def _blend_edges(self, window: np.ndarray, background: np.ndarray, band: int = 15) -> np.ndarray:
+        """
+        Show the background in a window, alpha-blending only a band along its edges
         
-        # Create a gradient mask
-        mask = np.zeros((height, width), dtype=np.float32)
+        The original fades out linearly over band pixels from each edge. Only
+        the four strips are weighted, so the cost is proportional to the
+        perimeter rather than the area.
+        """
+        blended = background.copy()
+        height, width = blended.shape[:2]
+        band = min(band, height // 2, width // 2)
+        if band < 1:
+            return blended
         
-        # Create radial gradient from center
-        center_y, center_x = height // 2, width // 2
-        max_distance = np.sqrt(center_x**2 + center_y**2)
+        # Weight of the original at each distance from the edge
+        ramp = 1.0 - (np.arange(band, dtype=np.float32) + 0.5) / band
+        strips = [
+            (np.s_[:band, :], np.repeat(ramp[:, None], width, 1)),
+            (np.s_[height - band:, :], np.repeat(ramp[::-1, None], width, 1)),
+            (np.s_[:, :band], np.repeat(ramp[None, :], height, 0)),
+            (np.s_[:, width - band:], np.repeat(ramp[None, ::-1], height, 0))
+        ]
+        for strip, weight in strips:
+            blended[strip] = cv2.blendLinear(window[strip], blended[strip], weight, 1.0 - weight)
+        return blended
+    
+    def _create_blend_mask(self, region: np.ndarray, feather: int = 15, mode: str = "radial") -> np.ndarray:
+        """
+        Create a mask for smooth blending
         
-        for y in range(height):
-            for x in range(width):
-                distance = np.sqrt((x - center_x)**2 + (y - center_y)**2)
-                mask[y, x] = 1.0 - (distance / max_distance)
+        The mask is the weight of the original image (1 keeps it, 0 shows the
+        background). "radial" fades from the original at the centre to the
+        background at the corners; "replace" shows the background everywhere
+        except a band of feather pixels along the edges.
+        
+        Args:
+            region: Region the mask is for (only its shape is used)
+            feather: Gaussian blur kernel size in pixels, softening the mask
+            mode: Blend mode, "radial" or "replace"
+        
+        Returns:
+            float32 mask the size of the region
+        """
+        height, width = region.shape[:2]
+        ys, xs = np.ogrid[:height, :width]
+        
+        if mode == "replace":
+            # Distance to the nearest edge, so the original shows only along the border
+            edge = np.minimum(np.minimum(xs, width - 1 - xs), np.minimum(ys, height - 1 - ys))
+            mask = np.clip(1.0 - edge / max(feather, 1), 0, 1).astype(np.float32)
+        else:
+            # Radial gradient from center
+            center_y, center_x = height // 2, width // 2
+            max_distance = np.sqrt(center_x**2 + center_y**2)
+            distance = np.sqrt((xs - center_x)**2 + (ys - center_y)**2)
+            mask = (1.0 - distance / max_distance).astype(np.float32)
         
         # Apply Gaussian blur for smoother edges
-        mask = cv2.GaussianBlur(mask, (15, 15), 0)
+        kernel = max(1, int(feather)) | 1
+        if kernel > 1:
+            mask = cv2.GaussianBlur(mask, (kernel, kernel), 0)
         
         return mask
     
@@ -312,6 +1275,103 @@ class ImageProcessor:
         
         return blended
     
+    def _harmonize(self, window: np.ndarray, decoy: np.ndarray) -> np.ndarray:
+        """Match a decoy region's exposure and white balance to the window it replaces"""
+        lut = self._harmonize_lut(window, decoy)
+        return decoy if lut is None else cv2.LUT(decoy, lut)
+    
+    def _harmonize_lut(self, window: np.ndarray, decoy: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Build a per-channel lookup table moving a decoy's colour statistics towards a window's
+        
+        The mean and spread of each channel are measured on subsampled
+        copies (at most HARMONIZE_SAMPLE_EDGE pixels on the long edge), and
+        the decoy's values are mapped linearly onto the window's, blended with
+        the identity by HARMONIZE_STRENGTH. Only means and spreads are matched,
+        not whole histograms, so the decoy takes on the photo's exposure and
+        colour cast but not the colours of the view it hides. Applying the
+        table is a single cv2.LUT per region, whatever its size.
+        
+        Args:
+            window: Original window pixels
+            decoy: Background pixels that will replace them
+        
+        Returns:
+            (1, 256, 3) uint8 table for cv2.LUT, None if harmonization is off
+        """
+        strength = settings.HARMONIZE_STRENGTH
+        if strength <= 0 or window.size == 0 or decoy.size == 0:
+            return None
+        
+        def sample(image: np.ndarray) -> np.ndarray:
+            step = max(1, max(image.shape[:2]) // max(1, settings.HARMONIZE_SAMPLE_EDGE))
+            return np.ascontiguousarray(image[::step, ::step])
+        
+        window_mean, window_std = cv2.meanStdDev(sample(window))
+        decoy_mean, decoy_std = cv2.meanStdDev(sample(decoy))
+        
+        # Flat regions have no spread to match; keep the gain sane either way
+        gain = np.where(decoy_std > 1, window_std / np.maximum(decoy_std, 1), 1.0).clip(0.5, 2.0)
+        values = np.arange(256, dtype=np.float32)[:, None]
+        matched = window_mean.T + (values - decoy_mean.T) * gain.T
+        table = values + strength * (matched - values)
+        return np.clip(np.rint(table), 0, 255).astype(np.uint8)[None]
+    
+    async def _keep_original(
+        self, 
+        image_path: str, 
+        data: bytes, 
+        image: np.ndarray, 
+        action: str, 
+        variant_sizes: Optional[List[int]] = None
+    ) -> ProcessResult:
+        """
+        Return an image without confident windows unchanged, minus its metadata
+        
+        Nothing is generated or blended. JPEG and PNG uploads are copied with
+        their metadata removed; other formats, and JPEGs whose EXIF orientation
+        rotates them, are re-encoded from the decoded (upright) pixels.
+        
+        Args:
+            image_path: Path to input image
+            data: Encoded input image
+            image: Decoded input image
+            action: NO_WINDOWS_ACTION that applies; "ask" flags the result for confirmation
+            variant_sizes: Long-edge sizes of downscaled variants to produce
+        
+        Returns:
+            Processing result with the stripped original and any variant paths
+        """
+        logger.info(f"No confident windows in {image_path}, returning it unchanged ({action})", extra=SAMPLED)
+        
+        def save() -> str:
+            stripped = None
+            if probe_image(data)[2] == 1:
+                stripped = strip_metadata(data)
+            
+            stem = f"{Path(image_path).stem}_unchanged_{int(time.time())}"
+            if stripped is not None:
+                suffix = ".png" if stripped.startswith(b"\x89PNG") else ".jpg"
+                output_path = str(Path(settings.PROCESSED_DIR) / f"{stem}{suffix}")
+                self._write_bytes(stripped, output_path)
+            else:
+                output_path = str(Path(settings.PROCESSED_DIR) / f"{stem}.jpg")
+                self._write_jpeg(image, output_path, 95)
+            return output_path
+        
+        output_path = await asyncio.to_thread(save)
+        
+        variants = {}
+        if variant_sizes:
+            variants = await self._save_variants(image, output_path, variant_sizes)
+        
+        return ProcessResult(
+            output_path=output_path, 
+            variants=variants, 
+            windows=0, 
+            confirmation_required=action == "ask"
+        )
+    
     def _save_processed_image(self, image: np.ndarray, original_path: str) -> str:
         """Save processed image to output directory"""
         try:
@@ -322,38 +1382,144 @@ class ImageProcessor:
             output_path = Path(settings.PROCESSED_DIR) / output_filename
             
             # Save image with high quality
-            cv2.imwrite(str(output_path), image, [cv2.IMWRITE_JPEG_QUALITY, 95])
+            self._write_jpeg(image, str(output_path), 95)
             
-            logger.info(f"Processed image saved: {output_path}")
+            logger.info(f"Processed image saved: {output_path}", extra=SAMPLED)
             return str(output_path)
-            
+        
         except Exception as e:
             logger.error(f"Error saving processed image: {e}")
             raise
     
+    def _build_variant_chain(
+        self, 
+        image: np.ndarray, 
+        sizes: List[int]
+    ) -> List[Tuple[int, np.ndarray]]:
+        """
+        Downscale an image into a chain of variants
+        
+        Each variant is resized from the previous (larger) one with area
+        interpolation, so every step only touches the pixels it needs.
+        Sizes that would upscale the image are skipped.
+        
+        Args:
+            image: Full-resolution image
+            sizes: Target long-edge sizes in pixels
+        
+        Returns:
+            List of (size, image) pairs, largest first
+        """
+        chain = []
+        current = image
+        
+        for size in sorted({int(s) for s in sizes if int(s) > 0}, reverse=True):
+            height, width = current.shape[:2]
+            long_edge = max(height, width)
+            if size >= long_edge:
+                continue
+            
+            scale = size / long_edge
+            new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            current = cv2.resize(current, new_size, interpolation=cv2.INTER_AREA)
+            chain.append((size, current))
+        
+        return chain
+    
+    async def _save_variants(
+        self, 
+        image: np.ndarray, 
+        output_path: str, 
+        sizes: List[int]
+    ) -> Dict[int, str]:
+        """
+        Save downscaled variants of a processed image next to it
+        
+        Args:
+            image: Processed full-resolution image
+            output_path: Path of the saved full-resolution image
+            sizes: Target long-edge sizes in pixels
+        
+        Returns:
+            Mapping of long-edge size to variant path
+        """
+        output = Path(output_path)
+        with stage_timer("resize"):
+            chain = self._build_variant_chain(image, sizes)
+        
+        # JPEG encoding releases the GIL, so variants encode in parallel.
+        # to_thread carries the request context, so stage timings still count.
+        paths = [str(output.with_name(f"{output.stem}_{size}{output.suffix}")) for size, _ in chain]
+        results = await asyncio.gather(*[
+            asyncio.to_thread(self._write_variant, variant, path)
+            for (_, variant), path in zip(chain, paths)
+        ], return_exceptions=True)
+        
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            # Don't leave a partial set of variants behind
+            for path in paths:
+                self._discard_output(path)
+            logger.error(f"Failed to save {len(errors)} of {len(paths)} variants for {output.name}: {errors[0]}")
+            raise errors[0]
+        
+        logger.info(f"Saved {len(paths)} variants for {output.name}", extra=SAMPLED)
+        return {size: path for (size, _), path in zip(chain, paths)}
+    
+    def _discard_output(self, path: str):
+        """Delete an output file and drop it from the download index"""
+        Path(path).unlink(missing_ok=True)
+        processed_index.remove(Path(path).name)
+        file_reaper.forget(path)
+    
+    def _write_variant(self, image: np.ndarray, path: str):
+        """Encode and write a single variant"""
+        self._write_jpeg(image, path, settings.VARIANT_JPEG_QUALITY)
+    
+    def _write_jpeg(self, image: np.ndarray, path: str, quality: int):
+        """Encode a JPEG, write it and register it for download"""
+        self._write_image(image, path, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    
+    def _write_image(self, image: np.ndarray, path: str, params: List[int]):
+        """Encode an image in the format of its extension, write it and register it for download"""
+        with stage_timer("encode"):
+            success, buffer = cv2.imencode(Path(path).suffix, image, params)
+        if not success:
+            raise ValueError(f"Could not encode image: {path}")
+        
+        self._write_bytes(buffer.tobytes(), path)
+    
+    def _write_bytes(self, data: bytes, path: str):
+        """Write an encoded image and register it for download"""
+        with stage_timer("save"):
+            with open(path, "wb") as f:
+                f.write(data)
+        
+        # Hash the encoded buffer now so downloads never re-read the file
+        processed_index.register(path, data)
+        file_reaper.track(path, size=len(data))
+    
     def enhance_image(self, image_path: str) -> str:
         """Enhance image quality"""
         try:
-            # Load image with PIL for enhancement
-            with Image.open(image_path) as img:
-                # Convert to RGB if necessary
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Enhance sharpness
-                enhancer = ImageEnhance.Sharpness(img)
-                img = enhancer.enhance(1.2)
-                
-                # Enhance contrast
-                enhancer = ImageEnhance.Contrast(img)
-                img = enhancer.enhance(1.1)
-                
-                # Save enhanced image
-                enhanced_path = image_path.replace('.jpg', '_enhanced.jpg')
-                img.save(enhanced_path, 'JPEG', quality=95)
-                
-                return enhanced_path
-                
+            # Decode upright, then hand the pixels to PIL for enhancement
+            image = decode_image(Path(image_path).read_bytes()).image
+            img = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+            
+            # Enhance sharpness
+            enhancer = ImageEnhance.Sharpness(img)
+            img = enhancer.enhance(1.2)
+            
+            # Enhance contrast
+            enhancer = ImageEnhance.Contrast(img)
+            img = enhancer.enhance(1.1)
+            
+            # Save enhanced image
+            enhanced_path = image_path.replace('.jpg', '_enhanced.jpg')
+            img.save(enhanced_path, 'JPEG', quality=95)
+            
+            return enhanced_path
+        
         except Exception as e:
             logger.error(f"Error enhancing image: {e}")
             return image_path 
\ No newline at end of file
@@ -0,0 +1,59 @@
+"""
+Job status tracking for GeoMask
+"""
+
+import json
+import re
+from datetime import datetime
+from typing import Optional
+
+from app.config import settings
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+JOB_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+
+class JobStore:
+    """
+    Processing job records kept in the shared cache
+    
+    Any worker can read a job another worker is running, so a client whose
+    connection dropped can poll for the result. Failures to record status
+    are logged and never fail the request itself.
+    """
+    
+    def __init__(self, cache, ttl: Optional[float] = None):
+        self.cache = cache
+        self.ttl = ttl if ttl is not None else settings.FILE_TTL_HOURS * 3600
+    
+    async def update(self, job_id: str, status: str, created_at: datetime, **fields) -> dict:
+        """
+        Write the current state of a job
+        
+        Args:
+            job_id: Job identifier
+            status: processing, completed or failed
+            created_at: When the job was accepted
+            **fields: Extra fields (progress, result, error)
+        
+        Returns:
+            The stored record
+        """
+        record = {"job_id": job_id, "status": status, "created_at": created_at.isoformat(), **fields}
+        try:
+            await self.cache.set(f"job:{job_id}", json.dumps(record).encode(), self.ttl)
+        except Exception as e:
+            logger.error(f"Failed to record status of job {job_id}: {e}")
+        return record
+    
+    async def get(self, job_id: str) -> Optional[dict]:
+        """Return a job record, None if unknown or expired"""
+        data = await self.cache.get(f"job:{job_id}")
+        return json.loads(data) if data is not None else None
+
+
+def is_valid_job_id(job_id: str) -> bool:
+    """Job IDs from URLs and forms become cache keys, so keep them simple"""
+    return bool(JOB_ID_PATTERN.match(job_id))
@@ -0,0 +1,59 @@
+"""
+Preview records for GeoMask
+"""
+
+import json
+from typing import Optional, Tuple
+
+from app.config import settings
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class PreviewExpired(LookupError):
+    """A preview is unknown, has expired, or its upload has been removed"""
+
+
+class PreviewStore:
+    """
+    What a preview needs to be rendered later, kept in the shared cache
+    
+    Each preview keeps its generated background (encoded, as the provider
+    returned it) and a record of the upload path, scene and regions, so the
+    full-resolution render from any worker reuses exactly what the user
+    saw. Failing to store a preview is logged; rendering it then reports it
+    as expired.
+    """
+    
+    def __init__(self, cache, ttl: Optional[float] = None):
+        self.cache = cache
+        self.ttl = ttl if ttl is not None else settings.PREVIEW_TTL_SECONDS
+    
+    async def save(self, preview_id: str, record: dict, background: bytes):
+        """
+        Store a preview
+        
+        Args:
+            preview_id: Key to render the preview by (the job ID)
+            record: Upload path, scene and regions
+            background: Encoded background image
+        """
+        try:
+            await self.cache.set(f"preview:{preview_id}:background", background, self.ttl)
+            await self.cache.set(f"preview:{preview_id}", json.dumps(record).encode(), self.ttl)
+        except Exception as e:
+            logger.error(f"Failed to store preview {preview_id}: {e}")
+    
+    async def load(self, preview_id: str) -> Tuple[dict, bytes]:
+        """
+        Fetch a preview's record and background
+        
+        Raises:
+            PreviewExpired: If either is missing
+        """
+        record = await self.cache.get(f"preview:{preview_id}")
+        background = await self.cache.get(f"preview:{preview_id}:background")
+        if record is None or background is None:
+            raise PreviewExpired(preview_id)
+        return json.loads(record), background
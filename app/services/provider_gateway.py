@@ -0,0 +1,222 @@
+"""
+Provider gateway for GeoMask
+
+Limits concurrent calls to each image provider, coalesces identical
+concurrent requests and backs off when a provider reports rate limiting.
+"""
+
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from app.config import settings
+from app.utils.logger import setup_logger
+from app.utils.metrics import record_cache
+
+logger = setup_logger(__name__)
+
+
+class ProviderRateLimited(Exception):
+    """Raised by a provider call that was rejected with HTTP 429"""
+    
+    def __init__(self, message: str = "Provider rate limited", retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """Check whether an exception represents a provider 429"""
+    if isinstance(error, ProviderRateLimited):
+        return True
+    return getattr(error, "status_code", None) == 429
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """Extract a Retry-After hint from a provider error, if any"""
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is not None:
+        return float(retry_after)
+    
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        try:
+            return float(headers.get("retry-after"))
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+@dataclass
+class ProviderState:
+    """Concurrency and backoff state for a single provider"""
+    semaphore: asyncio.Semaphore
+    backoff: float = 0.0
+    backoff_until: float = 0.0
+    in_flight: int = 0
+    calls_total: int = 0
+    rate_limited_total: int = 0
+
+
+class ProviderGateway:
+    """
+    Front door for all provider calls
+    
+    - At most max_concurrency calls are in flight per provider.
+    - Concurrent requests with the same key share one call (single-flight).
+      The call is cancelled once every request waiting on it has been.
+    - A 429 doubles the provider's backoff window (honouring Retry-After);
+      every call to that provider waits out the window before starting,
+      and successes shrink it again.
+    """
+    
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        initial_backoff: Optional[float] = None,
+        max_backoff: Optional[float] = None,
+        max_retries: Optional[int] = None
+    ):
+        self.max_concurrency = max_concurrency or settings.PROVIDER_MAX_CONCURRENCY
+        self.initial_backoff = initial_backoff if initial_backoff is not None else settings.PROVIDER_BACKOFF_INITIAL_SECONDS
+        self.max_backoff = max_backoff if max_backoff is not None else settings.PROVIDER_BACKOFF_MAX_SECONDS
+        self.max_retries = max_retries if max_retries is not None else settings.PROVIDER_MAX_RETRIES
+        
+        self._providers: Dict[str, ProviderState] = {}
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self.coalesced_total = 0
+        self.cancelled_total = 0
+    
+    def _state(self, provider: str) -> ProviderState:
+        state = self._providers.get(provider)
+        if state is None:
+            state = ProviderState(semaphore=asyncio.Semaphore(self.max_concurrency))
+            self._providers[provider] = state
+        return state
+    
+    async def coalesce(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run factory once for all concurrent callers sharing key
+        
+        The shared call runs in its own task, so one waiter being cancelled
+        does not cancel the work for everyone else. When the last waiter is
+        cancelled (its client left or its deadline passed) the call is
+        cancelled too, instead of finishing for nobody.
+        
+        Args:
+            key: Identity of the request (e.g. provider, prompt and size)
+            factory: Coroutine function producing the result
+        
+        Returns:
+            The shared result
+        """
+        task = self._inflight.get(key)
+        record_cache("provider_coalesce", task is not None)
+        if task is None:
+            task = asyncio.create_task(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced_total += 1
+            logger.debug(f"Coalesced provider request: {key}")
+        
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[task] == 1 and not task.done():
+                # Nobody wants the result any more; new callers start afresh
+                self._forget(key, task)
+                task.cancel()
+                self.cancelled_total += 1
+                logger.info(f"Cancelled provider request nobody is waiting for: {key}")
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+    
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+    
+    async def limited(self, provider: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Call a provider under its concurrency limit, backing off on 429
+        
+        Args:
+            provider: Provider name
+            factory: Coroutine function making one provider call
+        
+        Returns:
+            The provider call's result
+        
+        Raises:
+            ProviderRateLimited: If the provider keeps rate limiting after
+                max_retries attempts
+        """
+        state = self._state(provider)
+        attempt = 0
+        
+        while True:
+            async with state.semaphore:
+                # Wait out any backoff window opened by another call
+                delay = state.backoff_until - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                
+                state.in_flight += 1
+                state.calls_total += 1
+                try:
+                    result = await factory()
+                except Exception as e:
+                    if not is_rate_limited(e):
+                        raise
+                    self._open_backoff(provider, state, get_retry_after(e))
+                    if attempt >= self.max_retries:
+                        raise ProviderRateLimited(f"{provider} rate limited after {attempt + 1} attempts") from e
+                    attempt += 1
+                    continue
+                finally:
+                    state.in_flight -= 1
+            
+            # Recover gradually once the provider accepts calls again
+            state.backoff = state.backoff / 2 if state.backoff > self.initial_backoff else 0.0
+            return result
+    
+    async def run(self, provider: str, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Coalesce on key and call the provider under its limits"""
+        return await self.coalesce(key, lambda: self.limited(provider, factory))
+    
+    def _open_backoff(self, provider: str, state: ProviderState, retry_after: Optional[float]):
+        """Widen the provider's backoff window after a 429"""
+        state.rate_limited_total += 1
+        state.backoff = min(self.max_backoff, max(self.initial_backoff, state.backoff * 2))
+        # Jitter spreads retries from concurrent callers
+        window = max(state.backoff * random.uniform(0.8, 1.2), retry_after or 0.0)
+        state.backoff_until = max(state.backoff_until, time.monotonic() + window)
+        logger.warning(f"Provider {provider} rate limited, backing off {window:.1f}s")
+    
+    def stats(self) -> dict:
+        """Current gateway state"""
+        return {
+            "coalesced_total": self.coalesced_total,
+            "cancelled_total": self.cancelled_total,
+            "pending_keys": len(self._inflight),
+            "providers": {
+                name: {
+                    "in_flight": state.in_flight,
+                    "calls_total": state.calls_total,
+                    "rate_limited_total": state.rate_limited_total,
+                    "backoff_seconds": state.backoff
+                }
+                for name, state in self._providers.items()
+            }
+        }
+
+
+# Shared gateway so every AIGenerator instance coalesces together
+provider_gateway = ProviderGateway()
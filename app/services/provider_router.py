@@ -0,0 +1,279 @@
+"""
+Latency-aware provider routing for GeoMask
+
+Tracks rolling latency and error rate per provider, sends each request to
+the fastest healthy provider, hedges with a second provider when the first
+is slower than its own p95, and trips a circuit breaker on providers that
+keep failing so requests skip them without waiting for a timeout.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.utils.logger import setup_logger
+from app.utils.metrics import PROVIDER_SECONDS
+
+logger = setup_logger(__name__)
+
+
+class ProviderUnavailable(Exception):
+    """Raised when every candidate provider failed or was skipped"""
+    
+    def __init__(self, errors: List[Tuple[str, Exception]]):
+        details = ", ".join(f"{name}: {error}" for name, error in errors) or "no healthy provider"
+        super().__init__(f"All providers failed ({details})")
+        self.errors = errors
+
+
+class ProviderStats:
+    """Rolling latency and outcome window for one provider"""
+    
+    def __init__(self, window: int):
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+    
+    def record(self, success: bool, latency: Optional[float] = None):
+        self.outcomes.append(success)
+        if success and latency is not None:
+            self.latencies.append(latency)
+    
+    def percentile(self, q: float) -> Optional[float]:
+        """Latency percentile over successful calls, None without samples"""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+        return ordered[index]
+    
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return 1.0 - sum(self.outcomes) / len(self.outcomes)
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after consecutive failures (or a high error rate, see
+    ProviderRouter.rank) -> half-open after a cooldown
+    
+    While open, the provider is skipped. In half-open state a single trial
+    call is let through; its outcome closes or re-opens the circuit.
+    """
+    
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+    
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+    
+    def allows(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        return state == "half_open" and not self.trial_in_flight
+    
+    def on_attempt(self):
+        if self.state == "half_open":
+            self.trial_in_flight = True
+    
+    def on_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+    
+    def on_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+    
+    def on_cancel(self):
+        self.trial_in_flight = False
+    
+    def trip(self):
+        """Open the circuit now, whatever the consecutive failure count"""
+        self.opened_at = time.monotonic()
+        self.trial_in_flight = False
+
+
+class ProviderRouter:
+    """Chooses, hedges and health-checks provider calls"""
+    
+    def __init__(
+        self,
+        window: Optional[int] = None,
+        failure_threshold: Optional[int] = None,
+        cooldown: Optional[float] = None,
+        max_error_rate: Optional[float] = None,
+        hedge_min: Optional[float] = None,
+        hedge_default: Optional[float] = None,
+        attempt_timeout: Optional[float] = None
+    ):
+        self.window = window or settings.ROUTER_WINDOW
+        self.failure_threshold = failure_threshold or settings.ROUTER_FAILURE_THRESHOLD
+        self.cooldown = cooldown if cooldown is not None else settings.ROUTER_CIRCUIT_COOLDOWN_SECONDS
+        self.max_error_rate = max_error_rate if max_error_rate is not None else settings.ROUTER_MAX_ERROR_RATE
+        self.hedge_min = hedge_min if hedge_min is not None else settings.ROUTER_HEDGE_MIN_SECONDS
+        self.hedge_default = hedge_default if hedge_default is not None else settings.ROUTER_HEDGE_DEFAULT_SECONDS
+        self.attempt_timeout = attempt_timeout if attempt_timeout is not None else settings.PROVIDER_TIMEOUT_SECONDS
+        
+        self._stats: Dict[str, ProviderStats] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self.hedges_total = 0
+    
+    def _get(self, provider: str) -> Tuple[ProviderStats, CircuitBreaker]:
+        if provider not in self._stats:
+            self._stats[provider] = ProviderStats(self.window)
+            self._breakers[provider] = CircuitBreaker(self.failure_threshold, self.cooldown)
+        return self._stats[provider], self._breakers[provider]
+    
+    def rank(self, providers: List[str]) -> List[str]:
+        """
+        Order healthy providers, fastest first
+        
+        Providers without samples keep their configured order ahead of
+        measured ones, so each gets probed.
+        """
+        ranked = []
+        for order, provider in enumerate(providers):
+            stats, breaker = self._get(provider)
+            if breaker.state == "closed" and len(stats.outcomes) >= 5 and stats.error_rate > self.max_error_rate:
+                # Intermittent failures never reach the consecutive threshold;
+                # open the circuit so the provider gets a trial after the
+                # cooldown, and start its error rate over from that trial
+                logger.warning(f"Circuit open for provider {provider} (error rate {stats.error_rate:.0%})")
+                breaker.trip()
+                stats.outcomes.clear()
+            if not breaker.allows():
+                continue
+            median = stats.percentile(0.5)
+            ranked.append((median if median is not None else 0.0, order, provider))
+        return [provider for _, _, provider in sorted(ranked)]
+    
+    def hedge_delay(self, provider: str) -> float:
+        """How long to wait for a provider before hedging: its p95"""
+        stats, _ = self._get(provider)
+        p95 = stats.percentile(0.95)
+        if p95 is None:
+            return self.hedge_default
+        return max(self.hedge_min, p95)
+    
+    async def _attempt(self, provider: str, call: Callable[[str], Awaitable[Any]]) -> Any:
+        """Run one provider call, recording its latency and outcome"""
+        stats, breaker = self._get(provider)
+        breaker.on_attempt()
+        start = time.monotonic()
+        
+        try:
+            async with asyncio.timeout(self.attempt_timeout):
+                result = await call(provider)
+        except asyncio.CancelledError:
+            # Lost a hedge race; not the provider's fault
+            breaker.on_cancel()
+            raise
+        except Exception:
+            PROVIDER_SECONDS.labels(provider, "error").observe(time.monotonic() - start)
+            stats.record(False)
+            breaker.on_failure()
+            if breaker.state == "open":
+                logger.warning(f"Circuit open for provider {provider}")
+            raise
+        
+        latency = time.monotonic() - start
+        PROVIDER_SECONDS.labels(provider, "success").observe(latency)
+        stats.record(True, latency)
+        breaker.on_success()
+        return result
+    
+    async def generate(self, providers: List[str], call: Callable[[str], Awaitable[Any]]) -> Any:
+        """
+        Run call against the best provider, hedging once if it is slow
+        
+        Args:
+            providers: Candidate providers in preference order
+            call: Coroutine function taking a provider name
+        
+        Returns:
+            Result of the first provider call to succeed
+        
+        Raises:
+            ProviderUnavailable: If no candidate succeeded
+        """
+        candidates = iter(self.rank(providers))
+        pending: Dict[asyncio.Task, str] = {}
+        errors: List[Tuple[str, Exception]] = []
+        hedged = False
+        
+        def launch() -> bool:
+            provider = next(candidates, None)
+            if provider is None:
+                return False
+            pending[asyncio.create_task(self._attempt(provider, call))] = provider
+            return True
+        
+        if not launch():
+            raise ProviderUnavailable(errors)
+        
+        try:
+            while pending:
+                timeout = None
+                if not hedged and len(pending) == 1:
+                    timeout = self.hedge_delay(next(iter(pending.values())))
+                
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                
+                if not done:
+                    # Primary is slower than its p95: race a second provider
+                    hedged = True
+                    if launch():
+                        self.hedges_total += 1
+                        logger.info(f"Hedging provider request to {list(pending.values())[-1]}")
+                    continue
+                
+                for task in done:
+                    provider = pending.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    errors.append((provider, task.exception()))
+                    logger.warning(f"Provider {provider} failed: {task.exception()}")
+                
+                if not pending:
+                    launch()
+            
+            raise ProviderUnavailable(errors)
+        
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    def stats(self) -> dict:
+        """Per-provider latency, error rate and circuit state"""
+        return {
+            "hedges_total": self.hedges_total,
+            "providers": {
+                name: {
+                    "p50_seconds": stats.percentile(0.5),
+                    "p95_seconds": stats.percentile(0.95),
+                    "error_rate": stats.error_rate,
+                    "circuit": self._breakers[name].state
+                }
+                for name, stats in self._stats.items()
+            }
+        }
+
+
+# Shared router so health and latency are tracked once per process
+provider_router = ProviderRouter()
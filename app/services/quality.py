@@ -0,0 +1,136 @@
+"""
+Load-adaptive quality tiers for GeoMask
+
+Under pressure a slightly cheaper result now beats a full one after a
+long wait in the queue. Each request gets one of three tiers, chosen
+from the admission controller's queue and the latency of recent
+requests:
+
+- full: a background from the decoy library or a fresh generation,
+  radially feathered into the windows at full resolution
+- reduced: a library or cached provider background (never a new
+  provider call), with only the window edges alpha-blended
+- minimal: a library or procedural background pasted in, with the
+  image capped at QUALITY_MINIMAL_MAX_EDGE
+"""
+
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional, Tuple
+
+from app.config import settings
+from app.services.admission import AdmissionController
+from app.utils.logger import setup_logger
+from app.utils.metrics import record_quality_tier
+
+logger = setup_logger(__name__)
+
+# Completed requests within this window make up the recent latency
+LATENCY_WINDOW_SECONDS = 60
+
+
+@dataclass(frozen=True)
+class QualityTier:
+    """What a request may spend on its result"""
+    name: str
+    # Where the background may come from: fresh (provider), cached or procedural
+    background: str
+    # Blend for _replace_backgrounds: radial, edges or paste
+    blend: str
+    # Long-edge cap in pixels, 0 = full resolution
+    max_edge: int = 0
+
+
+def quality_tiers() -> Dict[str, QualityTier]:
+    """The tiers from best to cheapest"""
+    return {
+        "full": QualityTier("full", background="fresh", blend="radial"),
+        "reduced": QualityTier("reduced", background="cached", blend="edges"),
+        "minimal": QualityTier(
+            "minimal", background="procedural", blend="paste", max_edge=settings.QUALITY_MINIMAL_MAX_EDGE
+        )
+    }
+
+
+FULL = quality_tiers()["full"]
+
+
+class QualityController:
+    """
+    Moves requests between quality tiers as load changes
+    
+    Two signals are compared with per-tier thresholds: load, the jobs in
+    flight plus those waiting per processing slot, and the mean latency
+    (arrival to response) of requests completed in the last minute. The
+    tier drops as soon as either signal crosses a threshold, and only
+    climbs back once both are below QUALITY_RECOVERY of the thresholds,
+    so a queue hovering at a threshold doesn't flip every other request.
+    """
+    
+    def __init__(self, admission: AdmissionController):
+        self.admission = admission
+        self.level = 0
+        self._latencies: Deque[Tuple[float, float]] = deque(maxlen=256)
+    
+    def observe(self, seconds: float, now: Optional[float] = None):
+        """Record the latency of a completed request"""
+        self._latencies.append((time.monotonic() if now is None else now, seconds))
+    
+    def load(self) -> float:
+        """Jobs in flight and waiting per processing slot"""
+        stats = self.admission.stats()
+        return (stats["in_flight"] + stats["waiting"]) / max(1, stats["max_concurrent"])
+    
+    def latency(self, now: Optional[float] = None) -> float:
+        """Mean latency of requests completed within LATENCY_WINDOW_SECONDS, 0 without any"""
+        cutoff = (time.monotonic() if now is None else now) - LATENCY_WINDOW_SECONDS
+        while self._latencies and self._latencies[0][0] < cutoff:
+            self._latencies.popleft()
+        if not self._latencies:
+            return 0.0
+        return sum(seconds for _, seconds in self._latencies) / len(self._latencies)
+    
+    def _level_for(self, load: float, latency: float, scale: float = 1.0) -> int:
+        """Cheapest tier whose thresholds (times scale) either signal reaches"""
+        thresholds = [
+            (settings.QUALITY_MINIMAL_LOAD, settings.QUALITY_MINIMAL_LATENCY_SECONDS),
+            (settings.QUALITY_REDUCED_LOAD, settings.QUALITY_REDUCED_LATENCY_SECONDS)
+        ]
+        for level, (max_load, max_latency) in zip((2, 1), thresholds):
+            if (max_load and load >= max_load * scale) or (max_latency and latency >= max_latency * scale):
+                return level
+        return 0
+    
+    def choose(self) -> QualityTier:
+        """
+        Pick the tier for a request about to be processed
+        
+        Returns:
+            The forced QUALITY_TIER, or the tier for the current load
+        """
+        tiers = quality_tiers()
+        if settings.QUALITY_TIER in tiers:
+            tier = tiers[settings.QUALITY_TIER]
+        else:
+            load, latency = self.load(), self.latency()
+            target = self._level_for(load, latency)
+            relaxed = self._level_for(load, latency, settings.QUALITY_RECOVERY)
+            level = max(target, min(self.level, relaxed))
+            if level != self.level:
+                logger.info(
+                    f"Quality tier {list(tiers)[self.level]} -> {list(tiers)[level]} "
+                    f"(load {load:.2f}, latency {latency:.1f}s)"
+                )
+                self.level = level
+            tier = list(tiers.values())[level]
+        
+        record_quality_tier(tier.name)
+        return tier
+    
+    def stats(self) -> dict:
+        return {
+            "level": self.level,
+            "load": self.load(),
+            "latency": self.latency()
+        }
@@ -0,0 +1,207 @@
+"""
+Interactive editing sessions for GeoMask
+
+A session keeps a decoded original, its window regions and candidate
+backgrounds in memory, so changing the feather, the blend mode or the
+decoy only re-blends the affected regions instead of re-running the
+pipeline. Hot sessions live in a per-process LRU bounded by total bytes
+and idle time; a small record and the encoded backgrounds are also kept
+in the shared cache, so any worker can restore a session it doesn't hold.
+"""
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.utils.logger import setup_logger
+from app.utils.metrics import record_cache
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = setup_logger(__name__)
+
+BLEND_MODES = ("radial", "replace")
+
+
+class SessionExpired(LookupError):
+    """A session is unknown, has expired, or its upload has been removed"""
+
+
+class EditSession:
+    """
+    State of one editing session
+    
+    Backgrounds are kept as one crop per region rather than full frames,
+    since only the regions are ever re-blended. assignments[i] is the index
+    of the background shown in region i, and masks[i] its blend mask for
+    the current feather and blend mode.
+    """
+    
+    def __init__(
+        self,
+        session_id: str,
+        image_path: str,
+        original_file: Optional[str],
+        image: "np.ndarray",
+        regions: List[Tuple[int, int, int, int]],
+        feather: int = 15,
+        blend_mode: str = "radial"
+    ):
+        self.session_id = session_id
+        self.image_path = image_path
+        self.original_file = original_file
+        self.image = image
+        self.regions = regions
+        self.feather = feather
+        self.blend_mode = blend_mode
+        self.backgrounds: List[List["np.ndarray"]] = []
+        self.scenes: List[Dict[str, str]] = []
+        self.assignments: List[int] = [0] * len(regions)
+        self.composite: Optional["np.ndarray"] = None
+        self.preview: Optional["np.ndarray"] = None
+        self.masks: Dict[int, "np.ndarray"] = {}
+        self.output_path: Optional[str] = None
+        self.revision = 0
+        self.lock = asyncio.Lock()
+    
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the session's arrays"""
+        total = self.image.nbytes
+        for array in (self.composite, self.preview):
+            if array is not None:
+                total += array.nbytes
+        for crops in self.backgrounds:
+            total += sum(crop.nbytes for crop in crops)
+        total += sum(mask.nbytes for mask in self.masks.values())
+        return total
+    
+    def record(self) -> dict:
+        """The small, serialisable part of the session"""
+        return {
+            "image_path": self.image_path,
+            "original_file": self.original_file,
+            "regions": [list(region) for region in self.regions],
+            "feather": self.feather,
+            "blend_mode": self.blend_mode,
+            "scenes": self.scenes,
+            "assignments": self.assignments,
+            "output_path": self.output_path,
+            "revision": self.revision
+        }
+
+
+class SessionStore:
+    """
+    Hot sessions in this process plus their records in the shared cache
+    
+    The in-process cache evicts least recently used sessions once their
+    arrays exceed SESSION_MAX_MB, and drops sessions idle for longer than
+    SESSION_TTL_SECONDS. Records and backgrounds in the shared cache expire
+    after the same idle time, so an evicted session can still be restored
+    (by re-decoding the original) until then.
+    """
+    
+    def __init__(self, cache, max_bytes: Optional[int] = None, ttl: Optional[float] = None):
+        self.cache = cache
+        self.max_bytes = max_bytes if max_bytes is not None else settings.SESSION_MAX_MB * 1024 * 1024
+        self.ttl = ttl if ttl is not None else settings.SESSION_TTL_SECONDS
+        self._sessions: "OrderedDict[str, Tuple[EditSession, int, float]]" = OrderedDict()
+        self.bytes = 0
+        self.evicted_total = 0
+    
+    def get(self, session_id: str) -> Optional[EditSession]:
+        """Return a hot session, None if this process doesn't hold it"""
+        entry = self._sessions.get(session_id)
+        if entry is not None and entry[2] + self.ttl <= time.monotonic():
+            self.discard(session_id)
+            entry = None
+        record_cache("session", entry is not None)
+        if entry is None:
+            return None
+        self._sessions.move_to_end(session_id)
+        return entry[0]
+    
+    def put(self, session: EditSession):
+        """Add or re-account a session after it changed, evicting others to stay within budget"""
+        self.discard(session.session_id)
+        size = session.nbytes
+        if size > self.max_bytes:
+            logger.warning(f"Session {session.session_id} ({size} bytes) exceeds SESSION_MAX_MB, not kept in memory")
+            return
+        
+        self._sessions[session.session_id] = (session, size, time.monotonic())
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted, _) = self._sessions.popitem(last=False)
+            self.bytes -= evicted
+            self.evicted_total += 1
+    
+    def discard(self, session_id: str):
+        """Drop a session from this process"""
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+    
+    async def save(self, session: EditSession, background: Optional[Tuple[int, bytes]] = None):
+        """
+        Write a session's record, and optionally one new encoded background, to the shared cache
+        
+        Failures are logged; the session then just can't be restored elsewhere.
+        """
+        try:
+            if background is not None:
+                index, data = background
+                await self.cache.set(f"session:{session.session_id}:background:{index}", data, self.ttl)
+            await self.cache.set(f"session:{session.session_id}", json.dumps(session.record()).encode(), self.ttl)
+        except Exception as e:
+            logger.error(f"Failed to store session {session.session_id}: {e}")
+    
+    async def load(self, session_id: str) -> dict:
+        """
+        Fetch a session's record from the shared cache
+        
+        Raises:
+            SessionExpired: If the record is missing
+        """
+        data = await self.cache.get(f"session:{session_id}")
+        if data is None:
+            raise SessionExpired(session_id)
+        return json.loads(data)
+    
+    async def load_backgrounds(self, session_id: str, count: int) -> List[bytes]:
+        """
+        Fetch a session's encoded backgrounds from the shared cache
+        
+        Raises:
+            SessionExpired: If any background is missing
+        """
+        backgrounds = []
+        for index in range(count):
+            background = await self.cache.get(f"session:{session_id}:background:{index}")
+            if background is None:
+                raise SessionExpired(session_id)
+            backgrounds.append(background)
+        return backgrounds
+    
+    async def delete(self, session_id: str, backgrounds: int):
+        """Remove a session from this process and the shared cache"""
+        self.discard(session_id)
+        try:
+            await self.cache.delete(f"session:{session_id}")
+            for index in range(backgrounds):
+                await self.cache.delete(f"session:{session_id}:background:{index}")
+        except Exception as e:
+            logger.error(f"Failed to delete session {session_id}: {e}")
+    
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "evicted_total": self.evicted_total
+        }
@@ -0,0 +1,237 @@
+"""
+Shared cache for GeoMask
+
+State that every worker should see (generated backgrounds, detection
+results, job status) goes through one of these backends:
+
+- MemoryCache: per process, for single-worker runs and tests
+- SQLiteCache: one database file shared by all workers on a host
+- RedisCache: shared across hosts via REDIS_URL, falling back to SQLite
+  while Redis is unreachable
+
+All backends store bytes under string keys with a per-entry TTL.
+"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+
+from app.config import settings
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+REDIS_RETRY_SECONDS = 30
+
+
+class MemoryCache:
+    """In-process LRU cache bounded by total value size"""
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+    
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires <= time.time():
+            await self.delete(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+    
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self.delete(key)
+        if len(value) > self.max_bytes:
+            return
+        self._entries[key] = (value, time.time() + ttl)
+        self.bytes += len(value)
+        while self.bytes > self.max_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self.bytes -= len(evicted)
+    
+    async def delete(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= len(entry[0])
+    
+    async def aclose(self):
+        pass
+
+
+class SQLiteCache:
+    """
+    Cache in a SQLite file shared by every worker process on the host
+    
+    WAL mode lets readers proceed while one worker writes. Each process
+    opens its own connection on first use (so forking workers is safe),
+    and queries run in a thread to keep the event loop free. Expired rows
+    and, above max_bytes, the oldest rows are purged every PURGE_EVERY
+    writes.
+    """
+    
+    backend = "sqlite"
+    PURGE_EVERY = 100
+    
+    def __init__(self, path: str, max_bytes: int):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._writes = 0
+    
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, expires REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_created ON cache (created)")
+        return conn
+    
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+    
+    def _get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT value FROM cache WHERE key = ? AND expires > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+    
+    def _set(self, key: str, value: bytes, ttl: float):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, created, expires) VALUES (?, ?, ?, ?, ?)",
+                (key, sqlite3.Binary(value), len(value), now, now + ttl)
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                self._purge(conn, now)
+    
+    def _purge(self, conn: sqlite3.Connection, now: float):
+        """Drop expired rows, then the oldest rows until under max_bytes"""
+        conn.execute("DELETE FROM cache WHERE expires <= ?", (now,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        
+        # Free a little extra so the next writes don't purge again immediately
+        excess = total - int(self.max_bytes * 0.9)
+        doomed = []
+        for key, size in conn.execute("SELECT key, size FROM cache ORDER BY created"):
+            doomed.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM cache WHERE key = ?", doomed)
+    
+    def _delete(self, key: str):
+        with self._lock:
+            self._connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+    
+    def _close(self):
+        with self._lock:
+            conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.close()
+    
+    async def get(self, key: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._get, key)
+    
+    async def set(self, key: str, value: bytes, ttl: float):
+        await asyncio.to_thread(self._set, key, value, ttl)
+    
+    async def delete(self, key: str):
+        await asyncio.to_thread(self._delete, key)
+    
+    async def aclose(self):
+        await asyncio.to_thread(self._close)
+
+
+class RedisCache:
+    """Cache shared across hosts through Redis, with a local fallback"""
+    
+    def __init__(self, redis_url: str, fallback):
+        import redis.asyncio as redis
+        
+        self.client = redis.from_url(redis_url)
+        self.fallback = fallback
+        self.down_until = 0.0
+    
+    async def _run(self, redis_call, fallback_call):
+        if time.monotonic() < self.down_until:
+            return await fallback_call()
+        
+        try:
+            return await redis_call()
+        except Exception as e:
+            # Skip Redis for a while instead of failing (and logging) per request
+            self.down_until = time.monotonic() + REDIS_RETRY_SECONDS
+            logger.warning(f"Redis cache unavailable, using the local cache for {REDIS_RETRY_SECONDS}s: {e}")
+            return await fallback_call()
+    
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._run(
+            lambda: self.client.get(f"geomask:cache:{key}"),
+            lambda: self.fallback.get(key)
+        )
+    
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self._run(
+            lambda: self.client.set(f"geomask:cache:{key}", value, px=max(1, int(ttl * 1000))),
+            lambda: self.fallback.set(key, value, ttl)
+        )
+    
+    async def delete(self, key: str):
+        await self._run(
+            lambda: self.client.delete(f"geomask:cache:{key}"),
+            lambda: self.fallback.delete(key)
+        )
+    
+    async def aclose(self):
+        try:
+            await self.client.close()
+        except Exception as e:
+            logger.error(f"Error closing Redis cache client: {e}")
+        await self.fallback.aclose()
+
+
+def create_shared_cache():
+    """Create the configured shared cache backend"""
+    backend = settings.SHARED_CACHE_BACKEND.lower()
+    max_bytes = settings.SHARED_CACHE_MAX_MB * 1024 * 1024
+    
+    if backend == "memory":
+        return MemoryCache(max_bytes)
+    
+    local = SQLiteCache(settings.SHARED_CACHE_PATH, max_bytes)
+    if backend in ("auto", "redis") and settings.REDIS_URL:
+        try:
+            cache = RedisCache(settings.REDIS_URL, fallback=local)
+            logger.info("Using Redis shared cache")
+            return cache
+        except ImportError:
+            logger.warning("redis package not installed, using SQLite shared cache")
+    elif backend == "redis":
+        logger.warning("SHARED_CACHE_BACKEND=redis needs REDIS_URL, using SQLite shared cache")
+    
+    return local
+
+
+shared_cache = create_shared_cache()
@@ -0,0 +1,115 @@
+"""
+Request deadlines and cancellation for GeoMask
+
+A deadline is set once per request, at the endpoint, and read by every
+stage below it through a context variable, the same way stage timings
+are collected. Stages check the remaining budget before starting work:
+they skip or cheapen work that would overrun, and stop with
+DeadlineExceeded once nothing useful can be returned in time.
+run_until_disconnected() cancels the processing when the client goes
+away, which also cancels its pending provider calls.
+"""
+
+import asyncio
+import math
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Iterator, Optional, TypeVar
+
+from starlette.requests import Request
+
+from app.utils.logger import setup_logger
+from app.utils.metrics import record_cancellation
+
+logger = setup_logger(__name__)
+
+T = TypeVar("T")
+
+_current_deadline: ContextVar[Optional["Deadline"]] = ContextVar("geomask_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's deadline passed before a stage could start"""
+
+
+class ClientDisconnected(Exception):
+    """The client went away while its request was processing"""
+
+
+class Deadline:
+    """A point in time (monotonic) by which a request must be answered"""
+    
+    def __init__(self, expires_at: float):
+        self.expires_at = expires_at
+    
+    @classmethod
+    def after(cls, seconds: float, start: Optional[float] = None) -> "Deadline":
+        """Deadline seconds after start (default: now)"""
+        return cls((time.monotonic() if start is None else start) + seconds)
+    
+    def remaining(self) -> float:
+        """Seconds left, negative once expired"""
+        return self.expires_at - time.monotonic()
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]) -> Iterator[Optional[Deadline]]:
+    """Make deadline the current request's deadline for the enclosed work"""
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def remaining_budget() -> float:
+    """Seconds left for the current request, infinite without a deadline"""
+    deadline = _current_deadline.get()
+    return math.inf if deadline is None else deadline.remaining()
+
+
+def check_deadline(stage: str):
+    """
+    Refuse to start a stage once the current request's deadline has passed
+    
+    Raises:
+        DeadlineExceeded: If the deadline has passed
+    """
+    if remaining_budget() <= 0:
+        record_cancellation("deadline")
+        raise DeadlineExceeded(f"Deadline exceeded before {stage}")
+
+
+async def run_until_disconnected(request: Request, work: Awaitable[T]) -> T:
+    """
+    Run work, cancelling it if the client disconnects first
+    
+    The request body must already have been read: the watcher consumes
+    the remaining ASGI messages, of which only http.disconnect is left.
+    
+    Raises:
+        ClientDisconnected: If the client went away before work finished
+    """
+    task = asyncio.ensure_future(work)
+    
+    async def watch():
+        while True:
+            message = await request.receive()
+            if message["type"] == "http.disconnect":
+                task.cancel()
+                return
+    
+    watcher = asyncio.create_task(watch())
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if not watcher.done() or watcher.cancelled():
+            # The endpoint itself was cancelled, not the work
+            task.cancel()
+            raise
+        record_cancellation("disconnect")
+        logger.info(f"Client disconnected, cancelled {request.url.path}")
+        raise ClientDisconnected()
+    finally:
+        watcher.cancel()
@@ -0,0 +1,160 @@
+"""
+Download metadata index for GeoMask
+"""
+
+import hashlib
+import mimetypes
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+import anyio
+
+from app.config import settings
+from app.utils.logger import setup_logger
+from app.utils.metrics import record_cache
+
+logger = setup_logger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class FileMetadata:
+    """Precomputed metadata for a downloadable file"""
+    path: str
+    size: int
+    etag: str
+    content_type: str
+    created: float
+
+
+class FileIndex:
+    """
+    In-memory index of downloadable files
+    
+    Files are registered with their size, content hash and content type when
+    they are written, so serving them does not need a stat or a re-read. Files
+    written by another process are indexed lazily on first lookup.
+    """
+    
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self._entries: Dict[str, FileMetadata] = {}
+        self._lock = threading.Lock()
+    
+    def register(self, path: str, data: Optional[bytes] = None) -> FileMetadata:
+        """
+        Register a file in the index
+        
+        Args:
+            path: Path to the file
+            data: File contents if already in memory (avoids re-reading)
+        
+        Returns:
+            Metadata for the file
+        """
+        file_path = Path(path)
+        
+        if data is not None:
+            size = len(data)
+            digest = hashlib.sha256(data).hexdigest()
+        else:
+            size, digest = self._hash_file(file_path)
+        
+        content_type = mimetypes.guess_type(file_path.name)[0] or "application/octet-stream"
+        metadata = FileMetadata(
+            path=str(file_path),
+            size=size,
+            etag=f'"{digest[:32]}"',
+            content_type=content_type,
+            created=time.time()
+        )
+        
+        with self._lock:
+            self._entries[file_path.name] = metadata
+        
+        return metadata
+    
+    def get(self, filename: str) -> Optional[FileMetadata]:
+        """
+        Look up a file by name
+        
+        Args:
+            filename: Bare file name inside the indexed directory
+        
+        Returns:
+            Metadata, or None if the file does not exist
+        """
+        with self._lock:
+            metadata = self._entries.get(filename)
+        
+        if metadata is not None:
+            return metadata
+        
+        # Reject anything that is not a plain file name
+        if Path(filename).name != filename or filename.startswith("."):
+            return None
+        
+        file_path = self.directory / filename
+        if not file_path.is_file():
+            return None
+        
+        try:
+            return self.register(str(file_path))
+        except OSError as e:
+            logger.warning(f"Could not index file {file_path}: {e}")
+            return None
+    
+    async def aget(self, filename: str) -> Optional[FileMetadata]:
+        """
+        Look up a file by name from async code
+        
+        Hits are served from memory; a miss stats and hashes the file in a
+        worker thread so the event loop is never blocked on disk I/O.
+        
+        Args:
+            filename: Bare file name inside the indexed directory
+        
+        Returns:
+            Metadata, or None if the file does not exist
+        """
+        with self._lock:
+            metadata = self._entries.get(filename)
+        
+        record_cache("download_index", metadata is not None)
+        if metadata is not None:
+            return metadata
+        
+        return await anyio.to_thread.run_sync(self.get, filename)
+    
+    def remove(self, filename: str):
+        """Remove a file from the index"""
+        with self._lock:
+            self._entries.pop(filename, None)
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+    
+    @staticmethod
+    def _hash_file(file_path: Path):
+        """Compute size and SHA-256 of a file on disk"""
+        hasher = hashlib.sha256()
+        size = 0
+        
+        with open(file_path, "rb") as f:
+            while True:
+                chunk = f.read(HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                size += len(chunk)
+        
+        return size, hasher.hexdigest()
+
+
+# Index of processed images served by /api/download
+processed_index = FileIndex(settings.PROCESSED_DIR)
@@ -0,0 +1,392 @@
+"""
+Background reaper for uploaded, processed and temporary files
+"""
+
+import asyncio
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.utils.file_index import processed_index
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+@dataclass
+class TrackedFile:
+    """A file managed by the reaper"""
+    path: str
+    directory: str
+    size: int
+    expiry: float
+    # Creation (or modification) time, for REAPER_MIN_AGE_SECONDS
+    created: float
+
+
+class FileReaper:
+    """
+    Expiry index for generated artifacts
+    
+    Files are tracked when they are created. Expiry is kept in a min-heap so
+    each pass only looks at files that are actually due, and per-directory
+    byte quotas are enforced by evicting the least recently used files.
+    
+    Worker processes on a host share the managed directories, so only the
+    one holding REAPER_LOCK_FILE reaps; the others stand by (tracking
+    nothing) and take over when it exits. The active reaper scans the
+    directories at startup, for files left over from a previous run, and
+    every REAPER_RESCAN_SECONDS for files the other workers wrote. Files
+    younger than REAPER_MIN_AGE_SECONDS are never evicted for quota, so an
+    upload or result still in use by a request survives.
+    """
+    
+    def __init__(
+        self,
+        ttl_seconds: Optional[Dict[str, float]] = None,
+        quotas: Optional[Dict[str, int]] = None,
+        batch_size: Optional[int] = None,
+        interval: Optional[float] = None,
+        min_age: Optional[float] = None,
+        lock_file: Optional[str] = None
+    ):
+        default_ttl = settings.FILE_TTL_HOURS * 3600
+        if ttl_seconds is None:
+            ttl_seconds = {
+                settings.UPLOAD_DIR: default_ttl,
+                settings.PROCESSED_DIR: default_ttl,
+                settings.TEMP_DIR: settings.TEMP_FILE_TTL_HOURS * 3600
+            }
+        if quotas is None:
+            quotas = {
+                settings.UPLOAD_DIR: settings.UPLOAD_DIR_QUOTA_MB * 1024 * 1024,
+                settings.PROCESSED_DIR: settings.PROCESSED_DIR_QUOTA_MB * 1024 * 1024,
+                settings.TEMP_DIR: settings.TEMP_DIR_QUOTA_MB * 1024 * 1024
+            }
+        
+        # Keys must match str(Path(file).parent), e.g. "./uploads/" -> "uploads"
+        self.ttl_seconds = {str(Path(d)): ttl for d, ttl in ttl_seconds.items()}
+        self.quotas = {str(Path(d)): quota for d, quota in quotas.items()}
+        self.batch_size = batch_size or settings.REAPER_BATCH_SIZE
+        self.interval = interval or settings.REAPER_INTERVAL_SECONDS
+        self.min_age = min_age if min_age is not None else settings.REAPER_MIN_AGE_SECONDS
+        self.lock_file = lock_file if lock_file is not None else settings.REAPER_LOCK_FILE
+        
+        self._heap: List[Tuple[float, str]] = []
+        self._files: Dict[str, TrackedFile] = {}
+        self._lru: Dict[str, "OrderedDict[str, None]"] = {}
+        self._bytes: Dict[str, int] = {}
+        self._due: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._host_lock = None
+        # Another process on the host is reaping the directories
+        self.standby = False
+        self._quota_blocked = False
+        self.expired_due = 0
+        self.bytes_over_quota = 0
+        self.deleted_total = 0
+    
+    def track(
+        self,
+        path: str,
+        size: Optional[int] = None,
+        ttl: Optional[float] = None,
+        created: Optional[float] = None
+    ):
+        """
+        Start tracking a newly created file
+        
+        Args:
+            path: Path to the file
+            size: File size in bytes (stat-ed if not given)
+            ttl: Time to live in seconds (defaults to the directory's TTL)
+            created: When the file was written (defaults to now)
+        """
+        if self.standby:
+            return
+        
+        file_path = Path(path)
+        directory = str(file_path.parent)
+        
+        if size is None:
+            try:
+                size = file_path.stat().st_size
+            except OSError:
+                return
+        
+        if ttl is None:
+            ttl = self.ttl_seconds.get(directory, settings.FILE_TTL_HOURS * 3600)
+        
+        now = time.time()
+        expiry = now + ttl
+        
+        with self._lock:
+            self._untrack(str(file_path))
+            self._files[str(file_path)] = TrackedFile(
+                str(file_path), directory, size, expiry, now if created is None else created
+            )
+            self._lru.setdefault(directory, OrderedDict())[str(file_path)] = None
+            self._bytes[directory] = self._bytes.get(directory, 0) + size
+            heapq.heappush(self._heap, (expiry, str(file_path)))
+    
+    def touch(self, path: str):
+        """Mark a file as recently used for quota eviction"""
+        with self._lock:
+            tracked = self._files.get(str(path))
+            if tracked is not None:
+                self._lru[tracked.directory].move_to_end(str(path))
+    
+    def forget(self, path: str):
+        """Stop tracking a file without deleting it"""
+        with self._lock:
+            self._untrack(str(path))
+    
+    def _untrack(self, path: str) -> Optional[TrackedFile]:
+        """Drop a file from the index; its heap entry is discarded lazily"""
+        tracked = self._files.pop(path, None)
+        self._due.pop(path, None)
+        if tracked is not None:
+            self._lru[tracked.directory].pop(path, None)
+            self._bytes[tracked.directory] -= tracked.size
+        return tracked
+    
+    def recover(self) -> int:
+        """
+        Index files on disk this process isn't tracking yet
+        
+        Picks up files left over from a previous run or written by other
+        workers, and drops tracked files that no longer exist.
+        
+        Returns:
+            Number of files newly tracked
+        """
+        recovered = 0
+        
+        for directory, ttl in self.ttl_seconds.items():
+            dir_path = Path(directory)
+            if not dir_path.exists():
+                continue
+            
+            with self._lock:
+                tracked = set(self._lru.get(directory, ()))
+            
+            entries = []
+            seen = set()
+            for file_path in dir_path.iterdir():
+                seen.add(str(file_path))
+                if str(file_path) in tracked:
+                    continue
+                try:
+                    stat = file_path.stat()
+                except OSError:
+                    continue
+                if file_path.is_file():
+                    entries.append((stat.st_mtime, str(file_path), stat.st_size))
+            
+            # Deleted by the worker that wrote them
+            with self._lock:
+                for path in tracked - seen:
+                    self._untrack(path)
+            
+            # Oldest first so LRU order follows modification time
+            for mtime, path, size in sorted(entries):
+                self.track(path, size=size, ttl=max(0.0, mtime + ttl - time.time()), created=mtime)
+                recovered += 1
+        
+        return recovered
+    
+    def collect(self, now: Optional[float] = None) -> List[str]:
+        """
+        Pick the next batch of files to delete
+        
+        Expired files come first, then least recently used files from any
+        directory that is over its quota.
+        
+        Args:
+            now: Current time (defaults to time.time())
+        
+        Returns:
+            Paths to delete, at most batch_size of them
+        """
+        now = time.time() if now is None else now
+        batch = []
+        
+        with self._lock:
+            # Move newly expired files from the heap to the due queue. Each
+            # file passes through here once, so a pass costs O(k log n) for
+            # the k files that expired since the last one.
+            while self._heap and self._heap[0][0] <= now:
+                expiry, path = heapq.heappop(self._heap)
+                tracked = self._files.get(path)
+                if tracked is not None and tracked.expiry == expiry:
+                    self._due[path] = None
+            
+            while self._due and len(batch) < self.batch_size:
+                path = next(iter(self._due))
+                self._untrack(path)
+                batch.append(path)
+            
+            self._quota_blocked = False
+            for directory, quota in self.quotas.items():
+                lru = self._lru.get(directory)
+                while lru and self._bytes[directory] > quota and len(batch) < self.batch_size:
+                    path = next(iter(lru))
+                    if self._files[path].created > now - self.min_age:
+                        # Everything after it was used more recently; wait for it to age
+                        self._quota_blocked = True
+                        break
+                    self._untrack(path)
+                    batch.append(path)
+            
+            # Work left for the next pass
+            self.expired_due = len(self._due)
+            self.bytes_over_quota = sum(
+                max(0, self._bytes.get(directory, 0) - quota)
+                for directory, quota in self.quotas.items()
+            )
+        
+        return batch
+    
+    def delete(self, paths: List[str]) -> int:
+        """Delete a batch of files, returning how many were removed"""
+        deleted = 0
+        processed_dir = Path(settings.PROCESSED_DIR)
+        
+        for path in paths:
+            file_path = Path(path)
+            try:
+                file_path.unlink()
+                deleted += 1
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"Could not delete file {file_path}: {e}")
+                continue
+            
+            if file_path.parent == processed_dir:
+                processed_index.remove(file_path.name)
+        
+        self.deleted_total += deleted
+        return deleted
+    
+    async def run_once(self) -> int:
+        """Run a single bounded reaping pass"""
+        paths = self.collect()
+        if not paths:
+            return 0
+        
+        deleted = await asyncio.to_thread(self.delete, paths)
+        logger.info(
+            f"Reaper deleted {deleted} files "
+            f"(due: {self.expired_due}, over quota: {self.bytes_over_quota} bytes)"
+        )
+        return deleted
+    
+    def _acquire_host_lock(self) -> bool:
+        """
+        Try to become the host's reaper
+        
+        Returns:
+            True if this process holds REAPER_LOCK_FILE (or locking is
+            disabled or unsupported), False if another process does
+        """
+        if self._host_lock is not None or not self.lock_file:
+            return True
+        
+        try:
+            import fcntl
+        except ImportError:
+            return True
+        
+        try:
+            Path(self.lock_file).parent.mkdir(parents=True, exist_ok=True)
+            handle = open(self.lock_file, "a")
+        except OSError as e:
+            logger.warning(f"Could not open reaper lock file {self.lock_file}, reaping without it: {e}")
+            return True
+        
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        
+        # Released by the kernel when this process exits, however it exits
+        self._host_lock = handle
+        return True
+    
+    def _release_host_lock(self):
+        handle, self._host_lock = self._host_lock, None
+        if handle is not None:
+            handle.close()
+    
+    async def _run(self):
+        """Reap periodically until cancelled, or stand by for the active reaper to exit"""
+        next_scan = time.monotonic() + settings.REAPER_RESCAN_SECONDS
+        while True:
+            try:
+                if self.standby and self._acquire_host_lock():
+                    self.standby = False
+                    logger.info(f"Reaper took over, tracking {await asyncio.to_thread(self.recover)} files")
+                    next_scan = time.monotonic() + settings.REAPER_RESCAN_SECONDS
+                
+                if not self.standby:
+                    if time.monotonic() >= next_scan:
+                        await asyncio.to_thread(self.recover)
+                        next_scan = time.monotonic() + settings.REAPER_RESCAN_SECONDS
+                    await self.run_once()
+            except Exception as e:
+                logger.error(f"Error during reaping: {e}")
+            
+            # Drain a backlog quickly, otherwise wait for the next interval
+            await asyncio.sleep(0 if self.has_backlog else self.interval)
+    
+    def start(self):
+        """Become the host's reaper if no other process is, and start the background task"""
+        if self._task is not None:
+            return
+        if self._acquire_host_lock():
+            logger.info(f"Reaper recovered {self.recover()} existing files")
+        else:
+            self.standby = True
+            logger.info("Another process is reaping the file directories; standing by")
+        self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def stop(self):
+        """Stop the background task and hand the directories to another process"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._release_host_lock()
+    
+    @property
+    def has_backlog(self) -> bool:
+        """Whether the last pass left work behind that can be done now"""
+        return bool(self.expired_due or (self.bytes_over_quota and not self._quota_blocked))
+    
+    def stats(self) -> dict:
+        """Current reaper state"""
+        with self._lock:
+            return {
+                "role": "standby" if self.standby else "active",
+                "tracked_files": len(self._files),
+                "expired_due": self.expired_due,
+                "bytes_over_quota": self.bytes_over_quota,
+                "deleted_total": self.deleted_total,
+                "directory_bytes": dict(self._bytes)
+            }
+
+
+# Shared reaper instance
+file_reaper = FileReaper()
@@ -2,90 +2,428 @@
 File utility functions for GeoMask
 """
 
+import asyncio
+import hashlib
 import os
+import re
 import shutil
 import time
 import uuid
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional, List
-import magic
+from typing import BinaryIO, List, Optional, Tuple
 from fastapi import UploadFile
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from app.config import settings
-from app.utils.logger import setup_logger
+from app.utils.file_reaper import file_reaper
+from app.utils.logger import SAMPLED, setup_logger
 
 logger = setup_logger(__name__)
 
 
-async def save_upload_file(file: UploadFile) -> str:
+# Leading bytes of the image formats GeoMask accepts, checked on the first chunk
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+)
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Multipart boundaries and the other form fields on top of the file itself
+UPLOAD_BODY_OVERHEAD = 64 * 1024
+
+
+class UploadRejected(ValueError):
+    """An upload failed validation; status_code is the HTTP status to answer with"""
+    
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass
+class SavedUpload:
+    """An upload written to disk by save_upload_file"""
+    path: str
+    size: int
+    sha256: str
+    mime_type: str
+
+
+def detect_image_type(head: bytes) -> Optional[str]:
     """
-    Save uploaded file to uploads directory
+    Identify an image format from its leading bytes
+    
+    Args:
+        head: First bytes of the file (at least 12)
+    
+    Returns:
+        MIME type, or None if the bytes are not a supported image format
+    """
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    return None
+
+
+def detect_video_type(head: bytes) -> Optional[str]:
+    """
+    Identify a short-video container from its leading bytes
+    
+    Args:
+        head: First bytes of the file (at least 12)
+    
+    Returns:
+        MIME type, or None if the bytes are not a supported video container
+    """
+    if head[4:8] == b"ftyp":
+        return "video/quicktime" if head[8:10] == b"qt" else "video/mp4"
+    if head.startswith(b"\x1aE\xdf\xa3"):
+        return "video/webm"
+    return None
+
+
+async def save_upload_file(file: UploadFile) -> SavedUpload:
+    """
+    Validate and save an uploaded file to the uploads directory in one pass
+    
+    The signature is checked on the first chunk, the size limit is enforced
+    as chunks are written, and the content is hashed on the way through, so
+    a bad upload is rejected without reading it twice.
     
     Args:
         file: Uploaded file
-        
+    
     Returns:
-        Path to saved file
+        The saved upload with its size and SHA-256
+    
+    Raises:
+        UploadRejected: If the file is not an accepted image or is too large
     """
     try:
-        # Validate file
-        await validate_file(file)
+        # Validate what is known without reading the body
+        validate_file(file)
         
         # Generate unique filename
         timestamp = int(time.time())
         unique_id = str(uuid.uuid4())[:8]
         extension = Path(file.filename).suffix.lower()
         filename = f"upload_{timestamp}_{unique_id}{extension}"
-        
-        # Save file
         file_path = Path(settings.UPLOAD_DIR) / filename
         
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        logger.info(f"File saved: {file_path}")
-        return str(file_path)
+        # One thread hop for the whole copy instead of one per chunk
+        detect = detect_video_type if extension in settings.VIDEO_EXTENSIONS else detect_image_type
+        saved = await asyncio.to_thread(_stream_to_disk, file.file, file_path, detect)
+        file_reaper.track(saved.path, size=saved.size)
         
+        logger.info(f"File saved: {file_path}", extra=SAMPLED)
+        return saved
+    
+    except UploadRejected as e:
+        logger.warning(f"Rejected upload {file.filename}: {e}")
+        raise
     except Exception as e:
         logger.error(f"Error saving file: {e}")
         raise
 
 
-async def validate_file(file: UploadFile) -> bool:
+# PNG chunks that carry text, EXIF or timestamps rather than pixels or colour
+PNG_METADATA_CHUNKS = {b"tEXt", b"zTXt", b"iTXt", b"eXIf", b"tIME"}
+
+
+def strip_metadata(data: bytes) -> Optional[bytes]:
     """
-    Validate uploaded file
+    Remove EXIF, XMP, IPTC and comments from a JPEG or PNG without re-encoding
+    
+    JPEG keeps its JFIF header, ICC colour profile and Adobe marker (needed to
+    decode some colour spaces); PNG keeps every chunk except text, EXIF and
+    timestamps.
     
     Args:
-        file: Uploaded file
+        data: Encoded image
+    
+    Returns:
+        The image without metadata, or None for other formats or malformed files
+    """
+    try:
+        if data.startswith(b"\xff\xd8"):
+            return _strip_jpeg(data)
+        if data.startswith(b"\x89PNG\r\n\x1a\n"):
+            return _strip_png(data)
+    except (IndexError, ValueError) as e:
+        logger.error(f"Could not strip metadata: {e}")
+    return None
+
+
+def _strip_jpeg(data: bytes) -> bytes:
+    output = bytearray(data[:2])
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            raise ValueError("Malformed JPEG segment")
+        marker = data[position + 1]
+        if marker == 0xFF:
+            # Fill byte
+            position += 1
+            continue
+        if marker == 0xDA:
+            # Start of scan: the rest is image data
+            output += data[position:]
+            return bytes(output)
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            output += data[position:position + 2]
+            position += 2
+            continue
         
+        end = position + 2 + int.from_bytes(data[position + 2:position + 4], "big")
+        segment = data[position:end]
+        is_metadata = (0xE1 <= marker <= 0xEF or marker == 0xFE) and not (
+            (marker == 0xE2 and segment[4:16] == b"ICC_PROFILE\x00") or marker == 0xEE
+        )
+        if not is_metadata:
+            output += segment
+        position = end
+    raise ValueError("JPEG has no image data")
+
+
+def _strip_png(data: bytes) -> bytes:
+    output = bytearray(data[:8])
+    position = 8
+    while position + 8 <= len(data):
+        length = int.from_bytes(data[position:position + 4], "big")
+        chunk_type = data[position + 4:position + 8]
+        end = position + 12 + length
+        if end > len(data):
+            raise ValueError("Truncated PNG chunk")
+        if chunk_type not in PNG_METADATA_CHUNKS:
+            output += data[position:end]
+        position = end
+        if chunk_type == b"IEND":
+            return bytes(output)
+    raise ValueError("PNG has no IEND chunk")
+
+
+def _stream_to_disk(source: BinaryIO, file_path: Path, detect=detect_image_type) -> SavedUpload:
+    """Copy an upload to disk chunk by chunk, validating and hashing as it goes"""
+    hasher = hashlib.sha256()
+    size = 0
+    mime_type = None
+    
+    try:
+        with open(file_path, "wb") as buffer:
+            while chunk := source.read(UPLOAD_CHUNK_SIZE):
+                if mime_type is None:
+                    mime_type = detect(chunk[:16])
+                    if mime_type is None:
+                        raise UploadRejected("File content is not a supported image or video format")
+                
+                size += len(chunk)
+                if size > settings.MAX_FILE_SIZE:
+                    raise UploadRejected(
+                        f"File size exceeds maximum allowed size of {settings.MAX_FILE_SIZE} bytes",
+                        status_code=413
+                    )
+                
+                hasher.update(chunk)
+                buffer.write(chunk)
+        
+        if mime_type is None:
+            raise UploadRejected("File is empty")
+    except BaseException:
+        file_path.unlink(missing_ok=True)
+        raise
+    
+    return SavedUpload(path=str(file_path), size=size, sha256=hasher.hexdigest(), mime_type=mime_type)
+
+
+def validate_file(file: UploadFile) -> bool:
+    """
+    Validate the parts of an upload known before its content is read
+    
+    The content itself (signature and actual size) is checked while it is
+    streamed to disk by save_upload_file.
+    
+    Args:
+        file: Uploaded file
+    
     Returns:
         True if valid
-        
+    
     Raises:
-        ValueError: If file is invalid
+        UploadRejected: If file is invalid
     """
-    # Check file size
-    if file.size > settings.MAX_FILE_SIZE:
-        raise ValueError(f"File size exceeds maximum allowed size of {settings.MAX_FILE_SIZE} bytes")
+    # Check declared size
+    if file.size is not None and file.size > settings.MAX_FILE_SIZE:
+        raise UploadRejected(
+            f"File size exceeds maximum allowed size of {settings.MAX_FILE_SIZE} bytes",
+            status_code=413
+        )
     
     # Check file extension
-    file_extension = Path(file.filename).suffix.lower()
-    if file_extension not in settings.ALLOWED_EXTENSIONS:
-        raise ValueError(f"File extension {file_extension} not allowed. Allowed: {settings.ALLOWED_EXTENSIONS}")
+    file_extension = Path(file.filename or "").suffix.lower()
+    allowed = settings.ALLOWED_EXTENSIONS + settings.VIDEO_EXTENSIONS
+    if file_extension not in allowed:
+        raise UploadRejected(f"File extension {file_extension} not allowed. Allowed: {allowed}")
     
     # Check MIME type
-    if not file.content_type.startswith("image/"):
-        raise ValueError("File must be an image")
+    media = "video/" if file_extension in settings.VIDEO_EXTENSIONS else "image/"
+    if not (file.content_type or "").startswith(media):
+        raise UploadRejected("File must be an image" if media == "image/" else "File must be a video")
     
-    # Read first few bytes to check magic number
-    content = await file.read(1024)
-    await file.seek(0)  # Reset file pointer
+    return True
+
+
+def path_matches(path: str, prefixes) -> bool:
+    """
+    Whether a request path is one of prefixes or below one of them
     
-    mime_type = magic.from_buffer(content, mime=True)
-    if not mime_type.startswith("image/"):
-        raise ValueError(f"Invalid image format: {mime_type}")
+    "/api/sessions" matches "/api/sessions/abc/backgrounds" but not
+    "/api/sessionsx".
+    """
+    return any(path == prefix or path.startswith(prefix.rstrip("/") + "/") for prefix in prefixes)
+
+
+class MultipartHeadSniffer:
+    """
+    Checks the signature of a multipart file part as the body arrives
     
-    return True
+    Starlette spools the whole multipart body before the endpoint runs, so
+    save_upload_file only sees the file once it has all been received.
+    This finds the file part in the first UPLOAD_BODY_OVERHEAD bytes of the
+    raw body and checks its leading bytes, so a non-image is refused after
+    its first chunk instead. Bodies it can't make sense of are passed on for
+    save_upload_file to judge.
+    """
+    
+    def __init__(self, boundary: bytes, field: str = "file"):
+        self.delimiter = b"--" + boundary
+        self.field = field
+        self.buffer = bytearray()
+        self.done = False
+    
+    @classmethod
+    def for_scope(cls, scope: Scope) -> Optional["MultipartHeadSniffer"]:
+        """A sniffer for a multipart/form-data request, None for other bodies"""
+        content_type = Headers(scope=scope).get("content-type", "")
+        match = re.match(r'multipart/form-data;.*boundary="?([^";]+)"?', content_type, re.IGNORECASE)
+        return cls(match.group(1).encode("latin-1")) if match else None
+    
+    def feed(self, chunk: bytes) -> bool:
+        """
+        Add the next bytes of the body
+        
+        Returns:
+            False once the file part is known not to be an accepted format
+        """
+        if self.done:
+            return True
+        self.buffer += chunk
+        
+        found = self._find_head()
+        if found is None:
+            # Too far in to be the framing before the file; leave it to save_upload_file
+            self.done = len(self.buffer) > UPLOAD_BODY_OVERHEAD
+            return True
+        
+        self.done = True
+        self.buffer = bytearray()
+        filename, head = found
+        if not head:
+            return True
+        detect = detect_video_type if Path(filename).suffix.lower() in settings.VIDEO_EXTENSIONS else detect_image_type
+        return detect(head) is not None
+    
+    def _find_head(self) -> Optional[Tuple[str, bytes]]:
+        """Filename and first 16 bytes of the file part, None until they have arrived"""
+        position = 0
+        while True:
+            start = self.buffer.find(self.delimiter, position)
+            if start < 0:
+                return None
+            header_start = start + len(self.delimiter)
+            header_end = self.buffer.find(b"\r\n\r\n", header_start)
+            if header_end < 0:
+                return None
+            
+            headers = bytes(self.buffer[header_start:header_end]).decode("latin-1")
+            content_start = header_end + 4
+            name = re.search(r'\bname="([^"]*)"', headers)
+            if name is None or name.group(1) != self.field:
+                position = content_start
+                continue
+            
+            part_end = self.buffer.find(b"\r\n" + self.delimiter, content_start)
+            content_end = content_start + 16 if part_end < 0 else min(part_end, content_start + 16)
+            if content_end > len(self.buffer):
+                return None
+            filename = re.search(r'\bfilename="([^"]*)"', headers)
+            return (filename.group(1) if filename else ""), bytes(self.buffer[content_start:content_end])
+
+
+class UploadGuardMiddleware:
+    """
+    ASGI middleware refusing oversized or non-image upload bodies early
+    
+    A Content-Length over the limit is refused with 413 before any of the
+    body is read; chunked bodies are counted as they arrive and cut off
+    once they pass it. The limit is MAX_FILE_SIZE plus room for the
+    multipart framing. A file part whose leading bytes are not an accepted
+    format gets 400 as soon as they arrive (see MultipartHeadSniffer).
+    """
+    
+    def __init__(self, app: ASGIApp, paths: Optional[list] = None):
+        self.app = app
+        self.paths = list(paths if paths is not None else settings.ADMISSION_PATHS)
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or not path_matches(scope["path"], self.paths):
+            await self.app(scope, receive, send)
+            return
+        
+        limit = settings.MAX_FILE_SIZE + UPLOAD_BODY_OVERHEAD
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse(
+                {"detail": f"File size must be less than {settings.MAX_FILE_SIZE} bytes"},
+                status_code=413
+            )
+            await response(scope, receive, send)
+            return
+        
+        received = 0
+        sniffer = MultipartHeadSniffer.for_scope(scope)
+        
+        async def guarded_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                body = message.get("body", b"")
+                received += len(body)
+                if received > limit:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File size must be less than {settings.MAX_FILE_SIZE} bytes"
+                    )
+                if sniffer is not None and not sniffer.feed(body):
+                    logger.warning("Rejected upload: file content is not a supported image or video format")
+                    raise HTTPException(
+                        status_code=400,
+                        detail="File content is not a supported image or video format"
+                    )
+            return message
+        
+        await self.app(scope, guarded_receive, send)
 
 
 def get_file_info(file_path: str) -> dict:
@@ -94,7 +432,7 @@ def get_file_info(file_path: str) -> dict:
     
     Args:
         file_path: Path to file
-        
+    
     Returns:
         Dictionary with file information
     """
@@ -115,53 +453,13 @@ def get_file_info(file_path: str) -> dict:
         return {}
 
 
-def cleanup_temp_files(directory: str = None, max_age_hours: int = 24):
-    """
-    Clean up temporary files older than specified age
-    
-    Args:
-        directory: Directory to clean (defaults to temp directory)
-        max_age_hours: Maximum age in hours before deletion
-    """
-    try:
-        if directory is None:
-            directory = settings.TEMP_DIR
-        
-        temp_dir = Path(directory)
-        if not temp_dir.exists():
-            return
-        
-        current_time = time.time()
-        max_age_seconds = max_age_hours * 3600
-        
-        cleaned_count = 0
-        
-        for file_path in temp_dir.iterdir():
-            if file_path.is_file():
-                file_age = current_time - file_path.stat().st_mtime
-                
-                if file_age > max_age_seconds:
-                    try:
-                        file_path.unlink()
-                        cleaned_count += 1
-                        logger.debug(f"Cleaned up old file: {file_path}")
-                    except Exception as e:
-                        logger.warning(f"Could not delete file {file_path}: {e}")
-        
-        if cleaned_count > 0:
-            logger.info(f"Cleaned up {cleaned_count} old files from {directory}")
-            
-    except Exception as e:
-        logger.error(f"Error during cleanup: {e}")
-
-
 def ensure_directory_exists(directory: str) -> bool:
     """
     Ensure directory exists, create if it doesn't
     
     Args:
         directory: Directory path
-        
+    
     Returns:
         True if directory exists or was created
     """
@@ -180,7 +478,7 @@ def get_safe_filename(filename: str) -> str:
     
     Args:
         filename: Original filename
-        
+    
     Returns:
         Safe filename
     """
@@ -205,7 +503,7 @@ def get_file_size_mb(file_path: str) -> float:
     
     Args:
         file_path: Path to file
-        
+    
     Returns:
         File size in MB
     """
@@ -223,7 +521,7 @@ def is_image_file(file_path: str) -> bool:
     
     Args:
         file_path: Path to file
-        
+    
     Returns:
         True if file is an image
     """
@@ -233,12 +531,10 @@ def is_image_file(file_path: str) -> bool:
         if extension not in settings.ALLOWED_EXTENSIONS:
             return False
         
-        # Check magic number
+        # Check the signature, as uploads are
         with open(file_path, 'rb') as f:
-            content = f.read(1024)
-            mime_type = magic.from_buffer(content, mime=True)
-            return mime_type.startswith("image/")
-            
+            return detect_image_type(f.read(16)) is not None
+    
     except Exception as e:
         logger.error(f"Error checking if file is image: {e}")
         return False
@@ -251,7 +547,7 @@ def list_files_in_directory(directory: str, pattern: str = "*") -> List[str]:
     Args:
         directory: Directory path
         pattern: File pattern (e.g., "*.jpg")
-        
+    
     Returns:
         List of file paths
     """
@@ -262,7 +558,7 @@ def list_files_in_directory(directory: str, pattern: str = "*") -> List[str]:
         
         files = list(dir_path.glob(pattern))
         return [str(f) for f in files if f.is_file()]
-        
+    
     except Exception as e:
         logger.error(f"Error listing files: {e}")
         return []
@@ -275,7 +571,7 @@ def move_file(source: str, destination: str) -> bool:
     Args:
         source: Source file path
         destination: Destination file path
-        
+    
     Returns:
         True if successful
     """
@@ -288,7 +584,7 @@ def move_file(source: str, destination: str) -> bool:
         shutil.move(source, destination)
         logger.info(f"Moved file from {source} to {destination}")
         return True
-        
+    
     except Exception as e:
         logger.error(f"Error moving file: {e}")
         return False
@@ -301,7 +597,7 @@ def copy_file(source: str, destination: str) -> bool:
     Args:
         source: Source file path
         destination: Destination file path
-        
+    
     Returns:
         True if successful
     """
@@ -314,7 +610,7 @@ def copy_file(source: str, destination: str) -> bool:
         shutil.copy2(source, destination)
         logger.info(f"Copied file from {source} to {destination}")
         return True
-        
+    
     except Exception as e:
         logger.error(f"Error copying file: {e}")
         return False 
\ No newline at end of file
@@ -0,0 +1,182 @@
+"""
+HTTP response helpers for GeoMask
+"""
+
+import os
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from app.config import settings
+from app.utils.file_index import FileIndex, FileMetadata
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+
+def parse_range_header(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single byte range
+    
+    Args:
+        range_header: Value of the Range header
+        size: Size of the resource in bytes
+    
+    Returns:
+        Inclusive (start, end) offsets, or None if the header should be
+        ignored and the full resource served
+    
+    Raises:
+        ValueError: If the range cannot be satisfied
+    """
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        # Unknown units and multipart ranges fall back to a full response
+        return None
+    
+    start_text, sep, end_text = ranges.strip().partition("-")
+    if not sep:
+        return None
+    
+    try:
+        start = int(start_text) if start_text else None
+        end = int(end_text) if end_text else None
+    except ValueError:
+        # Malformed ranges are ignored
+        return None
+    
+    if start is None:
+        # Suffix range: last N bytes
+        if end is None or end <= 0 or size == 0:
+            raise ValueError("Range not satisfiable")
+        return max(0, size - end), size - 1
+    
+    if end is None:
+        end = size - 1
+    
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    
+    return start, min(end, size - 1)
+
+
+class IndexedFileResponse(Response):
+    """
+    File response driven by precomputed metadata
+    
+    Supports conditional requests (If-None-Match), single byte ranges and
+    zero-copy sendfile when the ASGI server offers it.
+    """
+    
+    def __init__(
+        self,
+        request: Request,
+        metadata: FileMetadata,
+        index: FileIndex,
+        filename: str
+    ):
+        self.metadata = metadata
+        self.index = index
+        self.byte_range: Optional[Tuple[int, int]] = None
+        
+        headers = {
+            "etag": metadata.etag,
+            "cache-control": settings.DOWNLOAD_CACHE_CONTROL,
+            "accept-ranges": "bytes",
+            "content-disposition": f"attachment; filename*=utf-8''{quote(filename)}"
+        }
+        
+        status_code = 200
+        if self._etag_matches(request.headers.get("if-none-match"), metadata.etag):
+            status_code = 304
+        else:
+            range_header = request.headers.get("range")
+            if_range = request.headers.get("if-range")
+            if range_header and (if_range is None or if_range == metadata.etag):
+                try:
+                    self.byte_range = parse_range_header(range_header, metadata.size)
+                except ValueError:
+                    status_code = 416
+                    headers["content-range"] = f"bytes */{metadata.size}"
+            
+            if self.byte_range is not None:
+                start, end = self.byte_range
+                status_code = 206
+                headers["content-range"] = f"bytes {start}-{end}/{metadata.size}"
+        
+        # 304 and 416 have no body: no content type, and Response leaves
+        # Content-Length off the 304 entirely
+        media_type = None
+        if status_code == 200:
+            headers["content-length"] = str(metadata.size)
+            media_type = metadata.content_type
+        elif status_code == 206:
+            headers["content-length"] = str(self.byte_range[1] - self.byte_range[0] + 1)
+            media_type = metadata.content_type
+        
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+    
+    @staticmethod
+    def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+        """Check an If-None-Match header against a strong ETag"""
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return etag in candidates
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if self.status_code not in (200, 206):
+            await super().__call__(scope, receive, send)
+            return
+        
+        try:
+            file = await anyio.to_thread.run_sync(open, self.metadata.path, "rb")
+        except FileNotFoundError:
+            # Deleted behind the index's back
+            self.index.remove(os.path.basename(self.metadata.path))
+            response = Response(status_code=404)
+            await response(scope, receive, send)
+            return
+        
+        start, end = self.byte_range or (0, self.metadata.size - 1)
+        remaining = end - start + 1
+        
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            
+            if scope["method"] == "HEAD" or remaining <= 0:
+                await send({"type": "http.response.body", "body": b""})
+                return
+            
+            if ZEROCOPY_EXTENSION in scope.get("extensions", {}):
+                await send({
+                    "type": ZEROCOPY_EXTENSION,
+                    "file": file.fileno(),
+                    "offset": start,
+                    "count": remaining
+                })
+                return
+            
+            await anyio.to_thread.run_sync(file.seek, start)
+            while remaining > 0:
+                chunk = await anyio.to_thread.run_sync(file.read, min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            
+            if remaining > 0:
+                # File shrank underneath us; terminate the body cleanly
+                await send({"type": "http.response.body", "body": b""})
+        
+        finally:
+            await anyio.to_thread.run_sync(file.close)
@@ -1,13 +1,157 @@
 """
 Logging utilities for GeoMask
+
+Every module logger feeds one shared QueueHandler. A single QueueListener
+thread owns the sinks (console, daily-rotated log file and error file), so
+formatting and disk I/O never run on the event loop and each file is only
+opened once per process.
 """
 
+import atexit
+import json
 import logging
+import queue
+import random
 import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 from pathlib import Path
-from datetime import datetime
+from typing import List, Optional
 from app.config import settings
 
+# Pass as extra= on per-image INFO lines that may be sampled under load
+SAMPLED = {"sampled": True}
+
+_lock = threading.Lock()
+_queue_handler: Optional["DroppingQueueHandler"] = None
+_listener: Optional[QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "function": record.funcName,
+            "line": record.lineno,
+            "process": record.process
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of records marked with extra=SAMPLED"""
+    
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "sampled", False) or record.levelno > logging.INFO:
+            return True
+        return self.rate >= 1.0 or random.random() < self.rate
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+    
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+    
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _build_formatter(detailed: bool) -> logging.Formatter:
+    if settings.LOG_FORMAT.lower() == "json":
+        return JsonFormatter()
+    if detailed:
+        return logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(funcName)s:%(lineno)d - %(message)s'
+        )
+    return logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+
+def _build_sinks() -> List[logging.Handler]:
+    """Create the shared console and file handlers"""
+    # Console handler
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(_build_formatter(detailed=False))
+    sinks = [console_handler]
+    
+    if not settings.LOG_TO_FILE:
+        return sinks
+    
+    # Detailed and error logs, rotated at midnight by the handler itself
+    try:
+        log_dir = Path(settings.LOG_DIR)
+        log_dir.mkdir(exist_ok=True)
+        
+        for filename, level in (("geomask.log", logging.DEBUG), ("geomask_errors.log", logging.ERROR)):
+            file_handler = TimedRotatingFileHandler(
+                log_dir / filename,
+                when="midnight",
+                backupCount=settings.LOG_BACKUP_DAYS,
+                encoding="utf-8",
+                delay=True
+            )
+            file_handler.setLevel(level)
+            file_handler.setFormatter(_build_formatter(detailed=True))
+            sinks.append(file_handler)
+    
+    except Exception as e:
+        # If file logging fails, just log to console
+        print(f"Could not setup file logging: {e}", file=sys.stderr)
+    
+    return sinks
+
+
+def _get_queue_handler() -> "DroppingQueueHandler":
+    """Create the shared queue handler and start its listener once"""
+    global _queue_handler, _listener
+    
+    with _lock:
+        if _queue_handler is None:
+            log_queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+            handler = DroppingQueueHandler(log_queue)
+            handler.addFilter(SamplingFilter(settings.LOG_SAMPLE_RATE))
+            
+            _listener = QueueListener(log_queue, *_build_sinks(), respect_handler_level=True)
+            _listener.start()
+            atexit.register(shutdown_logging)
+            _queue_handler = handler
+        
+        return _queue_handler
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    
+    with _lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+def dropped_records() -> int:
+    """Records dropped because the log queue was full"""
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
 
 def setup_logger(name: str, level: str = None) -> logging.Logger:
     """
@@ -16,7 +160,7 @@ def setup_logger(name: str, level: str = None) -> logging.Logger:
     Args:
         name: Logger name (usually __name__)
         level: Logging level (optional, uses settings if not provided)
-        
+    
     Returns:
         Configured logger instance
     """
@@ -31,46 +175,7 @@ def setup_logger(name: str, level: str = None) -> logging.Logger:
     if logger.handlers:
         return logger
     
-    # Create formatters
-    detailed_formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(funcName)s:%(lineno)d - %(message)s'
-    )
-    
-    simple_formatter = logging.Formatter(
-        '%(asctime)s - %(levelname)s - %(message)s'
-    )
-    
-    # Console handler
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(logging.INFO)
-    console_handler.setFormatter(simple_formatter)
-    logger.addHandler(console_handler)
-    
-    # File handler for detailed logs
-    try:
-        log_dir = Path("logs")
-        log_dir.mkdir(exist_ok=True)
-        
-        log_file = log_dir / f"geomask_{datetime.now().strftime('%Y%m%d')}.log"
-        file_handler = logging.FileHandler(log_file)
-        file_handler.setLevel(logging.DEBUG)
-        file_handler.setFormatter(detailed_formatter)
-        logger.addHandler(file_handler)
-        
-    except Exception as e:
-        # If file logging fails, just log to console
-        logger.warning(f"Could not setup file logging: {e}")
-    
-    # Error file handler
-    try:
-        error_log_file = log_dir / f"geomask_errors_{datetime.now().strftime('%Y%m%d')}.log"
-        error_handler = logging.FileHandler(error_log_file)
-        error_handler.setLevel(logging.ERROR)
-        error_handler.setFormatter(detailed_formatter)
-        logger.addHandler(error_handler)
-        
-    except Exception as e:
-        logger.warning(f"Could not setup error file logging: {e}")
+    logger.addHandler(_get_queue_handler())
     
     return logger
 
@@ -81,7 +186,7 @@ def get_logger(name: str) -> logging.Logger:
     
     Args:
         name: Logger name
-        
+    
     Returns:
         Logger instance
     """
@@ -94,4 +199,4 @@ class LoggerMixin:
     @property
     def logger(self) -> logging.Logger:
         """Get logger for this class"""
-        return get_logger(self.__class__.__name__) 
\ No newline at end of file
+        return get_logger(self.__class__.__name__)
@@ -0,0 +1,237 @@
+"""
+Prometheus metrics for GeoMask
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Covers fast CPU stages (ms) through slow provider calls (tens of seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+STAGE_SECONDS = Histogram(
+    "geomask_stage_seconds",
+    "Time spent in each processing stage",
+    ["stage"],
+    buckets=LATENCY_BUCKETS
+)
+PROCESS_SECONDS = Histogram(
+    "geomask_process_seconds",
+    "End-to-end /api/process handling time",
+    buckets=LATENCY_BUCKETS
+)
+PROVIDER_SECONDS = Histogram(
+    "geomask_provider_seconds",
+    "Latency of individual image provider calls",
+    ["provider", "outcome"],
+    buckets=LATENCY_BUCKETS
+)
+CACHE_REQUESTS = Counter(
+    "geomask_cache_requests_total",
+    "Cache lookups by cache and result (hit or miss)",
+    ["cache", "result"]
+)
+DECODES = Counter(
+    "geomask_decodes_total",
+    "Images decoded by backend and format",
+    ["backend", "format"]
+)
+CANCELLATIONS = Counter(
+    "geomask_cancellations_total",
+    "Requests whose processing was abandoned, by reason (disconnect or deadline)",
+    ["reason"]
+)
+DEGRADATIONS = Counter(
+    "geomask_degradations_total",
+    "Stages that did cheaper work to stay within a request's deadline",
+    ["stage"]
+)
+
+QUALITY_TIERS = Counter(
+    "geomask_quality_tier_total",
+    "Requests by the quality tier chosen for them (full, reduced or minimal)",
+    ["tier"]
+)
+
+_service_collectors: List["ServiceStatsCollector"] = []
+_current_timings: ContextVar[Optional["StageTimings"]] = ContextVar("geomask_stage_timings", default=None)
+
+
+class StageTimings:
+    """Per-request stage durations in seconds"""
+    
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+    
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+    
+    def as_dict(self) -> Dict[str, float]:
+        return {stage: round(seconds, 4) for stage, seconds in self.stages.items()}
+
+
+@contextmanager
+def collect_timings() -> Iterator[StageTimings]:
+    """Collect the stage timings recorded by the enclosed work"""
+    timings = StageTimings()
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """
+    Time a processing stage
+    
+    The duration is observed in the stage histogram and, if the caller is
+    collecting timings, added to the current request's breakdown. Stages
+    running in worker threads are attributed as long as the thread was
+    started with the caller's context (asyncio.to_thread does this).
+    
+    Args:
+        stage: Stage name (upload, decode, detect, generate, resize, blend, encode, save)
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.add(stage, elapsed)
+
+
+def record_cache(cache: str, hit: bool):
+    """Count a cache lookup"""
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def record_decode(backend: str, image_format: str):
+    """Count an image decoded by a backend"""
+    DECODES.labels(backend, image_format).inc()
+
+
+def record_cancellation(reason: str):
+    """Count a request abandoned because the client left or its deadline passed"""
+    CANCELLATIONS.labels(reason).inc()
+
+
+def record_degradation(stage: str):
+    """Count a stage that did cheaper work to meet a deadline"""
+    DEGRADATIONS.labels(stage).inc()
+
+
+def record_quality_tier(tier: str):
+    """Count a request served at a quality tier"""
+    QUALITY_TIERS.labels(tier).inc()
+
+
+class ServiceStatsCollector:
+    """
+    Exports the state of long-lived services at scrape time
+    
+    Reads the stats() of each service instead of mirroring every change
+    into gauges, so the hot paths stay free of metric updates.
+    """
+    
+    def __init__(self, admission=None, reaper=None, gateway=None, router=None, sessions=None, quality=None):
+        self.admission = admission
+        self.reaper = reaper
+        self.gateway = gateway
+        self.router = router
+        self.sessions = sessions
+        self.quality = quality
+    
+    def collect(self):
+        if self.admission is not None:
+            stats = self.admission.stats()
+            yield GaugeMetricFamily("geomask_jobs_in_flight", "Jobs currently processing", value=stats["in_flight"])
+            yield GaugeMetricFamily("geomask_jobs_waiting", "Jobs queued for a processing slot", value=stats["waiting"])
+            yield CounterMetricFamily("geomask_jobs_rejected", "Jobs rejected by admission control", value=stats["rejected_total"])
+        
+        if self.reaper is not None:
+            stats = self.reaper.stats()
+            yield GaugeMetricFamily("geomask_reaper_tracked_files", "Files tracked by the reaper", value=stats["tracked_files"])
+            yield GaugeMetricFamily("geomask_reaper_expired_due", "Expired files awaiting deletion", value=stats["expired_due"])
+            yield GaugeMetricFamily("geomask_reaper_bytes_over_quota", "Bytes above directory quotas", value=stats["bytes_over_quota"])
+            yield CounterMetricFamily("geomask_reaper_deleted", "Files deleted by the reaper", value=stats["deleted_total"])
+            directory_bytes = GaugeMetricFamily("geomask_directory_bytes", "Bytes tracked per directory", labels=["directory"])
+            for directory, size in stats["directory_bytes"].items():
+                directory_bytes.add_metric([directory], size)
+            yield directory_bytes
+        
+        if self.gateway is not None:
+            stats = self.gateway.stats()
+            yield GaugeMetricFamily("geomask_provider_pending_keys", "Distinct provider requests in flight", value=stats["pending_keys"])
+            yield CounterMetricFamily("geomask_provider_abandoned", "Provider calls cancelled because no request still waited for them", value=stats["cancelled_total"])
+            in_flight = GaugeMetricFamily("geomask_provider_in_flight", "Provider calls in flight", labels=["provider"])
+            backoff = GaugeMetricFamily("geomask_provider_backoff_seconds", "Current provider backoff window", labels=["provider"])
+            rate_limited = CounterMetricFamily("geomask_provider_rate_limited", "Provider 429 responses", labels=["provider"])
+            for name, provider in stats["providers"].items():
+                in_flight.add_metric([name], provider["in_flight"])
+                backoff.add_metric([name], provider["backoff_seconds"])
+                rate_limited.add_metric([name], provider["rate_limited_total"])
+            yield in_flight
+            yield backoff
+            yield rate_limited
+        
+        if self.router is not None:
+            stats = self.router.stats()
+            yield CounterMetricFamily("geomask_provider_hedges", "Hedged provider requests", value=stats["hedges_total"])
+            error_rate = GaugeMetricFamily("geomask_provider_error_rate", "Rolling provider error rate", labels=["provider"])
+            circuit_open = GaugeMetricFamily("geomask_provider_circuit_open", "1 if the provider's circuit is open", labels=["provider"])
+            for name, provider in stats["providers"].items():
+                error_rate.add_metric([name], provider["error_rate"])
+                circuit_open.add_metric([name], 1.0 if provider["circuit"] == "open" else 0.0)
+            yield error_rate
+            yield circuit_open
+        
+        if self.sessions is not None:
+            stats = self.sessions.stats()
+            yield GaugeMetricFamily("geomask_sessions", "Editing sessions held in memory", value=stats["sessions"])
+            yield GaugeMetricFamily("geomask_session_bytes", "Bytes held by in-memory editing sessions", value=stats["bytes"])
+            yield GaugeMetricFamily("geomask_session_max_bytes", "Memory budget for editing sessions", value=stats["max_bytes"])
+            yield CounterMetricFamily("geomask_sessions_evicted", "Editing sessions evicted to stay within budget", value=stats["evicted_total"])
+        
+        if self.quality is not None:
+            stats = self.quality.stats()
+            yield GaugeMetricFamily("geomask_quality_level", "Current quality tier (0 full, 1 reduced, 2 minimal)", value=stats["level"])
+            yield GaugeMetricFamily("geomask_quality_load", "Jobs in flight and waiting per processing slot", value=stats["load"])
+            yield GaugeMetricFamily("geomask_quality_latency_seconds", "Mean latency of requests completed in the last minute", value=stats["latency"])
+
+
+def register_service_stats(**services) -> ServiceStatsCollector:
+    """Register a collector exporting the given services' stats"""
+    collector = ServiceStatsCollector(**services)
+    REGISTRY.register(collector)
+    _service_collectors.append(collector)
+    return collector
+
+
+def render_metrics() -> tuple:
+    """
+    Render all metrics in the Prometheus text format
+    
+    Under gunicorn, PROMETHEUS_MULTIPROC_DIR is set and counters and
+    histograms are summed over every worker's files. Service stats are
+    live objects, so they describe the worker that answered the scrape.
+    """
+    if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+    
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    for collector in _service_collectors:
+        registry.register(collector)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,236 @@
+"""
+Sampling profiler for slow requests in GeoMask
+
+A background thread periodically snapshots the Python stack of every
+thread (sys._current_frames), so both the event loop and the worker threads
+running OpenCV code show up. Samples are aggregated as collapsed stacks,
+the input format of flamegraph.pl and speedscope.
+
+Requests are profiled from the start for a random fraction of traffic, or
+from the moment they exceed PROFILE_SLOW_SECONDS. The sampler only runs
+while at least one request is being profiled. Since samples cover the whole
+process, a profile taken under concurrency also includes other requests.
+"""
+
+import asyncio
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import List, Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.config import settings
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+PROFILE_SUFFIX = ".folded"
+PROFILE_NAME_PATTERN = re.compile(r"^[\w.-]+\.folded$")
+
+
+class ProfileSession:
+    """Samples collected while one request was being profiled"""
+    
+    def __init__(self, label: str, reason: str):
+        self.label = label
+        self.reason = reason
+        self.started = time.time()
+        self.stacks: Counter = Counter()
+        self.samples = 0
+    
+    def render(self) -> str:
+        """Render the samples as collapsed stacks, one 'frames count' line each"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class SamplingProfiler:
+    """Process-wide stack sampler shared by all active sessions"""
+    
+    def __init__(self, interval: Optional[float] = None):
+        self.interval = interval if interval is not None else settings.PROFILE_INTERVAL_MS / 1000
+        self._sessions: List[ProfileSession] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+    
+    def start(self, label: str, reason: str) -> ProfileSession:
+        """Start collecting samples for a new session"""
+        session = ProfileSession(label, reason)
+        with self._lock:
+            self._sessions.append(session)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="geomask-profiler", daemon=True)
+                self._thread.start()
+        return session
+    
+    def stop(self, session: ProfileSession):
+        """Stop collecting samples for a session"""
+        with self._lock:
+            if session in self._sessions:
+                self._sessions.remove(session)
+    
+    @property
+    def active(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+    
+    def _run(self):
+        """Sample until no session is left"""
+        own_ident = threading.get_ident()
+        
+        while True:
+            with self._lock:
+                sessions = list(self._sessions)
+                if not sessions:
+                    self._thread = None
+                    return
+            
+            stacks = self._sample(own_ident)
+            with self._lock:
+                for session in sessions:
+                    session.stacks.update(stacks)
+                    session.samples += 1
+            
+            time.sleep(self.interval)
+    
+    @staticmethod
+    def _sample(own_ident: int) -> List[str]:
+        """Collapse the current stack of every other thread"""
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = []
+        
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{Path(code.co_filename).name}:{code.co_name}")
+                frame = frame.f_back
+            frames.append(names.get(ident, f"thread-{ident}").replace(" ", "_"))
+            stacks.append(";".join(reversed(frames)))
+        
+        return stacks
+
+
+class ProfileStore:
+    """Bounded directory of saved profiles"""
+    
+    def __init__(self, directory: Optional[str] = None, max_files: Optional[int] = None):
+        self.directory = Path(directory or settings.PROFILE_DIR)
+        self.max_files = max_files or settings.PROFILE_MAX_FILES
+    
+    def save(self, session: ProfileSession, duration: float) -> Optional[Path]:
+        """
+        Write a session to disk, evicting the oldest profiles
+        
+        Args:
+            session: Finished profiling session
+            duration: Request duration in seconds
+        
+        Returns:
+            Path of the saved profile, or None if nothing was sampled
+        """
+        if not session.samples:
+            return None
+        
+        self.directory.mkdir(parents=True, exist_ok=True)
+        timestamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(session.started))
+        name = f"{timestamp}_{session.reason}_{duration:.1f}s_{session.label}{PROFILE_SUFFIX}"
+        path = self.directory / name
+        path.write_text(session.render())
+        
+        profiles = sorted(self.directory.glob(f"*{PROFILE_SUFFIX}"), key=lambda p: p.stat().st_mtime)
+        for old in profiles[:max(0, len(profiles) - self.max_files)]:
+            old.unlink(missing_ok=True)
+        
+        return path
+    
+    def list(self) -> List[dict]:
+        """Saved profiles, newest first"""
+        if not self.directory.exists():
+            return []
+        
+        entries = []
+        for path in self.directory.glob(f"*{PROFILE_SUFFIX}"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append({"name": path.name, "size": stat.st_size, "created": stat.st_mtime})
+        return sorted(entries, key=lambda e: e["created"], reverse=True)
+    
+    def path(self, name: str) -> Optional[Path]:
+        """Resolve a profile name to its path, rejecting anything else"""
+        if not PROFILE_NAME_PATTERN.match(name):
+            return None
+        path = self.directory / name
+        return path if path.is_file() else None
+
+
+profiler = SamplingProfiler()
+profile_store = ProfileStore()
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles sampled and slow requests
+    
+    A request is profiled from the start with probability sample_rate;
+    otherwise profiling starts once it has run for slow_seconds, so only
+    the slow tail pays for sampling.
+    """
+    
+    def __init__(
+        self,
+        app: ASGIApp,
+        paths: Optional[list] = None,
+        sample_rate: Optional[float] = None,
+        slow_seconds: Optional[float] = None,
+        enabled: Optional[bool] = None
+    ):
+        self.app = app
+        self.paths = set(paths if paths is not None else settings.PROFILE_PATHS)
+        self.sample_rate = sample_rate if sample_rate is not None else settings.PROFILE_SAMPLE_RATE
+        self.slow_seconds = slow_seconds if slow_seconds is not None else settings.PROFILE_SLOW_SECONDS
+        self.enabled = enabled if enabled is not None else settings.PROFILING_ENABLED
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if not self.enabled or scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        
+        label = uuid.uuid4().hex[:8]
+        session: Optional[ProfileSession] = None
+        timer = None
+        start = time.monotonic()
+        
+        def start_slow():
+            nonlocal session
+            session = profiler.start(label, "slow")
+        
+        if random.random() < self.sample_rate:
+            session = profiler.start(label, "sampled")
+        elif self.slow_seconds > 0:
+            timer = asyncio.get_running_loop().call_later(self.slow_seconds, start_slow)
+        
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if session is not None:
+                profiler.stop(session)
+                duration = time.monotonic() - start
+                try:
+                    path = await asyncio.to_thread(profile_store.save, session, duration)
+                    if path is not None:
+                        logger.info(f"Saved profile for {scope['path']} ({duration:.1f}s): {path.name}")
+                except Exception as e:
+                    logger.error(f"Error saving profile: {e}")
@@ -0,0 +1,126 @@
+"""
+Thread budgets for GeoMask
+
+OpenCV, the BLAS behind NumPy and thread pools each size themselves to
+every core of the machine. With several workers per host that
+oversubscribes the CPU: N workers each running N threads spend their
+time switching instead of computing. The cores a deployment may use
+(its cgroup CPU quota in a container, else its CPU affinity) are
+divided among the WEB_CONCURRENCY workers instead, and every pool in a
+worker is sized from its share.
+"""
+
+import math
+import os
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+from app.config import settings
+
+# Read once, when the libraries load
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS"
+)
+
+
+def cpu_quota(root: str = "/sys/fs/cgroup") -> Optional[float]:
+    """
+    CPU limit of the container, in cores
+    
+    Args:
+        root: cgroup filesystem mount point
+    
+    Returns:
+        Quota / period from cgroup v2 (cpu.max) or v1 (cpu.cfs_quota_us),
+        None without a limit
+    """
+    try:
+        quota, period = (Path(root) / "cpu.max").read_text().split()
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    
+    try:
+        quota = int((Path(root) / "cpu" / "cpu.cfs_quota_us").read_text())
+        period = int((Path(root) / "cpu" / "cpu.cfs_period_us").read_text())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def available_cpus() -> int:
+    """Cores this deployment may use: CPU_LIMIT, else the smaller of the cgroup quota and the CPU affinity"""
+    if settings.CPU_LIMIT > 0:
+        return max(1, int(settings.CPU_LIMIT))
+    
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    
+    quota = cpu_quota()
+    if quota is not None:
+        # A fractional core can't run another thread at full speed
+        cpus = min(cpus, max(1, math.floor(quota)))
+    return max(1, cpus)
+
+
+@dataclass(frozen=True)
+class ThreadBudget:
+    """How one worker process may use its share of the cores"""
+    cpus: int
+    workers: int
+    # Threads per worker for OpenCV and BLAS
+    native_threads: int
+    # Threads of the worker's executor (asyncio.to_thread)
+    executor_threads: int
+    
+    def env(self) -> Dict[str, str]:
+        """Thread counts for OpenMP and BLAS, by environment variable"""
+        return {name: str(self.native_threads) for name in THREAD_ENV_VARS}
+    
+    def apply_env(self):
+        """
+        Limit OpenMP and BLAS threads in this process and those it starts
+        
+        Only takes effect for libraries not loaded yet. Variables set by
+        the operator are kept.
+        """
+        for name, value in self.env().items():
+            os.environ.setdefault(name, value)
+    
+    def apply_opencv(self):
+        """Limit OpenCV's thread pool, if OpenCV is loaded"""
+        cv2 = sys.modules.get("cv2")
+        if cv2 is not None:
+            cv2.setNumThreads(self.native_threads)
+
+
+def plan_threads(cpus: Optional[int] = None, workers: Optional[int] = None) -> ThreadBudget:
+    """
+    Divide the cores among the workers
+    
+    Args:
+        cpus: Cores to divide (default: available_cpus())
+        workers: Worker processes sharing them (default: WEB_CONCURRENCY, else 1)
+    
+    Returns:
+        The budget of one worker, with NATIVE_THREADS and WORKER_THREADS
+        taking precedence where set
+    """
+    cpus = cpus or available_cpus()
+    workers = max(1, workers or int(os.environ.get("WEB_CONCURRENCY", "1")))
+    native = settings.NATIVE_THREADS or max(1, cpus // workers)
+    # Like Python's default of cores + 4, with the worker's cores; the extra
+    # threads cover file and cache I/O waiting rather than computing
+    executor = settings.WORKER_THREADS or min(32, native + 4)
+    return ThreadBudget(cpus, workers, native, executor)
+
+
+thread_budget = plan_threads()
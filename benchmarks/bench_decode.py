@@ -0,0 +1,90 @@
+"""
+Image decode benchmarks for GeoMask
+
+Times decode_image() with each available backend on JPEG, PNG and WebP
+encodings of the synthetic photo, at full size and at preview size
+(reduced decode to PREVIEW_MAX_EDGE), next to a plain cv2.imread of the
+same file. Usage:
+
+    python -m benchmarks.bench_decode --sizes medium phone --repeat 10
+"""
+
+import argparse
+import logging
+import sys
+import tempfile
+from pathlib import Path
+
+import cv2
+
+from app.config import settings
+from app.services import image_decoder
+from benchmarks.harness import format_table, measure, save_results
+from benchmarks.synthetic import RESOLUTIONS, make_photo
+
+DEFAULT_OUTPUT = Path(__file__).parent / "results" / "decode.json"
+
+ENCODINGS = {
+    "jpeg": (".jpg", [cv2.IMWRITE_JPEG_QUALITY, 90]),
+    "png": (".png", [cv2.IMWRITE_PNG_COMPRESSION, 3]),
+    "webp": (".webp", [cv2.IMWRITE_WEBP_QUALITY, 90])
+}
+
+
+def run(sizes, formats, backends, repeat: int, workdir: Path) -> dict:
+    """Run the decode benchmarks and return {benchmark: summary}"""
+    results = {}
+    configured = settings.DECODER_BACKENDS
+    
+    try:
+        for size in sizes:
+            photo = make_photo(*RESOLUTIONS[size])
+            for image_format in formats:
+                suffix, params = ENCODINGS[image_format]
+                path = workdir / f"{size}{suffix}"
+                cv2.imwrite(str(path), photo, params)
+                data = path.read_bytes()
+                
+                results[f"decode[{image_format},{size},cv2_imread]"] = measure(lambda: cv2.imread(str(path)), repeat)
+                
+                for backend in backends:
+                    # One backend at a time, so each is measured rather than the first that loads
+                    settings.DECODER_BACKENDS = [backend]
+                    image_decoder.available_backends.cache_clear()
+                    if not image_decoder.backends_for(image_format):
+                        continue
+                    
+                    results[f"decode[{image_format},{size},{backend}]"] = measure(
+                        lambda: image_decoder.decode_image(data), repeat
+                    )
+                    results[f"decode[{image_format},{size},{backend},preview]"] = measure(
+                        lambda: image_decoder.decode_image(data, min_edge=settings.PREVIEW_MAX_EDGE), repeat
+                    )
+                    print(f"{image_format} {size} {backend}", file=sys.stderr)
+    finally:
+        settings.DECODER_BACKENDS = configured
+        image_decoder.available_backends.cache_clear()
+    
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark image decoding backends")
+    parser.add_argument("--sizes", nargs="+", default=["medium", "phone"], choices=list(RESOLUTIONS))
+    parser.add_argument("--formats", nargs="+", default=list(ENCODINGS), choices=list(ENCODINGS))
+    parser.add_argument("--backends", nargs="+", default=list(image_decoder.BACKENDS), choices=list(image_decoder.BACKENDS))
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT)
+    args = parser.parse_args(argv)
+    
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory(prefix="geomask-bench-decode-") as tmp:
+        results = run(args.sizes, args.formats, args.backends, args.repeat, Path(tmp))
+    
+    save_results(args.output, results)
+    print(format_table(results))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+Logging overhead benchmarks for GeoMask
+
+Compares the caller-side cost of a log call with synchronous file handlers
+against the queue-based pipeline, and end-to-end process_image throughput
+with logging off, on, and sampled. Usage:
+
+    python -m benchmarks.bench_logging --size medium --repeat 10
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import queue
+import sys
+import tempfile
+from logging.handlers import QueueListener
+from pathlib import Path
+
+from benchmarks.harness import format_table, measure, save_results
+
+DEFAULT_OUTPUT = Path(__file__).parent / "results" / "logging.json"
+LINES_PER_RUN = 1000
+
+
+def log_call_benchmarks(workdir: Path, repeat: int) -> dict:
+    """Time LINES_PER_RUN INFO calls through each handler setup"""
+    from app.utils.logger import DroppingQueueHandler
+    
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(funcName)s:%(lineno)d - %(message)s')
+    results = {}
+    
+    # The previous setup: two synchronous file handlers on the caller's thread
+    sync_logger = logging.getLogger("bench.sync")
+    sync_logger.propagate = False
+    for name in ("sync.log", "sync_errors.log"):
+        handler = logging.FileHandler(workdir / name)
+        handler.setFormatter(formatter)
+        sync_logger.addHandler(handler)
+    sync_logger.handlers[1].setLevel(logging.ERROR)
+    sync_logger.setLevel(logging.INFO)
+    
+    # The queue pipeline: the caller only enqueues
+    sink = logging.FileHandler(workdir / "queued.log")
+    sink.setFormatter(formatter)
+    log_queue = queue.Queue(maxsize=100000)
+    listener = QueueListener(log_queue, sink, respect_handler_level=True)
+    queued_logger = logging.getLogger("bench.queued")
+    queued_logger.propagate = False
+    queued_logger.addHandler(DroppingQueueHandler(log_queue))
+    queued_logger.setLevel(logging.INFO)
+    listener.start()
+    
+    try:
+        for label, logger in (("sync_file", sync_logger), ("queue", queued_logger)):
+            def emit(logger=logger):
+                for i in range(LINES_PER_RUN):
+                    logger.info(f"Processing image: uploads/photo_{i}.jpg")
+            results[f"log_{LINES_PER_RUN}_calls[{label}]"] = measure(emit, repeat)
+    finally:
+        listener.stop()
+    
+    return results
+
+
+def end_to_end_benchmarks(workdir: Path, size: str, repeat: int) -> dict:
+    """process_image throughput with logging off, on and sampled"""
+    from app.config import settings
+    from app.services.image_processor import ImageProcessor
+    from app.utils import logger as app_logger
+    from benchmarks.fakes import FakeAIGenerator
+    from benchmarks.synthetic import RESOLUTIONS, write_photo
+    
+    settings.PROCESSED_DIR = str(workdir)
+    settings.DETECTION_CACHE_TTL_SECONDS = 0
+    processor = ImageProcessor(ai_generator=FakeAIGenerator(workdir))
+    photo = write_photo(workdir, size, *RESOLUTIONS[size])
+    loop = asyncio.new_event_loop()
+    
+    # Keep the console sink's output out of the report
+    devnull = open(os.devnull, "w")
+    for handler in app_logger._listener.handlers:
+        if type(handler) is logging.StreamHandler:
+            handler.setStream(devnull)
+    sampling = next(f for f in app_logger._queue_handler.filters if isinstance(f, app_logger.SamplingFilter))
+    
+    def run():
+        loop.run_until_complete(processor.process_image(str(photo), "city"))
+    
+    results = {}
+    try:
+        logging.disable(logging.CRITICAL)
+        results[f"end_to_end[{size},logging_off]"] = measure(run, repeat)
+        logging.disable(logging.NOTSET)
+        
+        sampling.rate = 1.0
+        results[f"end_to_end[{size},logging_on]"] = measure(run, repeat)
+        
+        sampling.rate = 0.1
+        results[f"end_to_end[{size},logging_sampled_10pct]"] = measure(run, repeat)
+    finally:
+        logging.disable(logging.NOTSET)
+        loop.close()
+    
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark logging overhead")
+    parser.add_argument("--size", default="small", choices=["small", "medium", "large", "phone"])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT)
+    args = parser.parse_args(argv)
+    
+    with tempfile.TemporaryDirectory(prefix="geomask-bench-logging-") as tmp:
+        workdir = Path(tmp)
+        # Must be set before the first logger is created
+        from app.config import settings
+        settings.LOG_DIR = str(workdir / "logs")
+        
+        results = log_call_benchmarks(workdir, args.repeat)
+        results.update(end_to_end_benchmarks(workdir, args.size, args.repeat))
+    
+    save_results(args.output, results)
+    print(format_table(results))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""
+Stage and end-to-end benchmarks for the GeoMask processing pipeline
+
+Runs offline on CPU: inputs are synthetic photos and the AI generator is
+replaced by FakeAIGenerator. Usage:
+
+    python -m benchmarks.bench_pipeline                      # compare with baseline
+    python -m benchmarks.bench_pipeline --update-baseline    # record a new baseline
+    python -m benchmarks.bench_pipeline --sizes small --repeat 3
+    python -m benchmarks.bench_pipeline --sizes small --no-stages --clips mp4 gif webp
+    python -m benchmarks.bench_pipeline --sizes phone --no-stages --tiers reduced minimal
+
+Exits with status 1 if any benchmark regressed beyond --tolerance.
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import tempfile
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import cv2
+
+from app.config import settings
+from app.services.image_decoder import decode_image
+from app.services.image_processor import ImageProcessor
+from app.services.quality import FULL, QualityTier, quality_tiers
+from benchmarks.fakes import FakeAIGenerator
+from benchmarks.harness import compare, format_table, load_results, measure, save_results
+from benchmarks.synthetic import RESOLUTIONS, write_clip, write_photo
+
+BENCHMARK_DIR = Path(__file__).parent
+DEFAULT_BASELINE = BENCHMARK_DIR / "baseline.json"
+DEFAULT_OUTPUT = BENCHMARK_DIR / "results" / "latest.json"
+CLIP_FRAMES = 60
+
+
+def stage_benchmarks(processor: ImageProcessor, photo: Path, workdir: Path) -> Dict[str, Callable[[], object]]:
+    """Build one zero-argument callable per pipeline stage for a photo"""
+    image = cv2.imread(str(photo))
+    height, width = image.shape[:2]
+    regions = processor._detect_windows(image)
+    background_path = asyncio.run(processor.ai_generator.generate_image(width=width, height=height))
+    background_raw = cv2.imread(background_path)
+    background = cv2.resize(background_raw, (width, height))
+    composite = processor._replace_backgrounds(image, background, regions)
+    encoded_path = str(workdir / "encode_bench.jpg")
+    # Relative sizes, so every resolution actually produces variants
+    variant_sizes = [max(width, height) // 2, max(width, height) // 4]
+    
+    return {
+        "decode": lambda: decode_image(photo.read_bytes()),
+        "detect": lambda: processor._detect_windows(image),
+        "resize": lambda: cv2.resize(background_raw, (width, height)),
+        "blend": lambda: processor._replace_backgrounds(image, background, regions),
+        "variants": lambda: processor._build_variant_chain(composite, variant_sizes),
+        "encode": lambda: processor._write_jpeg(composite, encoded_path, 95)
+    }
+
+
+def end_to_end_benchmark(processor: ImageProcessor, photo: Path, tier: QualityTier = FULL) -> Callable[[], object]:
+    """process_image on one photo at a quality tier, driven from a persistent event loop"""
+    loop = asyncio.new_event_loop()
+    return lambda: loop.run_until_complete(processor.process_image(str(photo), "city", tier=tier))
+
+
+def clip_benchmark(processor: ImageProcessor, clip: Path) -> Callable[[], object]:
+    """process_image on one animation or video, driven from a persistent event loop"""
+    loop = asyncio.new_event_loop()
+    return lambda: loop.run_until_complete(processor.process_image(str(clip), "city"))
+
+
+def run(sizes: List[str], repeat: int, stages: bool = True, clips: List[str] = (), tiers: List[str] = ()) -> dict:
+    """Run all benchmarks and return {benchmark: summary}"""
+    results = {}
+    
+    with tempfile.TemporaryDirectory(prefix="geomask-bench-") as tmp:
+        workdir = Path(tmp)
+        # Keep benchmark outputs out of the real processed directory
+        settings.PROCESSED_DIR = str(workdir)
+        # Every run processes the same photo; measure detection, not the cache
+        settings.DETECTION_CACHE_TTL_SECONDS = 0
+        
+        processor = ImageProcessor(ai_generator=FakeAIGenerator(workdir))
+        
+        for size in sizes:
+            width, height = RESOLUTIONS[size]
+            photo = write_photo(workdir, size, width, height)
+            
+            if stages:
+                for stage, fn in stage_benchmarks(processor, photo, workdir).items():
+                    results[f"{stage}[{size}]"] = measure(fn, repeat)
+                    print(f"  {stage}[{size}] done", file=sys.stderr)
+            
+            results[f"end_to_end[{size}]"] = measure(end_to_end_benchmark(processor, photo), repeat)
+            print(f"  end_to_end[{size}] done", file=sys.stderr)
+            
+            for tier in tiers:
+                results[f"end_to_end[{size},{tier}]"] = measure(
+                    end_to_end_benchmark(processor, photo, quality_tiers()[tier]), repeat
+                )
+                print(f"  end_to_end[{size},{tier}] done", file=sys.stderr)
+        
+        # Clips are 720p, the size the real-time target applies to
+        for fmt in clips:
+            clip = write_clip(workdir, "clip", 1280, 720, CLIP_FRAMES, suffix=f".{fmt}")
+            summary = measure(clip_benchmark(processor, clip), repeat)
+            results[f"clip[{fmt}_720p]"] = summary
+            fps = CLIP_FRAMES / (summary["p50_ms"] / 1000)
+            print(f"  clip[{fmt}_720p] done, {fps:.1f} frames/s", file=sys.stderr)
+    
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the GeoMask pipeline")
+    parser.add_argument("--sizes", nargs="+", default=["small", "medium", "large"], choices=sorted(RESOLUTIONS))
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark")
+    parser.add_argument("--no-stages", action="store_true", help="only run end-to-end benchmarks")
+    parser.add_argument("--clips", nargs="*", default=["mp4"], choices=["mp4", "gif", "webp"],
+                        help="720p clip formats to benchmark")
+    parser.add_argument("--tiers", nargs="*", default=[], choices=["reduced", "minimal"],
+                        help="also run end-to-end at these quality tiers")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args(argv)
+    
+    # Per-image INFO logs would dominate the small stages
+    logging.disable(logging.INFO)
+    
+    results = run(args.sizes, args.repeat, stages=not args.no_stages, clips=args.clips, tiers=args.tiers)
+    save_results(args.output, results)
+    print(format_table(results))
+    
+    if args.update_baseline:
+        save_results(args.baseline, results)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    
+    baseline = load_results(args.baseline)
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one")
+        return 0
+    
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\nRegressions beyond {args.tolerance:.0%}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    
+    print(f"\nNo regressions beyond {args.tolerance:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
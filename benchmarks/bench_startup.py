@@ -0,0 +1,191 @@
+"""
+Cold-start benchmarks for GeoMask
+
+Measures how long `import app.main` takes in a fresh interpreter (from
+`python -X importtime`), which packages that time goes to, and how long a
+uvicorn process takes to answer /health and /ready. Usage:
+
+    python -m benchmarks.bench_startup                      # compare with baseline
+    python -m benchmarks.bench_startup --update-baseline    # record a new baseline
+    python -m benchmarks.bench_startup --runs 10 --no-server
+
+Exits with status 1 if a benchmark regressed beyond --tolerance or if
+importing the app loads a module that should only be imported lazily.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import httpx
+
+from benchmarks.harness import compare, format_table, load_results, save_results, summarize
+from benchmarks.loadtest import free_port
+
+BENCHMARK_DIR = Path(__file__).parent
+DEFAULT_BASELINE = BENCHMARK_DIR / "baseline_startup.json"
+DEFAULT_OUTPUT = BENCHMARK_DIR / "results" / "startup.json"
+REPO_ROOT = BENCHMARK_DIR.parent
+
+# Provider SDKs and heavy libraries that must not load when the app is imported
+LAZY_MODULES = ("openai", "cv2", "magic", "torch", "diffusers", "transformers")
+
+
+def import_report(module: str) -> Tuple[float, Dict[str, float]]:
+    """
+    Import a module in a fresh interpreter with -X importtime
+    
+    Args:
+        module: Module to import
+    
+    Returns:
+        (cumulative import seconds of the module, self seconds per imported module)
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    
+    self_times = {}
+    cumulative = 0.0
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        self_times[name] = int(self_us) / 1e6
+        if name == module:
+            cumulative = int(cumulative_us) / 1e6
+    return cumulative, self_times
+
+
+def by_package(self_times: Dict[str, float]) -> Counter:
+    """Sum self import time per top-level package"""
+    totals = Counter()
+    for name, seconds in self_times.items():
+        totals[name.split(".")[0]] += seconds
+    return totals
+
+
+def time_to_ready(timeout: float = 60.0) -> Tuple[float, float]:
+    """Start uvicorn and time the first successful /health and /ready responses"""
+    port = free_port()
+    env = dict(os.environ, LOG_LEVEL="WARNING", LOG_TO_FILE="false")
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=REPO_ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL
+    )
+    
+    health = ready = None
+    try:
+        while ready is None and time.perf_counter() - start < timeout:
+            for path in ("/health", "/ready"):
+                try:
+                    response = httpx.get(f"http://127.0.0.1:{port}{path}", timeout=1.0)
+                except httpx.HTTPError:
+                    break
+                if response.status_code == 200:
+                    elapsed = time.perf_counter() - start
+                    if path == "/health" and health is None:
+                        health = elapsed
+                    elif path == "/ready":
+                        ready = elapsed
+            time.sleep(0.02)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    
+    if health is None or ready is None:
+        raise RuntimeError(f"App did not become ready within {timeout}s")
+    return health, ready
+
+
+def run(module: str, runs: int, server: bool) -> Tuple[dict, Counter, List[str]]:
+    """Run the startup benchmarks, returning results, package breakdown and eager heavy imports"""
+    import_samples = []
+    packages = Counter()
+    eager = set()
+    for _ in range(runs):
+        cumulative, self_times = import_report(module)
+        import_samples.append(cumulative)
+        packages.update(by_package(self_times))
+        eager.update(name for name in self_times if name.split(".")[0] in LAZY_MODULES)
+    
+    results = {f"import[{module}]": summarize(import_samples, 0)}
+    for name in packages:
+        packages[name] /= runs
+    
+    if server:
+        health_samples, ready_samples = [], []
+        for _ in range(runs):
+            health, ready = time_to_ready()
+            health_samples.append(health)
+            ready_samples.append(ready)
+        results["time_to_health"] = summarize(health_samples, 0)
+        results["time_to_ready"] = summarize(ready_samples, 0)
+    
+    return results, packages, sorted({name.split(".")[0] for name in eager})
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark GeoMask cold start")
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per benchmark")
+    parser.add_argument("--top", type=int, default=10, help="packages to list in the import breakdown")
+    parser.add_argument("--no-server", action="store_true", help="skip the uvicorn time-to-ready runs")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args(argv)
+    
+    results, packages, eager = run(args.module, args.runs, server=not args.no_server)
+    save_results(args.output, results)
+    print(format_table(results))
+    
+    print(f"\nImport time by package (self, mean of {args.runs} runs):")
+    for name, seconds in packages.most_common(args.top):
+        print(f"  {name:<24} {seconds * 1000:>9.1f} ms")
+    
+    if eager:
+        print(f"\nImporting {args.module} loaded lazy-only modules: {', '.join(eager)}")
+        return 1
+    
+    if args.update_baseline:
+        save_results(args.baseline, results)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    
+    baseline = load_results(args.baseline)
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one")
+        return 0
+    
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\nRegressions beyond {args.tolerance:.0%}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    
+    print(f"\nNo regressions beyond {args.tolerance:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+Thread budget benchmark for GeoMask
+
+Runs process_image in a loop in several worker processes at once, each
+limited to a number of OpenCV/BLAS threads, and reports the images per
+second all of them complete together. Splits are written WORKERSxTHREADS;
+the default compares the budgeted splits of the available cores with
+oversubscribed ones, where every worker uses every core as it would
+without a budget. Usage:
+
+    python -m benchmarks.bench_threads
+    python -m benchmarks.bench_threads --splits 1x4 2x2 4x1 4x4 --size large --duration 20
+
+NumPy and OpenCV are only imported in the worker processes, after their
+thread counts are set, so this module stays light to import.
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from app.utils.threads import THREAD_ENV_VARS, available_cpus
+from benchmarks.harness import save_results
+
+DEFAULT_OUTPUT = Path(__file__).parent / "results" / "threads.json"
+
+# Time for every worker to import and warm up before the timed window opens
+STARTUP_SECONDS = 15
+
+
+def parse_split(split: str) -> Tuple[int, int]:
+    """"2x4" -> (2 workers, 4 threads each)"""
+    workers, threads = split.lower().split("x")
+    return int(workers), int(threads)
+
+
+def default_splits(cpus: int) -> List[str]:
+    """Budgeted splits of the cores, then oversubscribed ones"""
+    budgeted = [f"1x{cpus}", f"{cpus}x1"]
+    if cpus >= 4:
+        budgeted.append(f"{cpus // 2}x2")
+    oversubscribed = [f"{cpus}x{cpus}", f"{2 * cpus}x{cpus}", f"{2 * cpus}x4"]
+    return list(dict.fromkeys(budgeted + oversubscribed))
+
+
+def worker(size: str, threads: int, start_at: float, duration: float, results):
+    """Process the same photo until the timed window closes and report the count"""
+    import asyncio
+    import logging
+    
+    import cv2
+    
+    from app.config import settings
+    from app.services.image_processor import ImageProcessor
+    from benchmarks.fakes import FakeAIGenerator
+    from benchmarks.synthetic import RESOLUTIONS, write_photo
+    
+    logging.disable(logging.INFO)
+    cv2.setNumThreads(threads)
+    
+    with tempfile.TemporaryDirectory(prefix="geomask-bench-threads-") as tmp:
+        workdir = Path(tmp)
+        settings.PROCESSED_DIR = str(workdir)
+        settings.DETECTION_CACHE_TTL_SECONDS = 0
+        processor = ImageProcessor(ai_generator=FakeAIGenerator(workdir))
+        photo = str(write_photo(workdir, size, *RESOLUTIONS[size]))
+        loop = asyncio.new_event_loop()
+        
+        loop.run_until_complete(processor.process_image(photo, "city"))
+        time.sleep(max(0.0, start_at - time.time()))
+        
+        count = 0
+        while time.time() < start_at + duration:
+            loop.run_until_complete(processor.process_image(photo, "city"))
+            count += 1
+        results.put(count)
+
+
+def run_split(workers: int, threads: int, size: str, duration: float) -> Dict:
+    """Images per second of workers processes with threads threads each"""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    
+    # Spawned processes read these when they first load OpenMP and BLAS
+    saved = {name: os.environ.get(name) for name in THREAD_ENV_VARS}
+    os.environ.update({name: str(threads) for name in THREAD_ENV_VARS})
+    try:
+        start_at = time.time() + STARTUP_SECONDS
+        processes = [
+            context.Process(target=worker, args=(size, threads, start_at, duration, results))
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+    
+    counts = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    
+    images = sum(counts)
+    return {
+        "workers": workers,
+        "threads": threads,
+        "images": images,
+        "images_per_s": round(images / duration, 3),
+        "mean_latency_ms": round(duration * workers / images * 1000, 1) if images else None
+    }
+
+
+def format_splits(rows: Dict[str, Dict], cpus: int) -> str:
+    lines = [f"{'split':>8} {'threads/core':>13} {'images/s':>9} {'latency ms':>11}"]
+    for split, row in rows.items():
+        load = row["workers"] * row["threads"] / cpus
+        lines.append(f"{split:>8} {load:>13.1f} {row['images_per_s']:>9} {row['mean_latency_ms'] or '-':>11}")
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    from benchmarks.synthetic import RESOLUTIONS
+    
+    cpus = available_cpus()
+    parser = argparse.ArgumentParser(description="Compare images per second under different worker/thread splits")
+    parser.add_argument("--splits", nargs="+", default=default_splits(cpus), help="WORKERSxTHREADS, e.g. 2x4")
+    parser.add_argument("--size", default="large", choices=sorted(RESOLUTIONS))
+    parser.add_argument("--duration", type=float, default=15, help="timed seconds per split")
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT)
+    args = parser.parse_args(argv)
+    
+    rows = {}
+    for split in args.splits:
+        workers, threads = parse_split(split)
+        rows[split] = run_split(workers, threads, args.size, args.duration)
+        print(f"  {split} done, {rows[split]['images_per_s']} images/s", file=sys.stderr)
+    
+    save_results(args.output, {"cpus": cpus, "size": args.size, "splits": rows})
+    print(f"{cpus} cores available")
+    print(format_splits(rows, cpus))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
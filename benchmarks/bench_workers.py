@@ -0,0 +1,79 @@
+"""
+Worker scaling benchmark for GeoMask
+
+Starts the app with an increasing number of workers against the fake
+OpenAI provider and runs the load test steps for each, reporting the
+highest throughput sustained without errors. Usage:
+
+    python -m benchmarks.bench_workers --workers 1 2 4 --rates 2 4 8 16
+    python -m benchmarks.bench_workers --server uvicorn --size large --duration 30
+
+Scaling is bounded by CPU cores: with more workers than cores the
+CPU-bound stages just take turns.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from benchmarks.harness import save_results
+from benchmarks.loadtest import add_load_arguments, encode_photo, local_deployment, run_steps
+
+DEFAULT_OUTPUT = Path(__file__).parent / "results" / "workers.json"
+
+
+def sustained_step(steps: List[Dict], max_error_rate: float) -> Optional[Dict]:
+    """The step with the highest achieved throughput within the error budget"""
+    healthy = [step for step in steps if step["error_rate"] <= max_error_rate]
+    return max(healthy, key=lambda step: step["achieved_rps"], default=None)
+
+
+def format_scaling(rows: List[Dict]) -> str:
+    lines = [f"{'workers':>8} {'sustained/s':>12} {'speedup':>8} {'p95 ms':>9}"]
+    base = rows[0]["sustained_rps"] if rows and rows[0]["sustained_rps"] else None
+    for row in rows:
+        speedup = f"{row['sustained_rps'] / base:.2f}x" if base else "-"
+        lines.append(f"{row['workers']:>8} {row['sustained_rps']:>12} {speedup:>8} {row.get('p95_ms', '-'):>9}")
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Measure throughput as app workers are added")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="worker counts to compare")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="error budget for a sustained step")
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT)
+    add_load_arguments(parser, rates=[1, 2, 4, 8, 16])
+    parser.set_defaults(server="gunicorn", size="medium", duration=10.0, provider_latency=0.2)
+    args = parser.parse_args(argv)
+    
+    photo = encode_photo(args.size)
+    worker_counts = args.workers
+    rows = []
+    
+    for workers in worker_counts:
+        print(f"{workers} worker(s):", file=sys.stderr)
+        args.workers = workers
+        with local_deployment(args) as url:
+            steps = asyncio.run(run_steps(url, photo, args))
+        
+        best = sustained_step(steps, args.max_error_rate)
+        row = {"workers": workers, "sustained_rps": best["achieved_rps"] if best else 0.0, "steps": steps}
+        if best and "p95_ms" in best:
+            row["p95_ms"] = best["p95_ms"]
+        rows.append(row)
+    
+    print(format_scaling(rows))
+    save_results(args.output, {
+        "server": args.server,
+        "size": args.size,
+        "cpu_count": os.cpu_count(),
+        "workers": rows
+    })
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
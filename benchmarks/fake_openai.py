@@ -0,0 +1,108 @@
+"""
+Local stand-in for the OpenAI image API
+
+Implements just enough of POST /v1/images/generations for AIGenerator:
+responses carry a URL back to this server, which serves a generated JPEG.
+Latency, error and rate-limit behaviour are configurable so load tests can
+reproduce a slow or flaky provider. Run it with:
+
+    python -m benchmarks.fake_openai --port 9100 --latency 2.0 --error-rate 0.05
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from functools import lru_cache
+
+import cv2
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+
+@lru_cache(maxsize=16)
+def render_image(width: int, height: int) -> bytes:
+    """Deterministic gradient JPEG, cached per size"""
+    ramp = np.linspace(40, 220, height, dtype=np.uint8)[:, None]
+    channel = np.broadcast_to(ramp, (height, width))
+    _, buffer = cv2.imencode(".jpg", cv2.merge([channel, channel, channel]), [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return buffer.tobytes()
+
+
+def create_app(
+    latency: float = 1.0,
+    jitter: float = 0.2,
+    error_rate: float = 0.0,
+    rate_limit_rate: float = 0.0,
+    image_size: int = 0
+) -> FastAPI:
+    """
+    Build the fake provider app
+    
+    Args:
+        latency: Mean generation latency in seconds
+        jitter: Relative latency jitter (0.2 = +/-20%)
+        error_rate: Fraction of requests failing with HTTP 500
+        rate_limit_rate: Fraction of requests rejected with HTTP 429
+        image_size: Served image size in pixels (0 = size from the request)
+    """
+    app = FastAPI(title="Fake OpenAI image API")
+    app.state.counts = {"requests": 0, "errors": 0, "rate_limited": 0}
+    
+    @app.post("/v1/images/generations")
+    async def generate(request: Request):
+        counts = app.state.counts
+        counts["requests"] += 1
+        body = await request.json()
+        
+        await asyncio.sleep(max(0.0, latency * random.uniform(1 - jitter, 1 + jitter)))
+        
+        roll = random.random()
+        if roll < rate_limit_rate:
+            counts["rate_limited"] += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit exceeded", "type": "rate_limit_exceeded"}},
+                status_code=429,
+                headers={"retry-after": "1"}
+            )
+        if roll < rate_limit_rate + error_rate:
+            counts["errors"] += 1
+            return JSONResponse({"error": {"message": "Internal error", "type": "server_error"}}, status_code=500)
+        
+        width, height = (int(v) for v in body.get("size", "1024x1024").split("x"))
+        if image_size:
+            width = height = image_size
+        
+        base = str(request.base_url).rstrip("/")
+        return {"created": int(time.time()), "data": [{"url": f"{base}/images/{width}x{height}.jpg"}]}
+    
+    @app.get("/images/{width}x{height}.jpg")
+    async def image(width: int, height: int):
+        return Response(render_image(min(width, 4096), min(height, 4096)), media_type="image/jpeg")
+    
+    @app.get("/stats")
+    async def stats():
+        return app.state.counts
+    
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake OpenAI image API for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=1.0, help="mean latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.2, help="relative latency jitter")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--image-size", type=int, default=0, help="served image size, 0 = requested size")
+    args = parser.parse_args(argv)
+    
+    app = create_app(args.latency, args.jitter, args.error_rate, args.rate_limit_rate, args.image_size)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Offline stand-ins for GeoMask services used by benchmarks
+"""
+
+import asyncio
+from pathlib import Path
+from typing import Dict, Tuple
+
+import cv2
+import numpy as np
+
+
+class FakeAIGenerator:
+    """
+    Drop-in replacement for AIGenerator that never touches the network
+    
+    Returns a pre-rendered background per size, optionally after a fixed
+    delay so end-to-end numbers can include a realistic provider wait.
+    """
+    
+    def __init__(self, directory: Path, latency: float = 0.0):
+        self.directory = Path(directory)
+        self.latency = latency
+        self.calls = 0
+        self._paths: Dict[Tuple[int, int], str] = {}
+    
+    async def initialize(self):
+        pass
+    
+    async def aclose(self):
+        pass
+    
+    async def generate_image(
+        self,
+        scene_type: str = "random",
+        custom_prompt: str = "",
+        width: int = 1024,
+        height: int = 1024,
+        quality: str = "standard",
+        cached_only: bool = False
+    ) -> str:
+        self.calls += 1
+        # Cached backgrounds skip the provider wait
+        if self.latency and not cached_only:
+            await asyncio.sleep(self.latency)
+        
+        path = self._paths.get((width, height))
+        if path is None:
+            # Provider images are square and get resized to the photo
+            ramp = np.linspace(0, 255, 1024, dtype=np.uint8)[:, None]
+            image = cv2.merge([np.broadcast_to(ramp, (1024, 1024))] * 3)
+            path = str(self.directory / f"fake_background_{width}x{height}.jpg")
+            cv2.imwrite(path, image)
+            self._paths[(width, height)] = path
+        return path
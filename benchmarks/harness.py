@@ -0,0 +1,118 @@
+"""
+Timing, memory and baseline comparison helpers for GeoMask benchmarks
+"""
+
+import json
+import math
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """Nearest-rank percentile of a non-empty sample list"""
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(q * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(samples: List[float], peak_bytes: int) -> Dict[str, float]:
+    """Latency percentiles (ms), throughput (ops/s) and peak memory (MB)"""
+    total = sum(samples)
+    return {
+        "runs": len(samples),
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 3),
+        "mean_ms": round(total / len(samples) * 1000, 3),
+        "throughput_per_s": round(len(samples) / total, 3) if total else 0.0,
+        "peak_memory_mb": round(peak_bytes / (1024 * 1024), 3)
+    }
+
+
+def measure(fn: Callable[[], object], repeat: int, warmup: int = 1) -> Dict[str, float]:
+    """
+    Benchmark a callable
+    
+    Timing runs and the memory run are separate because tracemalloc slows
+    down Python code a lot. Peak memory counts Python and numpy
+    allocations; buffers allocated inside OpenCV are not visible to it.
+    
+    Args:
+        fn: Zero-argument callable to benchmark
+        repeat: Number of timed runs
+        warmup: Untimed runs first, to fill caches
+    
+    Returns:
+        Summary as produced by summarize()
+    """
+    for _ in range(warmup):
+        fn()
+    
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    
+    return summarize(samples, peak)
+
+
+def load_results(path: Path) -> Optional[dict]:
+    """Load a results or baseline file, None if it does not exist"""
+    path = Path(path)
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())
+
+
+def save_results(path: Path, results: dict):
+    """Write results as stable, diff-friendly JSON"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n")
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    Flag benchmarks that got slower or hungrier than the baseline
+    
+    Args:
+        results: Current results, {benchmark: summary}
+        baseline: Baseline results in the same shape
+        tolerance: Allowed relative increase, e.g. 0.25 for +25%
+    
+    Returns:
+        Human-readable regression descriptions, empty if none
+    """
+    regressions = []
+    for name, current in sorted(results.items()):
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        for metric in ("p50_ms", "p95_ms", "peak_memory_mb"):
+            before, after = reference.get(metric), current.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if change > tolerance:
+                regressions.append(f"{name}: {metric} {before} -> {after} (+{change:.0%})")
+    return regressions
+
+
+def format_table(results: dict) -> str:
+    """Render results as a fixed-width table"""
+    columns = ("p50_ms", "p95_ms", "p99_ms", "throughput_per_s", "peak_memory_mb")
+    width = max([len(name) for name in results] + [9])
+    lines = [f"{'benchmark':<{width}}  " + "  ".join(f"{c:>16}" for c in columns)]
+    for name, summary in sorted(results.items()):
+        lines.append(f"{name:<{width}}  " + "  ".join(f"{summary[c]:>16}" for c in columns))
+    return "\n".join(lines)
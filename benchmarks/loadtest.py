@@ -0,0 +1,254 @@
+"""
+HTTP load test for /api/process
+
+Starts the fake OpenAI provider and the GeoMask app (or targets a running
+deployment with --url), then drives uploads at fixed arrival rates. Load is
+open-loop: requests are sent on schedule whether or not earlier ones have
+finished, so queueing shows up as latency and errors instead of silently
+lowering the offered load. Usage:
+
+    python -m benchmarks.loadtest --rates 1 2 4 8 --duration 30
+    python -m benchmarks.loadtest --workers 4 --provider-latency 5 --provider-error-rate 0.05
+    python -m benchmarks.loadtest --url http://staging:8000 --rates 2 4
+    python -m benchmarks.loadtest --server gunicorn --workers 4
+
+Each step reports offered and achieved throughput, latency percentiles and
+a breakdown of failures by status code.
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+import cv2
+import httpx
+
+from benchmarks.harness import percentile, save_results
+from benchmarks.synthetic import RESOLUTIONS, make_photo
+
+DEFAULT_OUTPUT = Path(__file__).parent / "results" / "loadtest.json"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url: str, timeout: float = 30.0):
+    """Poll a URL until it answers with 200"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+@contextmanager
+def local_deployment(args) -> Iterator[str]:
+    """Run the fake provider and the app as subprocesses, yielding the app URL"""
+    provider_port, app_port = free_port(), free_port()
+    workdir = tempfile.mkdtemp(prefix="geomask-loadtest-")
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="loadtest",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{provider_port}/v1",
+        AI_PROVIDER="openai",
+        # Measure capacity, not the per-client limit
+        RATE_LIMIT_PER_MINUTE="0",
+        LOG_LEVEL="WARNING",
+        LOG_TO_FILE="false",
+        WEB_CONCURRENCY=str(args.workers),
+        BIND=f"127.0.0.1:{app_port}",
+        GUNICORN_CMD_ARGS="--log-level warning",
+        SHARED_CACHE_PATH=os.path.join(workdir, "cache.sqlite3"),
+        PROMETHEUS_MULTIPROC_DIR=os.path.join(workdir, "metrics"),
+        # Every upload is the same photo; only reuse detections when sharing is the point
+        DETECTION_CACHE_TTL_SECONDS="86400" if args.coalesce else "0"
+    )
+    
+    # uvicorn.run() would fork the fake provider too if it saw WEB_CONCURRENCY
+    provider_env = {key: value for key, value in os.environ.items() if key != "WEB_CONCURRENCY"}
+    
+    if args.server == "gunicorn":
+        app_command = [sys.executable, "-m", "gunicorn", "app.main:app", "-c", "gunicorn.conf.py"]
+    else:
+        app_command = [
+            sys.executable, "-m", "uvicorn", "app.main:app",
+            "--host", "127.0.0.1", "--port", str(app_port),
+            "--workers", str(args.workers), "--log-level", "warning"
+        ]
+    
+    processes = [
+        subprocess.Popen([
+            sys.executable, "-m", "benchmarks.fake_openai",
+            "--port", str(provider_port),
+            "--latency", str(args.provider_latency),
+            "--error-rate", str(args.provider_error_rate),
+            "--rate-limit-rate", str(args.provider_rate_limit_rate),
+            "--image-size", str(args.provider_image_size)
+        ], env=provider_env),
+        subprocess.Popen(app_command, env=env)
+    ]
+    
+    try:
+        wait_until_up(f"http://127.0.0.1:{provider_port}/stats")
+        wait_until_up(f"http://127.0.0.1:{app_port}/ready", timeout=60.0)
+        yield f"http://127.0.0.1:{app_port}"
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+async def send_one(client: httpx.AsyncClient, url: str, photo: bytes, timeout: float, prompt: str) -> Dict:
+    start = time.perf_counter()
+    try:
+        response = await client.post(
+            f"{url}/api/process",
+            files={"file": ("loadtest.jpg", photo, "image/jpeg")},
+            data={"scene_type": "custom" if prompt else "city", "custom_prompt": prompt},
+            timeout=timeout
+        )
+        status = str(response.status_code)
+    except httpx.TimeoutException:
+        status = "timeout"
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    return {"status": status, "latency": time.perf_counter() - start}
+
+
+async def run_step(url: str, photo: bytes, rate: float, duration: float, timeout: float, coalesce: bool) -> Dict:
+    """
+    Offer `rate` requests per second for `duration` seconds
+    
+    Unless coalesce is set, every request carries its own prompt so the
+    provider gateway cannot merge them and each costs a provider call.
+    """
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=100)
+    async with httpx.AsyncClient(limits=limits) as client:
+        tasks: List[asyncio.Task] = []
+        start = time.perf_counter()
+        total = int(rate * duration)
+        
+        for i in range(total):
+            # Fixed schedule: sleep until the i-th arrival time
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            prompt = "" if coalesce else f"loadtest scene {i} at {rate}/s"
+            tasks.append(asyncio.create_task(send_one(client, url, photo, timeout, prompt)))
+        
+        results = await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+    
+    statuses = Counter(result["status"] for result in results)
+    ok = [result["latency"] for result in results if result["status"] == "200"]
+    summary = {
+        "offered_rps": rate,
+        "requests": len(results),
+        "achieved_rps": round(len(ok) / elapsed, 3),
+        "error_rate": round(1 - len(ok) / len(results), 4) if results else 0.0,
+        "statuses": dict(statuses)
+    }
+    if ok:
+        summary.update({
+            "p50_ms": round(percentile(ok, 0.50) * 1000, 1),
+            "p95_ms": round(percentile(ok, 0.95) * 1000, 1),
+            "p99_ms": round(percentile(ok, 0.99) * 1000, 1)
+        })
+    return summary
+
+
+def format_steps(steps: List[Dict]) -> str:
+    header = f"{'offered/s':>10} {'achieved/s':>11} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>8}  statuses"
+    lines = [header]
+    for step in steps:
+        lines.append(
+            f"{step['offered_rps']:>10} {step['achieved_rps']:>11} "
+            f"{step.get('p50_ms', '-'):>9} {step.get('p95_ms', '-'):>9} {step.get('p99_ms', '-'):>9} "
+            f"{step['error_rate']:>8.1%}  {step['statuses']}"
+        )
+    return "\n".join(lines)
+
+
+async def run_steps(url: str, photo: bytes, args) -> List[Dict]:
+    steps = []
+    for rate in args.rates:
+        step = await run_step(url, photo, rate, args.duration, args.timeout, args.coalesce)
+        steps.append(step)
+        print(format_steps([step]).splitlines()[-1], file=sys.stderr)
+        if args.stop_error_rate and step["error_rate"] > args.stop_error_rate:
+            print(f"Error rate above {args.stop_error_rate:.0%}, stopping", file=sys.stderr)
+            break
+    return steps
+
+
+def add_load_arguments(parser: argparse.ArgumentParser, rates: List[float]):
+    """Arguments shared by the load test and the worker scaling benchmark"""
+    parser.add_argument("--server", default="uvicorn", choices=["uvicorn", "gunicorn"], help="local app server")
+    parser.add_argument("--rates", type=float, nargs="+", default=rates, help="requests per second per step")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per step")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-request timeout")
+    parser.add_argument("--size", default="small", choices=sorted(RESOLUTIONS), help="uploaded photo size")
+    parser.add_argument("--coalesce", action="store_true", help="send identical scenes so provider calls and cached detections are shared")
+    parser.add_argument("--stop-error-rate", type=float, default=0.5, help="stop once a step fails this often")
+    parser.add_argument("--provider-latency", type=float, default=1.0)
+    parser.add_argument("--provider-error-rate", type=float, default=0.0)
+    parser.add_argument("--provider-rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--provider-image-size", type=int, default=0)
+
+
+def encode_photo(size: str) -> bytes:
+    _, buffer = cv2.imencode(".jpg", make_photo(*RESOLUTIONS[size]), [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return buffer.tobytes()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Load test /api/process at fixed arrival rates")
+    parser.add_argument("--url", help="target a running deployment instead of starting one")
+    parser.add_argument("--workers", type=int, default=1, help="app workers for the local deployment")
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT)
+    add_load_arguments(parser, rates=[0.5, 1, 2, 4])
+    args = parser.parse_args(argv)
+    
+    photo = encode_photo(args.size)
+    
+    if args.url:
+        steps = asyncio.run(run_steps(args.url.rstrip("/"), photo, args))
+    else:
+        with local_deployment(args) as url:
+            steps = asyncio.run(run_steps(url, photo, args))
+    
+    print(format_steps(steps))
+    save_results(args.output, {
+        "workers": None if args.url else args.workers,
+        "server": None if args.url else args.server,
+        "size": args.size,
+        "duration": args.duration,
+        "steps": steps
+    })
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
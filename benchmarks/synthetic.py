@@ -0,0 +1,99 @@
+"""
+Synthetic inputs for GeoMask benchmarks
+"""
+
+from pathlib import Path
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+# Named resolutions (width, height) covering thumbnails to phone photos
+RESOLUTIONS = {
+    "small": (640, 480),
+    "medium": (1280, 960),
+    "large": (1920, 1440),
+    "phone": (4032, 3024)
+}
+
+
+def make_photo(width: int, height: int, windows: int = 3, seed: int = 0) -> np.ndarray:
+    """
+    Create a deterministic indoor-looking photo with window-like rectangles
+    
+    A textured wall is overlaid with framed rectangles filled with a sky
+    gradient, which the edge-based window detector picks up like real
+    windows.
+    
+    Args:
+        width: Image width
+        height: Image height
+        windows: Number of windows to draw
+        seed: Random seed, so runs are reproducible
+    
+    Returns:
+        BGR image
+    """
+    rng = np.random.default_rng(seed)
+    wall = rng.normal(120, 12, (height, width, 1)).clip(0, 235).astype(np.uint8)
+    image = np.concatenate([wall, wall + 10, wall + 20], axis=2)
+    
+    for x, y, w, h in window_layout(width, height, windows):
+        ramp = np.linspace(0, 1, h, dtype=np.float32)[:, None, None]
+        sky = (np.array([235, 190, 140]) * (1 - ramp) + np.array([250, 230, 210]) * ramp).astype(np.uint8)
+        image[y:y + h, x:x + w] = np.broadcast_to(sky, (h, w, 3))
+        cv2.rectangle(image, (x, y), (x + w, y + h), (40, 40, 40), max(2, width // 300))
+    
+    return image
+
+
+def window_layout(width: int, height: int, windows: int) -> List[Tuple[int, int, int, int]]:
+    """Evenly spaced, non-overlapping window rectangles (x, y, w, h)"""
+    slot = width // max(1, windows)
+    w = int(slot * 0.6)
+    h = int(min(height * 0.45, w * 1.3))
+    y = height // 6
+    return [(i * slot + (slot - w) // 2, y, w, h) for i in range(windows)]
+
+
+def write_photo(directory: Path, name: str, width: int, height: int, seed: int = 0) -> Path:
+    """Encode a synthetic photo as JPEG and return its path"""
+    path = Path(directory) / f"{name}_{width}x{height}.jpg"
+    cv2.imwrite(str(path), make_photo(width, height, seed=seed), [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return path
+
+
+def make_clip(width: int, height: int, frames: int, pan: int = 4, seed: int = 0) -> List[np.ndarray]:
+    """
+    Frames of a camera slowly panning across a synthetic photo
+    
+    Args:
+        width: Frame width
+        height: Frame height
+        frames: Number of frames
+        pan: Horizontal pan per frame in pixels
+        seed: Random seed, so runs are reproducible
+    
+    Returns:
+        BGR frames
+    """
+    scene = make_photo(width + pan * frames, height, windows=4, seed=seed)
+    return [scene[:, i * pan:i * pan + width].copy() for i in range(frames)]
+
+
+def write_clip(directory: Path, name: str, width: int, height: int, frames: int, suffix: str = ".mp4") -> Path:
+    """Encode a synthetic panning clip as MP4, GIF or WebP and return its path"""
+    from PIL import Image
+    
+    path = Path(directory) / f"{name}_{width}x{height}{suffix}"
+    clip = make_clip(width, height, frames)
+    
+    if suffix == ".mp4":
+        writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), 25, (width, height))
+        for frame in clip:
+            writer.write(frame)
+        writer.release()
+    else:
+        images = [Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)) for frame in clip]
+        images[0].save(path, save_all=True, append_images=images[1:], duration=40, loop=0)
+    return path
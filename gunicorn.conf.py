@@ -0,0 +1,55 @@
+"""
+Gunicorn configuration for GeoMask
+
+Runs several uvicorn workers behind one port:
+
+    gunicorn app.main:app -c gunicorn.conf.py
+
+Workers share caches and job status through the shared cache (SQLite on
+one host, Redis via REDIS_URL across hosts) and report Prometheus metrics
+through PROMETHEUS_MULTIPROC_DIR.
+"""
+
+import os
+import shutil
+import tempfile
+
+from app.utils.threads import available_cpus, plan_threads
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+# One worker per core the container may use, not per core of the host
+workers = int(os.environ.get("WEB_CONCURRENCY", available_cpus()))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Requests wait on image providers for up to PROVIDER_TIMEOUT_SECONDS
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+max_requests = 1000
+max_requests_jitter = 100
+
+# Each worker imports the app after forking and builds its own pools,
+# connections and warm-up; nothing heavy is shared through fork
+preload_app = False
+
+# Read by the app: per-worker rate limit fallback, metrics aggregation
+os.environ["WEB_CONCURRENCY"] = str(workers)
+# Workers inherit OpenMP/BLAS thread counts for their share of the cores
+plan_threads(workers=workers).apply_env()
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "geomask-metrics"))
+# Several processes rotating the same log files would clobber each other
+os.environ.setdefault("LOG_TO_FILE", "false")
+
+
+def on_starting(server):
+    """Start every deployment with empty metric files"""
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """Drop live gauges of workers that exited"""
+    from prometheus_client import multiprocess
+    
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,161 @@
+"""
+Tests for rate limiting and admission control
+"""
+
+import asyncio
+
+import pytest
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.services import admission
+from app.services.admission import (
+    AdmissionController,
+    AdmissionMiddleware,
+    MemoryRateLimiter,
+    Overloaded,
+    TokenBucket,
+)
+
+
+async def wait_until(condition, timeout=1.0):
+    """Yield to the event loop until condition() holds"""
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0)
+
+
+def test_token_bucket_refills_over_time():
+    """Test the bucket allows a burst then refills at the configured rate"""
+    bucket = TokenBucket(capacity=2, rate=1.0)
+    now = bucket.updated
+    
+    assert bucket.take(now).allowed
+    assert bucket.take(now).allowed
+    
+    result = bucket.take(now)
+    assert not result.allowed
+    assert result.retry_after == pytest.approx(1.0)
+    
+    assert bucket.take(now + 1.0).allowed
+
+
+def test_admission_rejects_when_queue_full():
+    """Test requests beyond concurrency plus queue are rejected immediately"""
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=5)
+        release = asyncio.Event()
+        
+        async def hold():
+            async with controller.slot():
+                await release.wait()
+        
+        running = asyncio.create_task(hold())
+        queued = asyncio.create_task(hold())
+        try:
+            await wait_until(lambda: controller.in_flight == 1 and controller.waiting == 1)
+        except TimeoutError:
+            release.set()
+            raise
+        
+        try:
+            with pytest.raises(Overloaded) as exc_info:
+                async with controller.slot():
+                    pass
+            assert exc_info.value.retry_after > 0
+        finally:
+            release.set()
+        
+        await asyncio.gather(running, queued)
+        assert controller.in_flight == 0
+        assert controller.rejected_total == 1
+    
+    asyncio.run(scenario())
+
+
+def test_admission_times_out_waiting():
+    """Test queued requests give up after the queue timeout"""
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_queue=5, queue_timeout=0.01)
+        async with controller.slot():
+            with pytest.raises(Overloaded):
+                async with controller.slot():
+                    pass
+        assert controller.waiting == 0
+    
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_does_not_keep_slot():
+    """Test a queued request cancelled mid-wait never ends up holding a slot"""
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_queue=5, queue_timeout=5)
+        release = asyncio.Event()
+        
+        async def hold():
+            async with controller.slot():
+                await release.wait()
+        
+        running = asyncio.create_task(hold())
+        await wait_until(lambda: controller.in_flight == 1)
+        queued = asyncio.create_task(hold())
+        await wait_until(lambda: controller.waiting == 1)
+        
+        # Free the slot and cancel the waiter in the same iteration
+        release.set()
+        queued.cancel()
+        await asyncio.gather(running, queued, return_exceptions=True)
+        
+        assert controller.in_flight == 0
+        assert not controller._semaphore.locked()
+    
+    asyncio.run(scenario())
+
+
+def test_rate_limited_request_gets_429_with_retry_after(monkeypatch):
+    """Test over-limit clients are rejected before the handler runs"""
+    monkeypatch.setattr(admission.settings, "RATE_LIMIT_PER_MINUTE", 60)
+    monkeypatch.setattr(admission, "rate_limiter", MemoryRateLimiter(per_minute=60, burst=1))
+    monkeypatch.setattr(admission, "admission_controller", AdmissionController(1, 1, 1))
+    
+    app = FastAPI()
+    app.add_middleware(AdmissionMiddleware, paths=["/upload"])
+    
+    @app.post("/upload")
+    async def upload():
+        return {"ok": True}
+    
+    client = TestClient(app)
+    
+    response = client.post("/upload")
+    assert response.status_code == 200
+    assert response.headers["x-ratelimit-limit"] == "60"
+    
+    response = client.post("/upload")
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) >= 1
+
+
+def test_sub_routes_of_admission_paths_are_admitted(monkeypatch):
+    """Test session sub-routes are rate limited like the path they sit under"""
+    monkeypatch.setattr(admission.settings, "RATE_LIMIT_PER_MINUTE", 60)
+    monkeypatch.setattr(admission, "rate_limiter", MemoryRateLimiter(per_minute=60, burst=1))
+    monkeypatch.setattr(admission, "admission_controller", AdmissionController(1, 1, 1))
+    
+    app = FastAPI()
+    app.add_middleware(AdmissionMiddleware, paths=["/api/sessions"])
+    
+    @app.post("/api/sessions/{session_id}/recomposite")
+    async def recomposite(session_id: str):
+        return {"ok": True}
+    
+    @app.post("/api/sessionsx")
+    async def unrelated():
+        return {"ok": True}
+    
+    client = TestClient(app)
+    
+    assert client.post("/api/sessions/abc/recomposite").status_code == 200
+    assert client.post("/api/sessions/abc/recomposite").status_code == 429
+    assert client.post("/api/sessionsx").status_code == 200
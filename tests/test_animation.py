@@ -0,0 +1,164 @@
+"""
+Tests for animated image and video processing
+"""
+
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.config import settings
+from app.services.animation import RegionTracker, is_clip, run_frame_pipeline
+from app.services.image_processor import ImageProcessor
+from benchmarks.fakes import FakeAIGenerator
+from app.utils.deadlines import Deadline, DeadlineExceeded, deadline_scope
+from benchmarks.synthetic import make_clip, write_clip
+
+
+def test_tracker_follows_pan_between_keyframes():
+    """Test regions are detected once and then shifted with the camera"""
+    detections = []
+    
+    def detect(frame):
+        detections.append(frame)
+        return [(100, 50, 80, 60)]
+    
+    tracker = RegionTracker(detect, keyframe_interval=100)
+    regions = [tracker.update(frame) for frame in make_clip(1280, 720, frames=10, pan=4)]
+    
+    assert len(detections) == 1
+    # Content moves left as the camera pans right
+    x, y, w, h = regions[-1][0]
+    assert abs(x - (100 - 9 * 4)) <= 2
+    assert (y, w, h) == (50, 80, 60)
+
+
+def test_tracker_redetects_on_interval_and_cuts():
+    """Test keyframes are forced every interval and after a scene cut"""
+    tracker = RegionTracker(lambda frame: [], keyframe_interval=4)
+    cut = np.random.default_rng(0).integers(0, 255, (240, 320, 3), dtype=np.uint8)
+    frames = make_clip(320, 240, frames=6) + [cut, cut]
+    
+    for frame in frames:
+        regions = tracker.update(frame)
+    
+    assert tracker.keyframes == 3
+    assert regions == [(0, 0, 320, 240)]
+
+
+def test_pipeline_preserves_order_and_propagates_errors():
+    """Test frames come out in order and a failing stage stops the pipeline"""
+    written = []
+    count = run_frame_pipeline(range(50), lambda frame: frame * 2, written.append, queue_size=2)
+    
+    assert count == 50
+    assert written == [frame * 2 for frame in range(50)]
+    
+    def failing_write(frame):
+        if frame == 3:
+            raise IOError("disk full")
+    
+    with pytest.raises(IOError):
+        run_frame_pipeline(range(1000), lambda frame: frame, failing_write, queue_size=2)
+
+
+def test_pipeline_stops_on_deadline_and_cancel():
+    """Test the frame loop stops once the deadline passes or the cancel event is set"""
+    def slow(frame):
+        time.sleep(0.01)
+        return frame
+    
+    written = []
+    with deadline_scope(Deadline.after(0.1)):
+        with pytest.raises(DeadlineExceeded):
+            run_frame_pipeline(range(1000), slow, written.append, queue_size=2)
+    assert len(written) < 100
+    
+    cancel = threading.Event()
+    
+    def cancel_at_five(frame):
+        if frame == 5:
+            cancel.set()
+        return frame
+    
+    assert run_frame_pipeline(range(1000), cancel_at_five, lambda frame: None, 2, cancel) == 6
+
+
+def test_cancelled_clip_stops_rendering_and_removes_output(tmp_path, monkeypatch):
+    """Test cancelling a clip stops its render thread and deletes the partial output"""
+    monkeypatch.setattr(settings, "PROCESSED_DIR", str(tmp_path / "processed"))
+    monkeypatch.setattr(settings, "DETECTION_CACHE_TTL_SECONDS", 0)
+    (tmp_path / "processed").mkdir()
+    clip = write_clip(tmp_path, "clip", 320, 240, frames=60, suffix=".mp4")
+    processor = ImageProcessor(ai_generator=FakeAIGenerator(tmp_path))
+    
+    blend_frame = processor._blend_frame
+    blended = []
+    
+    def slow_blend(*args):
+        blended.append(1)
+        time.sleep(0.02)
+        return blend_frame(*args)
+    
+    processor._blend_frame = slow_blend
+    
+    async def scenario():
+        task = asyncio.create_task(processor.process_image(str(clip), "city"))
+        while not blended:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    
+    asyncio.run(scenario())
+    
+    frames = len(blended)
+    time.sleep(0.1)
+    assert len(blended) == frames < 60
+    assert list((tmp_path / "processed").iterdir()) == []
+    assert not [thread for thread in threading.enumerate() if thread.name.startswith("geomask-")]
+
+
+@pytest.mark.parametrize("suffix", [".gif", ".mp4"])
+def test_process_clip_keeps_every_frame(tmp_path, monkeypatch, suffix):
+    """Test an animation is masked frame by frame and written in its own format"""
+    monkeypatch.setattr(settings, "PROCESSED_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "DETECTION_CACHE_TTL_SECONDS", 0)
+    clip = write_clip(tmp_path, "clip", 320, 240, frames=8, suffix=suffix)
+    still = tmp_path / "still.gif"
+    Image.new("RGB", (32, 32)).save(still)
+    
+    assert is_clip(str(clip))
+    assert not is_clip(str(still))
+    
+    processor = ImageProcessor(ai_generator=FakeAIGenerator(tmp_path))
+    result = asyncio.run(processor.process_image(str(clip), "city"))
+    
+    assert result.output_path.endswith(suffix)
+    if suffix == ".gif":
+        with Image.open(result.output_path) as output:
+            assert output.n_frames == 8
+            assert output.size == (320, 240)
+    else:
+        import cv2
+        capture = cv2.VideoCapture(result.output_path)
+        assert int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) == 8
+        capture.release()
+
+
+def test_blend_frame_clips_regions_leaving_the_frame():
+    """Test a region tracked partly off-frame blends only its visible part"""
+    processor = ImageProcessor()
+    frame = np.zeros((100, 100, 3), np.uint8)
+    background = np.full((100, 100, 3), 255, np.uint8)
+    masks = {}
+    
+    result = processor._blend_frame(frame, background, [(-20, 60, 50, 60), (150, 0, 10, 10)], masks)
+    
+    assert result[:60].max() == 0
+    assert result[60:, 30:].max() == 0
+    assert result[80, 10].min() > 0
+    assert list(masks) == [(50, 60)]
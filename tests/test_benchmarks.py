@@ -0,0 +1,62 @@
+"""
+Tests for the benchmark harness
+"""
+
+from benchmarks.harness import compare, measure, percentile
+from benchmarks.synthetic import make_photo, window_layout
+
+
+def test_percentiles_and_measure():
+    """Test nearest-rank percentiles and the measure summary"""
+    samples = [i / 100 for i in range(1, 101)]
+    assert percentile(samples, 0.5) == 0.5
+    assert percentile(samples, 0.99) == 0.99
+    
+    summary = measure(lambda: bytearray(1024 * 1024), repeat=3, warmup=0)
+    assert summary["runs"] == 3
+    assert summary["peak_memory_mb"] >= 1.0
+
+
+def test_compare_flags_regressions():
+    """Test only metrics above the tolerance are reported"""
+    baseline = {"blend[small]": {"p50_ms": 100.0, "p95_ms": 120.0, "peak_memory_mb": 2.0}}
+    results = {
+        "blend[small]": {"p50_ms": 110.0, "p95_ms": 200.0, "peak_memory_mb": 2.0},
+        "detect[small]": {"p50_ms": 5.0, "p95_ms": 6.0, "peak_memory_mb": 1.0}
+    }
+    
+    regressions = compare(results, baseline, tolerance=0.25)
+    
+    assert len(regressions) == 1
+    assert regressions[0].startswith("blend[small]: p95_ms")
+
+
+def test_synthetic_windows_are_detected():
+    """Test the window detector finds the synthetic windows"""
+    from app.services.image_processor import ImageProcessor
+    
+    regions = ImageProcessor()._detect_windows(make_photo(640, 480, windows=3))
+    
+    assert len(regions) == 3
+    for x, y, w, h in window_layout(640, 480, 3):
+        cx, cy = x + w // 2, y + h // 2
+        assert any(rx <= cx <= rx + rw and ry <= cy <= ry + rh for rx, ry, rw, rh in regions)
+
+
+def test_fake_provider_mimics_openai_images():
+    """Test the load-test provider returns fetchable image URLs and injects errors"""
+    from fastapi.testclient import TestClient
+    from benchmarks.fake_openai import create_app
+    
+    client = TestClient(create_app(latency=0.0))
+    response = client.post("/v1/images/generations", json={"prompt": "city", "size": "320x240"})
+    assert response.status_code == 200
+    
+    url = response.json()["data"][0]["url"]
+    image = client.get(url.replace(str(client.base_url), ""))
+    assert image.headers["content-type"] == "image/jpeg"
+    
+    failing = TestClient(create_app(latency=0.0, rate_limit_rate=1.0))
+    rejected = failing.post("/v1/images/generations", json={"prompt": "city"})
+    assert rejected.status_code == 429
+    assert rejected.headers["retry-after"] == "1"
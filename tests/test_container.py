@@ -0,0 +1,54 @@
+"""
+Tests for the service container
+"""
+
+import asyncio
+import threading
+
+from app.services.container import ServiceContainer
+
+
+async def wait_until_ready(container: ServiceContainer, timeout: float = 30.0):
+    async def poll():
+        while not container.ready:
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(poll(), timeout)
+
+
+def test_processor_shares_the_warmed_up_generator():
+    """Test warm-up initializes the one generator the processor uses"""
+    async def scenario():
+        container = ServiceContainer()
+        await container.start()
+        try:
+            await wait_until_ready(container)
+            
+            assert container.image_processor.ai_generator is container.ai_generator
+            assert container.ai_generator.initialized
+            assert container.ai_generator.http_client is container.http_client
+            
+            thread_name = await asyncio.to_thread(lambda: threading.current_thread().name)
+            assert thread_name.startswith("geomask-worker")
+        finally:
+            await container.aclose()
+    
+    asyncio.run(scenario())
+
+
+def test_aclose_releases_pools():
+    """Test shutdown closes the HTTP client and executor and resets the generator"""
+    async def scenario():
+        container = ServiceContainer()
+        await container.start()
+        await wait_until_ready(container)
+        client, executor = container.http_client, container.executor
+        
+        await container.aclose()
+        
+        assert client.is_closed
+        assert executor._shutdown
+        assert container.http_client is None and container.executor is None
+        assert not container.ready
+        assert not container.ai_generator.initialized
+    
+    asyncio.run(scenario())
@@ -0,0 +1,86 @@
+"""
+Tests for the decoy image library
+"""
+
+import asyncio
+import os
+
+import cv2
+import numpy as np
+
+from app.config import settings
+from app.services.decoy_library import DecoyLibrary, describe_windows
+from app.services.image_processor import ImageProcessor
+from benchmarks.fakes import FakeAIGenerator
+from benchmarks.synthetic import make_photo, window_layout
+
+
+def write_decoy(path, brightness: int, size=(320, 240)):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    cv2.imwrite(str(path), np.full((size[1], size[0], 3), brightness, np.uint8))
+
+
+def test_select_matches_scene_and_lighting(tmp_path):
+    """Test the closest image of the requested scene is picked"""
+    library = tmp_path / "decoys"
+    write_decoy(library / "city" / "dusk.jpg", 40)
+    write_decoy(library / "city" / "noon.jpg", 230)
+    write_decoy(library / "beach" / "dusk.jpg", 45)
+    write_decoy(library / "loose.jpg", 120)
+    
+    decoys = DecoyLibrary(str(library), index_dir=str(tmp_path / "index"))
+    bright = describe_windows(np.full((480, 640, 3), 220, np.uint8))
+    dark = describe_windows(np.full((480, 640, 3), 50, np.uint8))
+    
+    async def scenario():
+        assert (await decoys.select("city", bright)).endswith("noon.jpg")
+        assert (await decoys.select("city", dark)).endswith(os.path.join("city", "dusk.jpg"))
+        assert (await decoys.select("random", dark)).endswith("dusk.jpg")
+        assert await decoys.select("forest", dark) is None
+    
+    asyncio.run(scenario())
+    assert decoys.stats()["scenes"] == ["beach", "city", "random"]
+
+
+def test_index_persists_and_refreshes_incrementally(tmp_path):
+    """Test a restarted worker reuses persisted descriptors and only describes new files"""
+    library = tmp_path / "decoys"
+    for index in range(3):
+        write_decoy(library / "city" / f"{index}.jpg", 60 * index + 30)
+    
+    async def scenario():
+        first = DecoyLibrary(str(library), index_dir=str(tmp_path / "index"))
+        assert await first.refresh() == 3
+        
+        restarted = DecoyLibrary(str(library), index_dir=str(tmp_path / "index"))
+        assert await restarted.refresh() == 0
+        assert np.array_equal(restarted.features, first.features)
+        
+        write_decoy(library / "city" / "new.jpg", 200)
+        (library / "city" / "0.jpg").unlink()
+        assert await restarted.refresh() == 1
+        assert sorted(entry.path for entry in restarted.entries) == ["city/1.jpg", "city/2.jpg", "city/new.jpg"]
+        assert len(list((tmp_path / "index" / "thumbnails").iterdir())) == 3
+    
+    asyncio.run(scenario())
+
+
+def test_processor_uses_library_instead_of_provider(tmp_path, monkeypatch):
+    """Test a library match skips generation and a custom prompt still generates"""
+    monkeypatch.setattr(settings, "PROCESSED_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "DETECTION_CACHE_TTL_SECONDS", 0)
+    write_decoy(tmp_path / "decoys" / "city" / "sky.jpg", 200, size=(1280, 960))
+    photo = make_photo(640, 480)
+    
+    generator = FakeAIGenerator(tmp_path)
+    decoys = DecoyLibrary(str(tmp_path / "decoys"), index_dir=str(tmp_path / "index"))
+    processor = ImageProcessor(ai_generator=generator, decoys=decoys)
+    regions = window_layout(640, 480, 3)
+    
+    background = asyncio.run(processor._generate_background(photo, "city", "", regions))
+    assert generator.calls == 0
+    assert background.shape == photo.shape
+    assert abs(int(background.mean()) - 200) <= 2
+    
+    asyncio.run(processor._generate_background(photo, "city", "a harbour at night", regions))
+    assert generator.calls == 1
@@ -0,0 +1,143 @@
+"""
+Tests for the file reaper
+"""
+
+import asyncio
+import os
+import time
+
+from app.utils.file_reaper import FileReaper
+
+
+def test_reaper_deletes_expired_files_in_batches(tmp_path):
+    """Test expired files are deleted at most batch_size at a time"""
+    directory = str(tmp_path)
+    reaper = FileReaper(ttl_seconds={directory: 0}, quotas={}, batch_size=2, interval=1)
+    
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"file_{i}.jpg"
+        path.write_bytes(b"x")
+        reaper.track(str(path), size=1)
+        paths.append(path)
+    
+    batch = reaper.collect(now=time.time() + 1)
+    assert len(batch) == 2
+    assert reaper.expired_due == 1
+    
+    reaper.delete(batch)
+    batch = reaper.collect(now=time.time() + 1)
+    assert len(batch) == 1
+    assert reaper.expired_due == 0
+    
+    reaper.delete(batch)
+    assert not any(path.exists() for path in paths)
+
+
+def test_reaper_evicts_least_recently_used_over_quota(tmp_path):
+    """Test quota enforcement evicts the least recently used file"""
+    directory = str(tmp_path)
+    reaper = FileReaper(ttl_seconds={directory: 3600}, quotas={directory: 20}, batch_size=10, interval=1, min_age=0)
+    
+    for name in ["a.jpg", "b.jpg", "c.jpg"]:
+        path = tmp_path / name
+        path.write_bytes(b"x" * 10)
+        reaper.track(str(path), size=10)
+    
+    reaper.touch(str(tmp_path / "a.jpg"))
+    
+    assert reaper.collect() == [str(tmp_path / "b.jpg")]
+    assert reaper.stats()["directory_bytes"][directory] == 20
+
+
+def test_reaper_normalises_directory_keys(tmp_path):
+    """Test TTLs and quotas apply when configured with trailing slashes or ./"""
+    directory = tmp_path / "uploads"
+    directory.mkdir()
+    reaper = FileReaper(
+        ttl_seconds={f"{directory}/": 0},
+        quotas={f"{directory}/./": 5},
+        batch_size=10,
+        interval=1
+    )
+    
+    path = directory / "a.jpg"
+    path.write_bytes(b"x" * 10)
+    reaper.track(str(path), size=10, created=time.time() - 3600)
+    assert reaper._files[str(path)].expiry <= time.time()
+    
+    assert reaper.collect(now=time.time() - 60) == [str(path)]
+    assert reaper.bytes_over_quota == 0
+
+
+def test_reaper_keeps_young_files_over_quota(tmp_path):
+    """Test files younger than min_age are not evicted, and don't make the reaper spin"""
+    directory = str(tmp_path)
+    reaper = FileReaper(ttl_seconds={directory: 3600}, quotas={directory: 10}, batch_size=10, interval=1, min_age=60)
+    
+    for name in ["old.jpg", "new.jpg"]:
+        (tmp_path / name).write_bytes(b"x" * 10)
+    reaper.track(str(tmp_path / "old.jpg"), size=10, created=time.time() - 120)
+    reaper.track(str(tmp_path / "new.jpg"), size=10)
+    
+    assert reaper.collect() == [str(tmp_path / "old.jpg")]
+    
+    (tmp_path / "newer.jpg").write_bytes(b"x" * 10)
+    reaper.track(str(tmp_path / "newer.jpg"), size=10)
+    assert reaper.collect() == []
+    assert reaper.bytes_over_quota == 10
+    assert not reaper.has_backlog
+
+
+def test_reaper_rescan_indexes_other_workers_files(tmp_path):
+    """Test a rescan tracks files written by other processes and drops deleted ones"""
+    directory = str(tmp_path)
+    reaper = FileReaper(ttl_seconds={directory: 3600}, quotas={}, batch_size=10, interval=1)
+    
+    mine = tmp_path / "mine.jpg"
+    mine.write_bytes(b"x")
+    reaper.track(str(mine), size=1)
+    expiry = reaper._files[str(mine)].expiry
+    
+    theirs = tmp_path / "theirs.jpg"
+    theirs.write_bytes(b"x" * 5)
+    os.utime(theirs, (time.time() - 60, time.time() - 60))
+    
+    assert reaper.recover() == 1
+    assert reaper._files[str(mine)].expiry == expiry
+    assert reaper._files[str(theirs)].created < time.time() - 30
+    
+    theirs.unlink()
+    assert reaper.recover() == 0
+    assert reaper.stats()["directory_bytes"][directory] == 1
+
+
+def test_one_reaper_per_lock_file(tmp_path):
+    """Test a second process stands by until the active reaper stops, then takes over"""
+    directory = tmp_path / "uploads"
+    directory.mkdir()
+    lock_file = str(tmp_path / "reaper.lock")
+    leftover = directory / "leftover.jpg"
+    leftover.write_bytes(b"x")
+    
+    async def scenario():
+        active = FileReaper(ttl_seconds={str(directory): 3600}, quotas={}, interval=0.01, lock_file=lock_file)
+        standby = FileReaper(ttl_seconds={str(directory): 3600}, quotas={}, interval=0.01, lock_file=lock_file)
+        
+        active.start()
+        standby.start()
+        assert active.stats()["role"] == "active"
+        assert standby.stats()["role"] == "standby"
+        assert active.stats()["tracked_files"] == 1
+        
+        # The standby tracks nothing, so it can't count or delete files twice
+        standby.track(str(leftover), size=1)
+        assert standby.stats()["tracked_files"] == 0
+        
+        await active.stop()
+        await asyncio.sleep(0.1)
+        assert standby.stats()["role"] == "active"
+        assert standby.stats()["tracked_files"] == 1
+        await standby.stop()
+    
+    asyncio.run(scenario())
@@ -0,0 +1,77 @@
+"""
+Tests for image decoding backends
+"""
+
+import io
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+from prometheus_client import REGISTRY
+
+from app.config import settings
+from app.services import image_decoder
+from app.services.image_decoder import decode_image
+
+
+@pytest.fixture
+def backends(monkeypatch):
+    """Select decoder backends for one test"""
+    def use(*names):
+        monkeypatch.setattr(settings, "DECODER_BACKENDS", list(names))
+        image_decoder.available_backends.cache_clear()
+    
+    yield use
+    image_decoder.available_backends.cache_clear()
+
+
+def encode(image: np.ndarray, image_format: str, orientation: int = 1) -> bytes:
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    buffer = io.BytesIO()
+    Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)).save(buffer, image_format, exif=exif.tobytes(), quality=95)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("backend", ["opencv", "pillow"])
+def test_backends_agree_on_orientation(backends, backend):
+    """Test every backend returns the same upright pixels for all EXIF orientations"""
+    backends(backend)
+    image = cv2.GaussianBlur(np.random.default_rng(0).integers(0, 255, (60, 90, 3), dtype=np.uint8), (0, 0), 3)
+    
+    for orientation in range(1, 9):
+        data = encode(image, "JPEG", orientation)
+        expected = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        decoded = decode_image(data)
+        
+        assert decoded.backend == backend
+        assert np.array_equal(decoded.image, expected), orientation
+        assert decoded.full_size == (expected.shape[1], expected.shape[0])
+
+
+def test_reduced_decode_and_fallback(backends, monkeypatch):
+    """Test reduced decodes stay above the requested size and failing backends fall through"""
+    backends("turbojpeg", "opencv", "pillow")
+    data = encode(np.zeros((1500, 2000, 3), np.uint8), "JPEG", orientation=6)
+    
+    preview = decode_image(data, min_edge=640)
+    assert preview.image.shape[:2] == (1000, 750)
+    assert preview.full_size == (1500, 2000)
+    assert preview.scale == 2
+    assert decode_image(data, min_size=(300, 300)).image.shape[:2] == (500, 375)
+    
+    def fail(self, data, factor):
+        raise RuntimeError("corrupt")
+    
+    monkeypatch.setattr(image_decoder.OpenCVBackend, "decode", fail)
+    before = REGISTRY.get_sample_value("geomask_decodes_total", {"backend": "pillow", "format": "jpeg"}) or 0
+    assert decode_image(data).backend == "pillow"
+    assert REGISTRY.get_sample_value("geomask_decodes_total", {"backend": "pillow", "format": "jpeg"}) == before + 1
+    
+    gif = io.BytesIO()
+    Image.new("RGB", (40, 30), (10, 20, 30)).save(gif, "GIF")
+    assert decode_image(gif.getvalue()).backend == "pillow"
+    
+    with pytest.raises(ValueError):
+        decode_image(b"not an image")
@@ -0,0 +1,80 @@
+"""
+Tests for the logging pipeline
+"""
+
+import json
+import logging
+import queue
+from logging.handlers import QueueListener
+
+from app.utils.logger import SAMPLED, DroppingQueueHandler, JsonFormatter, SamplingFilter
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+    
+    def emit(self, record):
+        self.records.append(record)
+
+
+def make_logger(name: str, log_queue: queue.Queue, rate: float = 1.0) -> logging.Logger:
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(rate))
+    logger = logging.getLogger(name)
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    return logger
+
+
+def test_records_reach_sinks_through_listener():
+    """Test log calls are delivered by the listener thread, not the caller"""
+    log_queue = queue.Queue()
+    sink = ListHandler()
+    listener = QueueListener(log_queue, sink, respect_handler_level=True)
+    logger = make_logger("test.queue", log_queue)
+    
+    listener.start()
+    logger.info("first")
+    logger.error("second")
+    listener.stop()
+    
+    assert [record.getMessage() for record in sink.records] == ["first", "second"]
+
+
+def test_sampling_keeps_warnings_and_unmarked_lines():
+    """Test only INFO lines marked as sampled are thinned out"""
+    log_queue = queue.Queue()
+    logger = make_logger("test.sampling", log_queue, rate=0.0)
+    
+    logger.info("per image", extra=SAMPLED)
+    logger.warning("per image problem", extra=SAMPLED)
+    logger.info("startup")
+    
+    messages = [log_queue.get_nowait().getMessage() for _ in range(log_queue.qsize())]
+    assert messages == ["per image problem", "startup"]
+
+
+def test_full_queue_drops_instead_of_blocking():
+    """Test a full queue drops records and counts them"""
+    log_queue = queue.Queue(maxsize=2)
+    logger = make_logger("test.dropping", log_queue)
+    
+    for i in range(5):
+        logger.info(f"line {i}")
+    
+    assert log_queue.qsize() == 2
+    assert logger.handlers[0].dropped == 3
+
+
+def test_json_formatter():
+    """Test JSON output is one parseable object per record"""
+    record = logging.LogRecord("app.main", logging.INFO, "main.py", 10, "File uploaded: %s", ("a.jpg",), None)
+    
+    entry = json.loads(JsonFormatter().format(record))
+    
+    assert entry["message"] == "File uploaded: a.jpg"
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "app.main"
@@ -59,4 +59,510 @@ def test_cleanup_endpoint():
     response = client.delete("/api/cleanup")
     assert response.status_code == 200
     data = response.json()
-    assert "message" in data 
\ No newline at end of file
+    assert "message" in data 
+
+def test_variant_chain_skips_upscaling():
+    """Test responsive variants are downscaled from each other"""
+    import numpy as np
+    from app.services.image_processor import ImageProcessor
+    
+    image = np.zeros((900, 1600, 3), dtype=np.uint8)
+    chain = ImageProcessor()._build_variant_chain(image, [2048, 1080, 640])
+    
+    assert [size for size, _ in chain] == [1080, 640]
+    assert chain[0][1].shape[:2] == (608, 1080)
+    assert chain[1][1].shape[:2] == (360, 640)
+
+
+def test_harmonize_matches_window_lighting(monkeypatch):
+    """Test decoys take on the window's exposure and colour cast through a lookup table"""
+    import numpy as np
+    from app.config import settings
+    from app.services.image_processor import ImageProcessor
+    
+    rng = np.random.default_rng(0)
+    window = (rng.normal((60, 80, 110), 10, (400, 300, 3))).clip(0, 255).astype(np.uint8)
+    decoy = (rng.normal((200, 200, 200), 30, (400, 300, 3))).clip(0, 255).astype(np.uint8)
+    processor = ImageProcessor()
+    
+    harmonized = processor._harmonize(window, decoy)
+    before = np.abs(decoy.mean(axis=(0, 1)) - window.mean(axis=(0, 1)))
+    after = np.abs(harmonized.mean(axis=(0, 1)) - window.mean(axis=(0, 1)))
+    assert (after < before * 0.4).all()
+    # Detail is kept: a monotonic per-channel mapping
+    assert np.corrcoef(decoy[..., 0].ravel(), harmonized[..., 0].ravel())[0, 1] > 0.99
+    
+    monkeypatch.setattr(settings, "HARMONIZE_STRENGTH", 0)
+    assert processor._harmonize(window, decoy) is decoy
+
+
+def test_detection_drops_low_confidence_candidates():
+    """Test window candidates are scored and weak ones never reach blending"""
+    import cv2
+    import numpy as np
+    from app.services.image_processor import ImageProcessor
+    from benchmarks.synthetic import make_photo
+    
+    processor = ImageProcessor()
+    candidates = processor._detect_window_candidates(make_photo(1280, 960))
+    assert len(candidates) == 3 and all(score >= 0.7 for _, score in candidates)
+    
+    # Round blobs pass the area and aspect filters but don't look like windows
+    blobs = np.full((960, 1280, 3), 90, np.uint8)
+    cv2.circle(blobs, (400, 400), 200, (200, 200, 200), -1)
+    cv2.circle(blobs, (900, 500), 150, (30, 30, 30), -1)
+    assert len(processor._detect_window_candidates(blobs)) == 2
+    assert processor._detect_windows(blobs) == []
+
+
+def test_process_without_windows_returns_stripped_original(monkeypatch):
+    """Test images without confident windows skip generation and lose their metadata"""
+    import io
+    import cv2
+    import numpy as np
+    from PIL import Image
+    from app.config import settings
+    
+    monkeypatch.setattr(settings, "RATE_LIMIT_PER_MINUTE", 0)
+    services = app.state.services
+    calls = []
+    
+    async def generate_image(*args, **kwargs):
+        calls.append(args)
+        raise AssertionError("No background should be generated")
+    
+    monkeypatch.setattr(services.image_processor.ai_generator, "generate_image", generate_image)
+    
+    exif = Image.Exif()
+    exif[0x010F] = "PhoneMaker"
+    exif[0x8825] = {2: (48.0, 51.0, 30.0)}
+    pixels = np.random.default_rng(0).integers(0, 255, (120, 160, 3), dtype=np.uint8)
+    upload = io.BytesIO()
+    Image.fromarray(pixels).save(upload, "JPEG", exif=exif.tobytes(), quality=90)
+    
+    response = client.post(
+        "/api/process",
+        files={"file": ("photo.jpg", upload.getvalue(), "image/jpeg")},
+        data={"scene_type": "city"}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["windows"] == 0
+    assert data["confirmation_required"] is False
+    assert calls == []
+    
+    download = client.get(data["download_url"]).content
+    assert b"Exif" not in download and b"PhoneMaker" not in download
+    original = cv2.imdecode(np.frombuffer(upload.getvalue(), np.uint8), cv2.IMREAD_COLOR)
+    assert np.array_equal(cv2.imdecode(np.frombuffer(download, np.uint8), cv2.IMREAD_COLOR), original)
+    
+    asked = client.post(
+        "/api/process",
+        files={"file": ("photo.jpg", upload.getvalue(), "image/jpeg")},
+        data={"scene_type": "city", "no_windows": "ask"}
+    )
+    assert asked.json()["confirmation_required"] is True
+    assert "no_windows=full" in asked.json()["message"]
+    
+    invalid = client.post(
+        "/api/process",
+        files={"file": ("photo.jpg", upload.getvalue(), "image/jpeg")},
+        data={"no_windows": "sometimes"}
+    )
+    assert invalid.status_code == 422
+
+
+def test_strip_metadata_keeps_colour_profile():
+    """Test metadata segments and chunks are removed without touching the pixels"""
+    import io
+    from PIL import Image
+    from PIL.PngImagePlugin import PngInfo
+    from app.utils.file_utils import strip_metadata
+    
+    image = Image.new("RGB", (32, 16), (200, 120, 40))
+    icc = b"\x00" * 128
+    
+    jpeg = io.BytesIO()
+    image.save(jpeg, "JPEG", exif=b"Exif\x00\x00MM\x00*", icc_profile=icc, comment=b"secret")
+    stripped = strip_metadata(jpeg.getvalue())
+    assert b"Exif" not in stripped and b"secret" not in stripped
+    assert b"ICC_PROFILE" in stripped
+    assert Image.open(io.BytesIO(stripped)).tobytes() == Image.open(jpeg).tobytes()
+    
+    png = io.BytesIO()
+    info = PngInfo()
+    info.add_text("Location", "48.85,2.35")
+    image.save(png, "PNG", pnginfo=info)
+    stripped = strip_metadata(png.getvalue())
+    assert b"Location" not in stripped
+    assert Image.open(io.BytesIO(stripped)).tobytes() == image.tobytes()
+    
+    assert strip_metadata(b"GIF89a") is None
+
+
+def test_download_etag_and_range():
+    """Test conditional and partial downloads of processed images"""
+    from pathlib import Path
+    from app.config import settings
+    from app.utils.file_index import processed_index
+    
+    path = Path(settings.PROCESSED_DIR) / "test_download.jpg"
+    path.write_bytes(b"0123456789")
+    processed_index.register(str(path))
+    
+    try:
+        response = client.get("/api/download/test_download.jpg")
+        assert response.status_code == 200
+        assert response.content == b"0123456789"
+        etag = response.headers["etag"]
+        assert "cache-control" in response.headers
+        
+        response = client.get("/api/download/test_download.jpg", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+        assert "content-length" not in response.headers
+        assert "content-type" not in response.headers
+        
+        # Files not yet in the index are picked up lazily
+        processed_index.remove(path.name)
+        response = client.get("/api/download/test_download.jpg", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        
+        response = client.get("/api/download/test_download.jpg", headers={"Range": "bytes=2-5"})
+        assert response.status_code == 206
+        assert response.content == b"2345"
+        assert response.headers["content-range"] == "bytes 2-5/10"
+        
+        response = client.get("/api/download/test_download.jpg", headers={"Range": "bytes=20-"})
+        assert response.status_code == 416
+        assert response.headers["content-range"] == "bytes */10"
+        assert "content-type" not in response.headers
+    finally:
+        path.unlink()
+        processed_index.remove(path.name)
+
+
+def test_process_with_variants_returns_downloadable_urls(monkeypatch):
+    """Test /api/process with variants=true links to downloadable variants"""
+    import cv2
+    import numpy as np
+    from app.config import settings
+    
+    monkeypatch.setattr(settings, "VARIANT_SIZES", [200, 100])
+    
+    image = np.full((150, 240, 3), 90, dtype=np.uint8)
+    cv2.rectangle(image, (40, 30), (200, 120), (255, 255, 255), 3)
+    _, buffer = cv2.imencode(".jpg", image)
+    
+    response = client.post(
+        "/api/process",
+        files={"file": ("photo.jpg", buffer.tobytes(), "image/jpeg")},
+        data={"scene_type": "city", "variants": "true"}
+    )
+    assert response.status_code == 200
+    variants = response.json()["variants"]
+    assert set(variants) == {"200", "100"}
+    
+    for size, url in variants.items():
+        download = client.get(url)
+        assert download.status_code == 200
+        decoded = cv2.imdecode(np.frombuffer(download.content, np.uint8), cv2.IMREAD_COLOR)
+        assert max(decoded.shape[:2]) == int(size)
+
+
+def test_process_timings_and_metrics():
+    """Test per-stage timings are returned on request and exported on /metrics"""
+    import cv2
+    import numpy as np
+    
+    image = np.full((120, 160, 3), 90, dtype=np.uint8)
+    _, buffer = cv2.imencode(".jpg", image)
+    
+    response = client.post(
+        "/api/process",
+        files={"file": ("photo.jpg", buffer.tobytes(), "image/jpeg")},
+        data={"scene_type": "city", "include_timings": "true", "no_windows": "full"}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["processing_time"] > 0
+    assert {"upload", "decode", "detect", "generate", "blend", "encode", "save"} <= set(data["timings"])
+    
+    metrics = client.get("/metrics")
+    assert metrics.status_code == 200
+    assert 'geomask_stage_seconds_bucket{le="0.005",stage="detect"}' in metrics.text
+    assert "geomask_jobs_waiting" in metrics.text
+
+
+def test_process_past_deadline_returns_504(monkeypatch):
+    """Test a request whose deadline passes stops processing with 504 and a failed job"""
+    import cv2
+    import numpy as np
+    from app.config import settings
+    
+    monkeypatch.setattr(settings, "RATE_LIMIT_PER_MINUTE", 0)
+    _, buffer = cv2.imencode(".jpg", np.full((120, 160, 3), 90, dtype=np.uint8))
+    
+    response = client.post(
+        "/api/process",
+        files={"file": ("photo.jpg", buffer.tobytes(), "image/jpeg")},
+        data={"no_windows": "full", "timeout": "0.000001"}
+    )
+    assert response.status_code == 504
+    assert client.get(f"/api/jobs/{response.headers['x-job-id']}").json()["status"] == "failed"
+    
+    preview = client.post(
+        "/api/process",
+        files={"file": ("photo.jpg", buffer.tobytes(), "image/jpeg")},
+        data={"no_windows": "full", "timeout": "0.000001", "preview": "true"}
+    )
+    assert preview.status_code == 504
+    assert 'geomask_cancellations_total{reason="deadline"}' in client.get("/metrics").text
+
+
+def test_process_reports_quality_tier(monkeypatch):
+    """Test the minimal tier caps the resolution and is reported in the response"""
+    import cv2
+    import numpy as np
+    from app.config import settings
+    
+    monkeypatch.setattr(settings, "RATE_LIMIT_PER_MINUTE", 0)
+    monkeypatch.setattr(settings, "QUALITY_TIER", "minimal")
+    monkeypatch.setattr(settings, "QUALITY_MINIMAL_MAX_EDGE", 80)
+    _, buffer = cv2.imencode(".jpg", np.full((120, 160, 3), 90, dtype=np.uint8))
+    
+    response = client.post(
+        "/api/process",
+        files={"file": ("photo.jpg", buffer.tobytes(), "image/jpeg")},
+        data={"no_windows": "full"}
+    )
+    assert response.status_code == 200
+    assert response.json()["quality_tier"] == "minimal"
+    
+    output = client.get(response.json()["download_url"])
+    image = cv2.imdecode(np.frombuffer(output.content, np.uint8), cv2.IMREAD_COLOR)
+    assert image.shape[:2] == (60, 80)
+    assert 'geomask_quality_tier_total{tier="minimal"}' in client.get("/metrics").text
+
+
+def test_ready_after_warm_up(monkeypatch):
+    """Test /ready answers 503 until startup warm-up has finished"""
+    import time
+    
+    monkeypatch.setattr(app.state.services, "ready", False)
+    assert client.get("/ready").status_code == 503
+    
+    with TestClient(app) as started:
+        deadline = time.monotonic() + 30
+        response = started.get("/ready")
+        while response.status_code != 200 and time.monotonic() < deadline:
+            time.sleep(0.05)
+            response = started.get("/ready")
+    
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"
+
+
+def test_import_does_not_load_heavy_modules():
+    """Test provider SDKs and OpenCV are only imported when first needed"""
+    import subprocess
+    import sys
+    
+    code = "import sys, app.main; print(','.join(m for m in ('openai', 'cv2', 'magic') if m in sys.modules))"
+    completed = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    
+    assert completed.stdout.strip() == ""
+
+
+def test_job_status_after_processing():
+    """Test a processed job can be looked up by the ID the server assigned it"""
+    import cv2
+    import numpy as np
+    
+    image = np.full((120, 160, 3), 90, dtype=np.uint8)
+    _, buffer = cv2.imencode(".jpg", image)
+    
+    response = client.post(
+        "/api/process",
+        files={"file": ("photo.jpg", buffer.tobytes(), "image/jpeg")},
+        data={"scene_type": "city", "job_id": "test-job-0001"}
+    )
+    assert response.status_code == 200
+    # Clients can't choose the ID, so they can't overwrite another client's job
+    job_id = response.json()["job_id"]
+    assert job_id != "test-job-0001"
+    
+    job = client.get(f"/api/jobs/{job_id}")
+    assert job.status_code == 200
+    assert job.json()["status"] == "completed"
+    assert job.json()["result"]["download_url"] == response.json()["download_url"]
+    
+    assert client.get("/api/jobs/unknown-job-id").status_code == 404
+
+
+def test_upload_validation_rejects_early(monkeypatch, tmp_path):
+    """Test non-image and oversized uploads are refused and leave no file behind"""
+    from app.config import settings
+    
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "MAX_FILE_SIZE", 1024)
+    monkeypatch.setattr(settings, "RATE_LIMIT_PER_MINUTE", 0)
+    
+    not_image = client.post(
+        "/api/process",
+        files={"file": ("photo.jpg", b"<html>" + b"x" * 100, "image/jpeg")}
+    )
+    assert not_image.status_code == 400
+    
+    # Small enough for the body guard, too large for the file limit
+    too_large = client.post(
+        "/api/process",
+        files={"file": ("photo.jpg", b"\xff\xd8\xff" + b"\0" * 2048, "image/jpeg")}
+    )
+    assert too_large.status_code == 413
+    assert client.get(f"/api/jobs/{too_large.headers['x-job-id']}").json()["status"] == "failed"
+    
+    # Refused on Content-Length before the body is parsed
+    huge = client.post(
+        "/api/process",
+        files={"file": ("photo.jpg", b"\xff\xd8\xff" + b"\0" * 200 * 1024, "image/jpeg")}
+    )
+    assert huge.status_code == 413
+    
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_non_image_upload_is_refused_after_first_chunk():
+    """Test the file part's signature is checked before the rest of the body is read"""
+    import asyncio
+    from starlette.exceptions import HTTPException
+    from app.utils.file_utils import UploadGuardMiddleware
+    
+    boundary = "geomask-test"
+    head = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="scene_type"\r\n\r\ncity\r\n'
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="photo.jpg"\r\n'
+        f'Content-Type: image/jpeg\r\n\r\n<html>'
+    ).encode()
+    chunks = [head[:40], head[40:], b"x" * 4096, b"x" * 4096]
+    read = []
+    
+    async def receive():
+        read.append(chunks[len(read)])
+        return {"type": "http.request", "body": read[-1], "more_body": len(read) < len(chunks)}
+    
+    async def spool_body(scope, receive, send):
+        while (await receive()).get("more_body"):
+            pass
+    
+    scope = {
+        "type": "http", "method": "POST", "path": "/api/process",
+        "headers": [(b"content-type", f"multipart/form-data; boundary={boundary}".encode())]
+    }
+    with pytest.raises(HTTPException) as rejected:
+        asyncio.run(UploadGuardMiddleware(spool_body)(scope, receive, None))
+    
+    assert rejected.value.status_code == 400
+    assert len(read) == 3
+    
+    # An image streams through untouched
+    chunks[1] = chunks[1].replace(b"<html>", b"\xff\xd8\xff\xe0" + b"\0" * 12)
+    read.clear()
+    asyncio.run(UploadGuardMiddleware(spool_body)(scope, receive, None))
+    assert len(read) == len(chunks)
+
+
+def test_process_video_upload(monkeypatch, tmp_path):
+    """Test a short video passes upload validation and comes back as MP4"""
+    from app.config import settings
+    from benchmarks.synthetic import write_clip
+    
+    monkeypatch.setattr(settings, "RATE_LIMIT_PER_MINUTE", 0)
+    clip = write_clip(tmp_path, "clip", 160, 120, frames=4, suffix=".mp4")
+    
+    response = client.post(
+        "/api/process",
+        files={"file": ("clip.mp4", clip.read_bytes(), "video/mp4")},
+        data={"scene_type": "city"}
+    )
+    assert response.status_code == 200
+    assert response.json()["processed_file"].endswith(".mp4")
+    
+    download = client.get(response.json()["download_url"])
+    assert download.headers["content-type"] == "video/mp4"
+    
+    mislabelled = client.post(
+        "/api/process",
+        files={"file": ("clip.jpg", clip.read_bytes(), "image/jpeg")}
+    )
+    assert mislabelled.status_code == 400
+
+
+def test_preview_then_render(monkeypatch):
+    """Test a preview is small and its render reuses the same background and regions"""
+    import cv2
+    import numpy as np
+    from app.config import settings
+    from benchmarks.synthetic import make_photo
+    
+    monkeypatch.setattr(settings, "RATE_LIMIT_PER_MINUTE", 0)
+    _, buffer = cv2.imencode(".jpg", make_photo(2560, 1920))
+    
+    preview = client.post(
+        "/api/process",
+        files={"file": ("photo.jpg", buffer.tobytes(), "image/jpeg")},
+        data={"scene_type": "city", "preview": "true"}
+    )
+    assert preview.status_code == 200
+    assert preview.json()["preview"] is True
+    small = cv2.imdecode(np.frombuffer(client.get(preview.json()["download_url"]).content, np.uint8), cv2.IMREAD_COLOR)
+    assert max(small.shape[:2]) == settings.PREVIEW_MAX_EDGE
+    
+    render = client.post("/api/render", data={"job_id": preview.json()["job_id"]})
+    assert render.status_code == 200
+    assert render.json()["original_file"] == "photo.jpg"
+    assert render.json()["preview"] is False
+    full = cv2.imdecode(np.frombuffer(client.get(render.json()["download_url"]).content, np.uint8), cv2.IMREAD_COLOR)
+    assert full.shape[:2] == (1920, 2560)
+    
+    # The full render matches the preview once scaled down
+    scaled = cv2.resize(full, (small.shape[1], small.shape[0]), interpolation=cv2.INTER_AREA)
+    assert np.abs(scaled.astype(int) - small.astype(int)).mean() < 6
+    
+    assert client.post("/api/render", data={"job_id": "unknown-preview"}).status_code == 404
+
+
+def test_session_lifecycle(monkeypatch):
+    """Test a session is created once and then edited, inspected and deleted cheaply"""
+    import cv2
+    from app.config import settings
+    from benchmarks.synthetic import make_photo
+    
+    monkeypatch.setattr(settings, "RATE_LIMIT_PER_MINUTE", 0)
+    _, buffer = cv2.imencode(".jpg", make_photo(1280, 960))
+    
+    created = client.post(
+        "/api/sessions",
+        files={"file": ("photo.jpg", buffer.tobytes(), "image/jpeg")},
+        data={"scene_type": "city"}
+    )
+    assert created.status_code == 200
+    session = created.json()
+    assert session["original_file"] == "photo.jpg"
+    assert session["assignments"] == [0] * len(session["regions"])
+    assert client.get(session["download_url"]).status_code == 200
+    
+    url = f"/api/sessions/{session['session_id']}"
+    edited = client.post(f"{url}/recomposite", json={"feather": 25, "blend_mode": "replace", "preview": True})
+    assert edited.status_code == 200
+    assert edited.json()["updated_regions"] == list(range(len(session["regions"])))
+    assert edited.json()["download_url"].endswith(".webp")
+    
+    assert client.post(f"{url}/recomposite", json={"background": 3}).status_code == 400
+    assert client.post(f"{url}/recomposite", json={"blend_mode": "overlay"}).status_code == 422
+    
+    state = client.get(url).json()
+    assert (state["feather"], state["blend_mode"], state["revision"]) == (25, "replace", session["revision"] + 1)
+    
+    assert client.delete(url).status_code == 200
+    assert client.get(url).status_code == 404
@@ -0,0 +1,82 @@
+"""
+Tests for the request profiler
+"""
+
+import threading
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.main import app as main_app
+from app.utils import profiling
+from app.utils.profiling import ProfileStore, ProfilingMiddleware, SamplingProfiler
+
+
+def busy_worker_stage(seconds: float):
+    """Stand-in for CPU-bound image work running in a worker thread"""
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        sum(range(1000))
+
+
+def test_sampler_sees_worker_threads():
+    """Test samples include stacks from threads other than the caller's"""
+    sampler = SamplingProfiler(interval=0.002)
+    session = sampler.start("test", "sampled")
+
+    worker = threading.Thread(target=busy_worker_stage, args=(0.2,), name="opencv worker")
+    worker.start()
+    worker.join()
+    sampler.stop(session)
+
+    assert session.samples > 0
+    worker_stacks = [stack for stack in session.stacks if stack.startswith("opencv_worker;")]
+    assert any("busy_worker_stage" in stack for stack in worker_stacks)
+    assert "busy_worker_stage" in session.render()
+
+
+def test_slow_requests_are_profiled_into_bounded_store(tmp_path, monkeypatch):
+    """Test requests over the threshold are saved and old profiles evicted"""
+    store = ProfileStore(directory=str(tmp_path), max_files=2)
+    monkeypatch.setattr(profiling, "profile_store", store)
+
+    app = FastAPI()
+
+    @app.post("/api/process")
+    def slow_process():
+        busy_worker_stage(0.15)
+        return {"ok": True}
+
+    app.add_middleware(ProfilingMiddleware, enabled=True, sample_rate=0.0, slow_seconds=0.02)
+    client = TestClient(app)
+
+    for _ in range(3):
+        assert client.post("/api/process").status_code == 200
+
+    profiles = store.list()
+    assert len(profiles) == 2
+    assert all("_slow_" in profile["name"] for profile in profiles)
+    assert "busy_worker_stage" in store.path(profiles[0]["name"]).read_text()
+
+
+def test_admin_profiles_require_token(tmp_path, monkeypatch):
+    """Test the admin endpoints are hidden without a token and check it"""
+    client = TestClient(main_app)
+    monkeypatch.setattr(profiling.profile_store, "directory", tmp_path)
+    (tmp_path / "20240101T000000_slow_31.0s_abcd1234.folded").write_text("MainThread;main.py:run 3\n")
+
+    monkeypatch.setattr(settings, "ADMIN_TOKEN", None)
+    assert client.get("/api/admin/profiles").status_code == 404
+
+    monkeypatch.setattr(settings, "ADMIN_TOKEN", "s3cret")
+    assert client.get("/api/admin/profiles", headers={"X-Admin-Token": "wrong"}).status_code == 403
+
+    response = client.get("/api/admin/profiles", headers={"X-Admin-Token": "s3cret"})
+    assert response.status_code == 200
+    name = response.json()["profiles"][0]["name"]
+
+    profile = client.get(f"/api/admin/profiles/{name}", headers={"X-Admin-Token": "s3cret"})
+    assert profile.text == "MainThread;main.py:run 3\n"
+    assert client.get("/api/admin/profiles/..%2Fsecret", headers={"X-Admin-Token": "s3cret"}).status_code == 404
@@ -0,0 +1,218 @@
+"""
+Tests for the provider gateway
+"""
+
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from app.config import settings
+from app.services.ai_generator import AIGenerator
+from app.services.provider_gateway import ProviderGateway, ProviderRateLimited
+from app.services.shared_cache import MemoryCache
+from app.utils.deadlines import Deadline, deadline_scope
+
+
+class StubProvider:
+    """Local provider that simulates latency and rate limits"""
+    
+    def __init__(self, latency: float = 0.01, rate_limit_first: int = 0):
+        self.latency = latency
+        self.rate_limit_first = rate_limit_first
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+    
+    async def generate(self, prompt: str = "") -> str:
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            if self.calls <= self.rate_limit_first:
+                raise ProviderRateLimited()
+            return f"stub_{self.calls}.jpg"
+        finally:
+            self.in_flight -= 1
+
+
+def test_identical_requests_are_coalesced():
+    """Test concurrent requests with the same key share one provider call"""
+    async def scenario():
+        gateway = ProviderGateway(max_concurrency=4, initial_backoff=0.01, max_retries=0)
+        provider = StubProvider()
+        
+        results = await asyncio.gather(*[
+            gateway.run("stub", ("city", 1024, 1024), provider.generate)
+            for _ in range(50)
+        ])
+        
+        assert provider.calls == 1
+        assert set(results) == {"stub_1.jpg"}
+        assert gateway.coalesced_total == 49
+    
+    asyncio.run(scenario())
+
+
+def test_concurrency_is_capped_per_provider():
+    """Test distinct requests never exceed the provider's in-flight limit"""
+    async def scenario():
+        gateway = ProviderGateway(max_concurrency=3, initial_backoff=0.01, max_retries=0)
+        provider = StubProvider()
+        
+        await asyncio.gather(*[
+            gateway.run("stub", ("custom", i), provider.generate)
+            for i in range(12)
+        ])
+        
+        assert provider.calls == 12
+        assert provider.max_in_flight == 3
+    
+    asyncio.run(scenario())
+
+
+def test_rate_limits_back_off_and_retry():
+    """Test a 429 opens a backoff window and the call is retried"""
+    async def scenario():
+        gateway = ProviderGateway(max_concurrency=2, initial_backoff=0.01, max_backoff=0.05, max_retries=2)
+        provider = StubProvider(rate_limit_first=2)
+        
+        result = await gateway.limited("stub", provider.generate)
+        
+        assert result == "stub_3.jpg"
+        assert gateway.stats()["providers"]["stub"]["rate_limited_total"] == 2
+        
+        # Persistent rate limiting gives up after max_retries
+        provider = StubProvider(rate_limit_first=10)
+        with pytest.raises(ProviderRateLimited):
+            await gateway.limited("stub", provider.generate)
+        assert provider.calls == 3
+    
+    asyncio.run(scenario())
+
+
+def test_generator_coalesces_same_scene():
+    """Test AIGenerator sends one provider call for a burst of identical scenes"""
+    async def scenario():
+        provider = StubProvider(latency=0.05)
+        generator = AIGenerator(gateway=ProviderGateway(max_concurrency=4, max_retries=0))
+        generator.initialized = True
+        generator.provider = "stub"
+        generator.providers = ["stub"]
+        
+        async def call_provider(name, prompt, width, height, quality):
+            return await provider.generate(prompt)
+        
+        generator._call_provider = call_provider
+        
+        paths = await asyncio.gather(*[
+            generator.generate_image(scene_type="city", width=512, height=512)
+            for _ in range(50)
+        ])
+        
+        assert provider.calls == 1
+        assert len(set(paths)) == 1
+    
+    asyncio.run(scenario())
+
+
+def test_call_is_cancelled_with_its_last_waiter():
+    """Test a shared call survives one waiter leaving and is cancelled when all have"""
+    async def scenario():
+        gateway = ProviderGateway(max_concurrency=4, max_retries=0)
+        provider = StubProvider(latency=10)
+        
+        waiters = [
+            asyncio.create_task(gateway.run("stub", ("city", 512), provider.generate))
+            for _ in range(2)
+        ]
+        await asyncio.sleep(0.01)
+        assert provider.in_flight == 1
+        
+        waiters[0].cancel()
+        await asyncio.sleep(0.01)
+        assert provider.in_flight == 1
+        assert gateway.cancelled_total == 0
+        
+        waiters[1].cancel()
+        await asyncio.sleep(0.01)
+        assert provider.in_flight == 0
+        assert gateway.stats()["cancelled_total"] == 1
+        assert gateway.stats()["pending_keys"] == 0
+    
+    asyncio.run(scenario())
+
+
+def test_generator_falls_back_within_deadline(monkeypatch):
+    """Test a provider call that would overrun the deadline is cut short with a fallback"""
+    monkeypatch.setattr(settings, "DEADLINE_RESERVE_SECONDS", 0.1)
+    monkeypatch.setattr(settings, "DEADLINE_MIN_PROVIDER_SECONDS", 0.05)
+    
+    async def scenario():
+        provider = StubProvider(latency=10)
+        generator = AIGenerator(gateway=ProviderGateway(max_concurrency=4, max_retries=0))
+        generator.initialized = True
+        generator.provider = "stub"
+        generator.providers = ["stub"]
+        
+        async def call_provider(name, prompt, width, height, quality):
+            return await provider.generate(prompt)
+        
+        generator._call_provider = call_provider
+        
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        with deadline_scope(Deadline.after(0.3)):
+            path = await generator.generate_image(scene_type="city", width=64, height=64)
+        
+        assert loop.time() - start < 1
+        assert "fallback" in path
+        assert provider.in_flight == 0
+        
+        # Too little time left to call a provider at all
+        with deadline_scope(Deadline.after(0.1)):
+            await generator.generate_image(scene_type="forest", width=64, height=64)
+        assert provider.calls == 1
+    
+    asyncio.run(scenario())
+
+
+def test_unimplemented_providers_are_not_routed_to(monkeypatch, caplog):
+    """Test providers without a client are skipped at startup, not tried per request"""
+    monkeypatch.setattr(settings, "AI_PROVIDERS", ["stability", "local"])
+    generator = AIGenerator()
+    
+    asyncio.run(generator.initialize())
+    
+    assert generator.providers == []
+    assert "stability is not implemented" in caplog.text
+    assert "local is not implemented" in caplog.text
+
+
+def test_full_generation_bypasses_background_cache(tmp_path):
+    """Test every full request gets a fresh image and cached_only reuses the latest"""
+    async def scenario():
+        calls = []
+        generator = AIGenerator(gateway=ProviderGateway(max_concurrency=4, max_retries=0), cache=MemoryCache(1 << 20))
+        generator.initialized = True
+        generator.provider = "stub"
+        generator.providers = ["stub"]
+        
+        async def call_provider(name, prompt, width, height, quality):
+            calls.append(prompt)
+            path = tmp_path / f"stub_{len(calls)}.jpg"
+            path.write_bytes(f"image {len(calls)}".encode())
+            return str(path)
+        
+        generator._call_provider = call_provider
+        
+        first = await generator.generate_image(scene_type="city", width=64, height=64)
+        second = await generator.generate_image(scene_type="city", width=64, height=64)
+        cached = await generator.generate_image(scene_type="city", width=64, height=64, cached_only=True)
+        
+        assert len(calls) == 2
+        assert first != second
+        assert Path(cached).read_bytes() == b"image 2"
+    
+    asyncio.run(scenario())
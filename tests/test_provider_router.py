@@ -0,0 +1,153 @@
+"""
+Tests for latency-aware provider routing
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from app.services.provider_router import ProviderRouter, ProviderUnavailable
+
+
+class StubProviders:
+    """Local providers with configurable latency and failures"""
+    
+    def __init__(self, latency: dict, failing: tuple = ()):
+        self.latency = latency
+        self.failing = set(failing)
+        self.calls = {name: 0 for name in latency}
+        self.cancelled = {name: 0 for name in latency}
+    
+    async def call(self, provider: str) -> str:
+        self.calls[provider] += 1
+        try:
+            await asyncio.sleep(self.latency[provider])
+        except asyncio.CancelledError:
+            self.cancelled[provider] += 1
+            raise
+        if provider in self.failing:
+            raise RuntimeError(f"{provider} is down")
+        return f"{provider}.jpg"
+
+
+def make_router(**kwargs) -> ProviderRouter:
+    options = dict(
+        window=20, failure_threshold=3, cooldown=60.0, max_error_rate=0.5,
+        hedge_min=0.01, hedge_default=1.0, attempt_timeout=2.0
+    )
+    options.update(kwargs)
+    return ProviderRouter(**options)
+
+
+def test_routes_to_fastest_provider():
+    """Test requests go to the provider with the lowest observed latency"""
+    async def scenario():
+        router = make_router(hedge_default=5.0)
+        stubs = StubProviders({"slow": 0.05, "fast": 0.005})
+        
+        # Probe both, then the router should settle on the fast one
+        await router.generate(["slow"], stubs.call)
+        await router.generate(["fast"], stubs.call)
+        
+        results = [await router.generate(["slow", "fast"], stubs.call) for _ in range(5)]
+        
+        assert results == ["fast.jpg"] * 5
+        assert router.rank(["slow", "fast"]) == ["fast", "slow"]
+    
+    asyncio.run(scenario())
+
+
+def test_hedges_when_primary_exceeds_p95():
+    """Test a second provider is raced once the first passes its p95"""
+    async def scenario():
+        router = make_router()
+        stubs = StubProviders({"primary": 0.01, "backup": 0.02})
+        
+        for _ in range(5):
+            await router.generate(["primary"], stubs.call)
+        for _ in range(5):
+            await router.generate(["backup"], stubs.call)
+        
+        # Primary suddenly stalls far beyond its usual latency
+        stubs.latency["primary"] = 1.0
+        start = time.monotonic()
+        result = await router.generate(["primary", "backup"], stubs.call)
+        elapsed = time.monotonic() - start
+        
+        assert result == "backup.jpg"
+        assert elapsed < 0.5
+        assert router.hedges_total == 1
+        # The losing call is cancelled, not left running
+        await asyncio.sleep(0)
+        assert stubs.cancelled["primary"] == 1
+    
+    asyncio.run(scenario())
+
+
+def test_circuit_opens_after_repeated_failures():
+    """Test a failing provider is skipped without waiting for it"""
+    async def scenario():
+        router = make_router(failure_threshold=2)
+        stubs = StubProviders({"dead": 0.01, "healthy": 0.01}, failing=("dead",))
+        
+        # Failures fail over to the next provider straight away
+        for _ in range(2):
+            assert await router.generate(["dead", "healthy"], stubs.call) == "healthy.jpg"
+        assert router.stats()["providers"]["dead"]["circuit"] == "open"
+        
+        await router.generate(["dead", "healthy"], stubs.call)
+        assert stubs.calls["dead"] == 2
+        
+        # With nothing healthy left the caller learns immediately
+        with pytest.raises(ProviderUnavailable):
+            await router.generate(["dead"], stubs.call)
+    
+    asyncio.run(scenario())
+
+
+def test_half_open_circuit_recovers():
+    """Test one trial call is let through after the cooldown"""
+    async def scenario():
+        router = make_router(failure_threshold=1, cooldown=0.05)
+        stubs = StubProviders({"flaky": 0.001}, failing=("flaky",))
+        
+        with pytest.raises(ProviderUnavailable):
+            await router.generate(["flaky"], stubs.call)
+        assert router.rank(["flaky"]) == []
+        
+        await asyncio.sleep(0.06)
+        stubs.failing.clear()
+        
+        assert await router.generate(["flaky"], stubs.call) == "flaky.jpg"
+        assert router.stats()["providers"]["flaky"]["circuit"] == "closed"
+    
+    asyncio.run(scenario())
+
+
+def test_error_rate_trips_circuit_and_recovers():
+    """Test an intermittently failing provider is tried again after the cooldown"""
+    async def scenario():
+        router = make_router(failure_threshold=3, cooldown=0.05, max_error_rate=0.5)
+        stubs = StubProviders({"flaky": 0.001, "healthy": 0.001})
+        
+        # Alternating failures: never 3 in a row, but a 2/3 error rate
+        for failing in (True, True, False, True, True, False):
+            stubs.failing = {"flaky"} if failing else set()
+            try:
+                await router.generate(["flaky"], stubs.call)
+            except ProviderUnavailable:
+                pass
+        
+        assert router.rank(["flaky", "healthy"]) == ["healthy"]
+        assert router.stats()["providers"]["flaky"]["circuit"] == "open"
+        
+        await asyncio.sleep(0.06)
+        stubs.failing.clear()
+        
+        assert router.rank(["flaky"]) == ["flaky"]
+        assert await router.generate(["flaky"], stubs.call) == "flaky.jpg"
+        assert router.stats()["providers"]["flaky"]["circuit"] == "closed"
+        assert "flaky" in router.rank(["flaky", "healthy"])
+    
+    asyncio.run(scenario())
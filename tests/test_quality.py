@@ -0,0 +1,103 @@
+"""
+Tests for load-adaptive quality tiers
+"""
+
+import time
+
+import numpy as np
+import pytest
+
+from app.config import settings
+from app.services.quality import QualityController
+
+
+class StubAdmission:
+    """Admission controller with a settable queue"""
+    
+    def __init__(self):
+        self.in_flight = 0
+        self.waiting = 0
+    
+    def stats(self) -> dict:
+        return {"in_flight": self.in_flight, "waiting": self.waiting, "max_concurrent": 4}
+
+
+@pytest.fixture
+def thresholds(monkeypatch):
+    monkeypatch.setattr(settings, "QUALITY_TIER", "auto")
+    monkeypatch.setattr(settings, "QUALITY_REDUCED_LOAD", 1.5)
+    monkeypatch.setattr(settings, "QUALITY_MINIMAL_LOAD", 3.0)
+    monkeypatch.setattr(settings, "QUALITY_REDUCED_LATENCY_SECONDS", 30)
+    monkeypatch.setattr(settings, "QUALITY_MINIMAL_LATENCY_SECONDS", 60)
+    monkeypatch.setattr(settings, "QUALITY_RECOVERY", 0.8)
+
+
+def test_tier_follows_load_with_hysteresis(thresholds):
+    """Test the tier drops as the queue grows and climbs back only well below the thresholds"""
+    admission = StubAdmission()
+    controller = QualityController(admission)
+    
+    def tier_at(in_flight: int, waiting: int) -> str:
+        admission.in_flight, admission.waiting = in_flight, waiting
+        return controller.choose().name
+    
+    assert tier_at(4, 0) == "full"
+    assert tier_at(4, 2) == "reduced"
+    assert tier_at(4, 1) == "reduced"   # load 1.25, above 0.8 x 1.5
+    assert tier_at(4, 8) == "minimal"
+    assert tier_at(4, 6) == "minimal"   # load 2.5, above 0.8 x 3.0
+    assert tier_at(4, 4) == "reduced"
+    assert tier_at(4, 0) == "full"
+
+
+def test_tier_follows_recent_latency(thresholds):
+    """Test slow recent requests lower the tier until they age out of the window"""
+    controller = QualityController(StubAdmission())
+    
+    controller.observe(45.0, now=time.monotonic() - 120)
+    assert controller.choose().name == "full"
+    
+    controller.observe(45.0)
+    assert controller.choose().name == "reduced"
+    assert controller.stats()["latency"] == 45.0
+
+
+def test_forced_tier(thresholds, monkeypatch):
+    """Test QUALITY_TIER pins every request to one tier"""
+    monkeypatch.setattr(settings, "QUALITY_TIER", "minimal")
+    monkeypatch.setattr(settings, "QUALITY_MINIMAL_MAX_EDGE", 800)
+    
+    tier = QualityController(StubAdmission()).choose()
+    assert (tier.name, tier.background, tier.blend, tier.max_edge) == ("minimal", "procedural", "paste", 800)
+
+
+def test_edge_blend_fades_only_the_border():
+    """Test the reduced tier's blend shows the background inside and the original at the edges"""
+    from app.services.image_processor import ImageProcessor
+    
+    processor = ImageProcessor.__new__(ImageProcessor)
+    window = np.full((100, 80, 3), 200, np.uint8)
+    background = np.full((100, 80, 3), 40, np.uint8)
+    
+    blended = processor._blend_edges(window, background, band=10)
+    
+    assert (blended[10:90, 10:70] == 40).all()
+    assert blended[0, 40, 0] > 180 and blended[50, 0, 0] > 180 and blended[0, 0, 0] > 190
+    assert 40 < blended[5, 40, 0] < 200
+
+
+def test_minimal_tier_preview_background_is_not_an_error(tmp_path, caplog):
+    """Test the minimal tier's procedural preview background is produced without logging an error"""
+    import asyncio
+    import logging
+    
+    from app.services.image_processor import ImageProcessor
+    
+    processor = ImageProcessor.__new__(ImageProcessor)
+    processor.decoys = None
+    
+    with caplog.at_level(logging.ERROR):
+        data = asyncio.run(processor._generate_background_data(64, 48, "city", "", source="procedural"))
+    
+    assert data.startswith(b"\xff\xd8")
+    assert not [record for record in caplog.records if record.levelno >= logging.ERROR]
@@ -0,0 +1,103 @@
+"""
+Tests for interactive editing sessions
+"""
+
+import asyncio
+import time
+
+import cv2
+import numpy as np
+
+from app.config import settings
+from app.services.image_processor import ImageProcessor
+from app.services.sessions import EditSession, SessionStore
+from app.services.shared_cache import MemoryCache
+from benchmarks.synthetic import write_photo
+
+
+class SceneGenerator:
+    """Generates a flat background in a different colour per scene"""
+    
+    COLOURS = {"city": (90, 90, 90), "beach": (200, 160, 40)}
+    
+    def __init__(self, directory):
+        self.directory = directory
+    
+    async def generate_image(
+        self, scene_type="random", custom_prompt="", width=1024, height=1024, quality="standard", cached_only=False
+    ):
+        path = str(self.directory / f"{scene_type}_{width}x{height}.png")
+        cv2.imwrite(path, np.full((height, width, 3), self.COLOURS[scene_type], np.uint8))
+        return path
+
+
+def make_session(session_id: str, size: int) -> EditSession:
+    return EditSession(session_id, "unused.jpg", None, np.zeros((size, size, 3), np.uint8), [])
+
+
+def test_store_evicts_least_recently_used_beyond_budget():
+    """Test sessions are evicted by total bytes, oldest use first, and expire when idle"""
+    store = SessionStore(MemoryCache(max_bytes=1 << 20), max_bytes=3 * 100 * 100 * 3, ttl=60)
+    for name in ("a", "b", "c"):
+        store.put(make_session(name, 100))
+    assert store.get("a") is not None
+    
+    store.put(make_session("d", 100))
+    
+    assert store.get("b") is None
+    assert all(store.get(name) is not None for name in ("a", "c", "d"))
+    assert store.stats() == {"sessions": 3, "bytes": 3 * 30000, "max_bytes": 90000, "evicted_total": 1}
+    
+    # Too large to keep at all
+    store.put(make_session("huge", 1000))
+    assert store.get("huge") is None
+    assert store.stats()["sessions"] == 3
+    
+    store.ttl = 0
+    assert store.get("a") is None
+    assert store.stats()["bytes"] == 2 * 30000
+
+
+def test_recomposite_only_touches_affected_regions(tmp_path, monkeypatch):
+    """Test edits re-blend just the regions they affect and survive a restore on another worker"""
+    monkeypatch.setattr(settings, "PROCESSED_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "DETECTION_CACHE_TTL_SECONDS", 0)
+    cache = MemoryCache(max_bytes=64 << 20)
+    photo = write_photo(tmp_path, "photo", 1280, 960)
+    
+    async def scenario():
+        processor = ImageProcessor(ai_generator=SceneGenerator(tmp_path), cache=cache)
+        session = await processor.open_session(str(photo), "session-0001", "city")
+        assert len(session.regions) >= 2
+        await processor.add_session_background(session, "beach")
+        
+        before = session.composite.copy()
+        start = time.perf_counter()
+        updated = await processor.recomposite(session, background=1, regions=[0])
+        elapsed = time.perf_counter() - start
+        
+        assert updated == [0]
+        changed = np.argwhere(np.any(before != session.composite, axis=2))
+        x, y, w, h = session.regions[0]
+        assert changed[:, 0].min() >= y and changed[:, 0].max() < y + h
+        assert changed[:, 1].min() >= x and changed[:, 1].max() < x + w
+        assert elapsed < 1.0
+        
+        # Nothing to re-blend, so nothing changes
+        assert await processor.recomposite(session, background=1, regions=[0]) == []
+        
+        await processor.recomposite(session, feather=31, blend_mode="replace", preview=True)
+        assert session.output_path.endswith("_preview.webp")
+        
+        # Another worker restores the same composite from the shared cache
+        other = ImageProcessor(ai_generator=SceneGenerator(tmp_path), cache=cache)
+        restored = await other.get_session("session-0001")
+        assert restored is not session
+        assert restored.assignments == session.assignments
+        assert (restored.feather, restored.blend_mode) == (31, "replace")
+        assert np.array_equal(restored.composite, session.composite)
+        
+        full = cv2.imread(str(photo))
+        assert np.array_equal(restored.image, full)
+    
+    asyncio.run(scenario())
@@ -0,0 +1,82 @@
+"""
+Tests for the shared cache and job store
+"""
+
+import asyncio
+import time
+from datetime import datetime, timezone
+
+from app.services.jobs import JobStore, is_valid_job_id
+from app.services.shared_cache import MemoryCache, SQLiteCache
+
+
+def test_sqlite_cache_is_shared_between_connections(tmp_path):
+    """Test a value written by one worker's connection is read by another's"""
+    async def scenario():
+        path = str(tmp_path / "cache.sqlite3")
+        writer, reader = SQLiteCache(path, max_bytes=1 << 20), SQLiteCache(path, max_bytes=1 << 20)
+        try:
+            await writer.set("detection:abc", b"[[1, 2, 3, 4]]", ttl=60)
+            assert await reader.get("detection:abc") == b"[[1, 2, 3, 4]]"
+            
+            await writer.set("short", b"x", ttl=0.01)
+            await asyncio.sleep(0.02)
+            assert await reader.get("short") is None
+            
+            await reader.delete("detection:abc")
+            assert await writer.get("detection:abc") is None
+        finally:
+            await writer.aclose()
+            await reader.aclose()
+    
+    asyncio.run(scenario())
+
+
+def test_sqlite_cache_purges_oldest_over_budget(tmp_path):
+    """Test the oldest entries are dropped once the size budget is exceeded"""
+    async def scenario():
+        cache = SQLiteCache(str(tmp_path / "cache.sqlite3"), max_bytes=1000)
+        cache.PURGE_EVERY = 1
+        try:
+            for i in range(5):
+                await cache.set(f"key{i}", bytes(300), ttl=60)
+                time.sleep(0.001)
+            assert await cache.get("key0") is None
+            assert await cache.get("key4") is not None
+        finally:
+            await cache.aclose()
+    
+    asyncio.run(scenario())
+
+
+def test_memory_cache_evicts_least_recently_used():
+    """Test the in-process cache stays within its byte budget"""
+    async def scenario():
+        cache = MemoryCache(max_bytes=10)
+        await cache.set("a", b"12345", ttl=60)
+        await cache.set("b", b"12345", ttl=60)
+        await cache.get("a")
+        await cache.set("c", b"12345", ttl=60)
+        
+        assert await cache.get("a") == b"12345"
+        assert await cache.get("b") is None
+        assert cache.bytes == 10
+    
+    asyncio.run(scenario())
+
+
+def test_job_store_round_trip():
+    """Test job records are stored and read back"""
+    async def scenario():
+        jobs = JobStore(MemoryCache(max_bytes=1 << 20), ttl=60)
+        created_at = datetime.now(timezone.utc)
+        await jobs.update("job-00000001", "completed", created_at, progress=100.0, result={"success": True})
+        
+        record = await jobs.get("job-00000001")
+        assert record["status"] == "completed"
+        assert record["result"] == {"success": True}
+        assert await jobs.get("job-missing") is None
+    
+    asyncio.run(scenario())
+    assert is_valid_job_id("client-job_01")
+    assert not is_valid_job_id("../../etc")
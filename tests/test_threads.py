@@ -0,0 +1,89 @@
+"""
+Tests for thread budgets
+"""
+
+import os
+
+from app.config import settings
+from app.utils import threads
+from app.utils.threads import THREAD_ENV_VARS, cpu_quota, plan_threads
+
+
+def test_cpu_quota_from_cgroup_v2_and_v1(tmp_path):
+    """Test the container CPU limit is read from either cgroup version"""
+    (tmp_path / "cpu.max").write_text("250000 100000\n")
+    assert cpu_quota(str(tmp_path)) == 2.5
+    
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+    assert cpu_quota(str(tmp_path)) is None
+    
+    (tmp_path / "cpu.max").unlink()
+    (tmp_path / "cpu").mkdir()
+    (tmp_path / "cpu" / "cpu.cfs_quota_us").write_text("300000\n")
+    (tmp_path / "cpu" / "cpu.cfs_period_us").write_text("100000\n")
+    assert cpu_quota(str(tmp_path)) == 3.0
+    
+    (tmp_path / "cpu" / "cpu.cfs_quota_us").write_text("-1\n")
+    assert cpu_quota(str(tmp_path)) is None
+
+
+def test_cores_are_divided_among_workers(monkeypatch):
+    """Test each worker gets its share of the cores, and explicit settings win"""
+    monkeypatch.setattr(settings, "NATIVE_THREADS", 0)
+    monkeypatch.setattr(settings, "WORKER_THREADS", 0)
+    monkeypatch.setattr(settings, "CPU_LIMIT", 0)
+    monkeypatch.setattr(threads, "cpu_quota", lambda: 2.5)
+    
+    assert threads.available_cpus() == min(2, len(os.sched_getaffinity(0)))
+    assert plan_threads(cpus=8, workers=4) == threads.ThreadBudget(8, 4, 2, 6)
+    assert plan_threads(cpus=2, workers=8).native_threads == 1
+    
+    monkeypatch.setenv("WEB_CONCURRENCY", "3")
+    assert plan_threads(cpus=12).native_threads == 4
+    
+    monkeypatch.setattr(settings, "CPU_LIMIT", 16)
+    monkeypatch.setattr(settings, "NATIVE_THREADS", 3)
+    monkeypatch.setattr(settings, "WORKER_THREADS", 10)
+    assert plan_threads(workers=2) == threads.ThreadBudget(16, 2, 3, 10)
+
+
+def test_env_keeps_operator_settings(monkeypatch):
+    """Test BLAS/OpenMP limits are set for unset variables only"""
+    for name in THREAD_ENV_VARS:
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("OMP_NUM_THREADS", "7")
+    
+    plan_threads(cpus=4, workers=2).apply_env()
+    
+    assert os.environ["OMP_NUM_THREADS"] == "7"
+    assert os.environ["OPENBLAS_NUM_THREADS"] == "2"
+    assert os.environ["MKL_NUM_THREADS"] == "2"
+
+
+def test_processing_leaves_event_loop_free(monkeypatch, tmp_path):
+    """Test CPU stages run in the executor, so other requests are served meanwhile"""
+    import asyncio
+    import time
+    
+    from app.services.image_processor import ImageProcessor
+    from benchmarks.fakes import FakeAIGenerator
+    from benchmarks.synthetic import write_photo
+    
+    monkeypatch.setattr(settings, "PROCESSED_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "DETECTION_CACHE_TTL_SECONDS", 0)
+    processor = ImageProcessor(ai_generator=FakeAIGenerator(tmp_path))
+    photo = str(write_photo(tmp_path, "photo", 4000, 3000))
+    
+    async def scenario() -> float:
+        gaps = []
+        work = asyncio.create_task(processor.process_image(photo, "city"))
+        last = time.perf_counter()
+        while not work.done():
+            await asyncio.sleep(0.005)
+            gaps.append(time.perf_counter() - last)
+            last = time.perf_counter()
+        await work
+        return max(gaps)
+    
+    # Decoding and blending this photo on the loop blocks it for about 0.25s
+    assert asyncio.run(scenario()) < 0.1